@@ -4,5 +4,6 @@ CREATE TABLE IF NOT EXISTS `CSVColumns` (
   `column_name` varchar(16) NOT NULL,
   `column_type` varchar(10) NOT NULL,
   `not_null` varchar(5) NOT NULL,
+  `encoding` varchar(10) NOT NULL DEFAULT 'auto',
   PRIMARY KEY (`table_name`,`column_name`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci
@@ -0,0 +1,10 @@
+USE CSVCatalog;
+CREATE TABLE IF NOT EXISTS `CSVPartitions` (
+  `table_name` varchar(16) NOT NULL,
+  `column_name` varchar(16) NOT NULL,
+  `partition_type` varchar(10) NOT NULL,
+  `bounds` mediumtext NOT NULL,
+  `partitions` int NOT NULL,
+  `directory` varchar(128) DEFAULT NULL,
+  PRIMARY KEY (`table_name`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci
@@ -0,0 +1,7 @@
+USE CSVCatalog;
+CREATE TABLE IF NOT EXISTS `CSVStatistics` (
+  `table_name` varchar(16) NOT NULL,
+  `column_name` varchar(16) NOT NULL,
+  `statistics` mediumtext NOT NULL,
+  PRIMARY KEY (`table_name`,`column_name`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci
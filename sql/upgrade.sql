@@ -0,0 +1,21 @@
+USE CSVCatalog;
+-- Upgrades a catalog created by an earlier release. Run each statement once; skip those already applied.
+-- Column encodings (dictionary encoding of text columns)
+ALTER TABLE `CSVColumns` ADD COLUMN `encoding` varchar(10) NOT NULL DEFAULT 'auto';
+-- Column statistics written by analyze()
+CREATE TABLE IF NOT EXISTS `CSVStatistics` (
+  `table_name` varchar(16) NOT NULL,
+  `column_name` varchar(16) NOT NULL,
+  `statistics` mediumtext NOT NULL,
+  PRIMARY KEY (`table_name`,`column_name`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+-- Table partitioning
+CREATE TABLE IF NOT EXISTS `CSVPartitions` (
+  `table_name` varchar(16) NOT NULL,
+  `column_name` varchar(16) NOT NULL,
+  `partition_type` varchar(10) NOT NULL,
+  `bounds` mediumtext NOT NULL,
+  `partitions` int NOT NULL,
+  `directory` varchar(128) DEFAULT NULL,
+  PRIMARY KEY (`table_name`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
@@ -0,0 +1,187 @@
+"""
+asyncio facade for CSVTable.
+Loading, queries and writes run on worker threads, so they do not block the event loop. Queries go to a
+pool sized for the CPU and loading and writes, which are mostly file I/O, to a separate pool, so a burst of
+writes cannot hold up queries. CSVTable is safe to share between threads (see CSVLock), so every call reads
+or writes the one loaded table.
+
+    t = await AsyncCSVTable.open('people')
+    rows = await t.find({'nameLast': 'Aaron'})
+    async for row in t.iter({'birthCountry': 'USA'}):
+        ...
+"""
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from itertools import islice
+import CSVTable
+
+# Created on first use. Threads, not processes: workers share the loaded table instead of copying it.
+query_executor = None
+io_executor = None
+
+
+def get_query_executor():
+    global query_executor
+    if query_executor is None:
+        query_executor = ThreadPoolExecutor(max_workers=os.cpu_count() or 4, thread_name_prefix="csvdb-query")
+    return query_executor
+
+
+def get_io_executor():
+    global io_executor
+    if io_executor is None:
+        io_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="csvdb-io")
+    return io_executor
+
+
+class AsyncCSVTable:
+    """
+    Async wrapper around a CSVTable. Operators returning a table return an AsyncCSVTable.
+    Cancelling a query stops waiting for it; iterators stop at the next batch and release their snapshot.
+    Writes are shielded: once started, a cancelled insert, update or delete still completes, so the file and
+    the indexes stay consistent.
+    """
+
+    def __init__(self, table, executor=None, io_executor=None):
+        """
+        :param table: A loaded CSVTable. Use AsyncCSVTable.open() to load one without blocking.
+        :param executor: Executor for queries. Defaults to a shared thread pool.
+        :param io_executor: Executor for loading and writes. Defaults to a shared thread pool.
+        """
+        self.table = table
+        self.__executor__ = executor
+        self.__io_executor__ = io_executor
+
+    def __len__(self):
+        return len(self.table)
+
+    def __str__(self):
+        return str(self.table)
+
+    @classmethod
+    async def open(cls, t_name, executor=None, io_executor=None):
+        """
+        Loads a table and builds its indexes on a worker thread.
+        :param t_name: Table name in the catalog.
+        :return: AsyncCSVTable
+        """
+        table = await asyncio.get_running_loop().run_in_executor(io_executor or get_io_executor(),
+                                                                 CSVTable.CSVTable, t_name)
+        return cls(table, executor, io_executor)
+
+    def __wrap__(self, table):
+        return AsyncCSVTable(table, self.__executor__, self.__io_executor__)
+
+    async def __run__(self, f, *args, **kwargs):
+        return await asyncio.get_running_loop().run_in_executor(self.__executor__ or get_query_executor(),
+                                                                partial(f, *args, **kwargs))
+
+    async def __write__(self, f, *args, **kwargs):
+        future = asyncio.get_running_loop().run_in_executor(self.__io_executor__ or get_io_executor(),
+                                                            partial(f, *args, **kwargs))
+        return await asyncio.shield(future)
+
+    async def find(self, t, fields=None, limit=None, offset=None):
+        """
+        :return: Rows matching the template, as <CSVTable>.find_by_template()
+        """
+        return await self.__run__(self.table.find_by_template, t, fields, limit=limit, offset=offset)
+
+    async def find_page(self, t, fields=None, page_size=100, cursor=None):
+        return await self.__run__(self.table.find_page, t, fields, page_size=page_size, cursor=cursor)
+
+    async def __iter_batches__(self, rows, batch_size):
+        """
+        Yields rows from a lazy CSVTable iterator, fetching batch_size at a time on a worker thread and
+        returning to the event loop between batches, where cancellation takes effect.
+        """
+        future = None
+        try:
+            while True:
+                future = asyncio.get_running_loop().run_in_executor(self.__executor__ or get_query_executor(),
+                                                                    lambda: list(islice(rows, batch_size)))
+                batch = await future
+                if not batch:
+                    return
+                for row in batch:
+                    yield row
+        finally:
+            close = getattr(rows, 'close', lambda: None)  # releases the snapshot
+            if future is not None and not future.done():  # cancelled while a batch was being read
+                future.add_done_callback(lambda _: close())
+            else:
+                close()
+
+    async def iter(self, t, fields=None, limit=None, offset=None, batch_size=1000):
+        """
+        async for row in t.iter(template): lazy version of find(). The whole iteration reads one snapshot.
+        :param batch_size: Rows fetched per trip to a worker thread.
+        """
+        rows = await self.__run__(self.table.iter_by_template, t, fields, limit=limit, offset=offset)
+        async for row in self.__iter_batches__(rows, batch_size):
+            yield row
+
+    async def iter_having(self, *conds, fields=None, batch_size=1000):
+        rows = await self.__run__(self.table.iter_having, *conds, fields=fields)
+        async for row in self.__iter_batches__(rows, batch_size):
+            yield row
+
+    async def collect(self, query):
+        """
+        :param query: CSVQuery built from <AsyncCSVTable>.table.query().
+        :return: List of rows
+        """
+        return await self.__run__(query.collect)
+
+    async def having(self, *conds):
+        return self.__wrap__(await self.__run__(self.table.having, *conds))
+
+    async def order_by(self, *cols):
+        return self.__wrap__(await self.__run__(self.table.order_by, *cols))
+
+    async def join(self, right_r, on_fields, where_template=None, project_fields=None):
+        """
+        :param right_r: AsyncCSVTable or CSVTable.
+        """
+        right_r = right_r.table if isinstance(right_r, AsyncCSVTable) else right_r
+        return self.__wrap__(await self.__run__(self.table.join, right_r, on_fields,
+                                                where_template=where_template, project_fields=project_fields))
+
+    async def semi_join(self, right_r, on_fields, where_template=None):
+        right_r = right_r.table if isinstance(right_r, AsyncCSVTable) else right_r
+        return self.__wrap__(await self.__run__(self.table.semi_join, right_r, on_fields, where_template=where_template))
+
+    async def anti_join(self, right_r, on_fields, where_template=None):
+        right_r = right_r.table if isinstance(right_r, AsyncCSVTable) else right_r
+        return self.__wrap__(await self.__run__(self.table.anti_join, right_r, on_fields, where_template=where_template))
+
+    async def multi_join(self, tables, conditions, where_template=None, project_fields=None):
+        tables = [t.table if isinstance(t, AsyncCSVTable) else t for t in tables]
+        conditions = [tuple(ref.table if isinstance(ref, AsyncCSVTable) else ref for ref in condition[:2])
+                      + tuple(condition[2:]) for condition in conditions]
+        return self.__wrap__(await self.__run__(self.table.multi_join, tables, conditions,
+                                                where_template=where_template, project_fields=project_fields))
+
+    async def explain(self, t):
+        return await self.__run__(self.table.explain, t)
+
+    async def explain_join(self, right_r, on_fields, where_template=None):
+        right_r = right_r.table if isinstance(right_r, AsyncCSVTable) else right_r
+        return await self.__run__(self.table.explain_join, right_r, on_fields, where_template=where_template)
+
+    async def analyze(self, persist=True):
+        return await self.__run__(self.table.analyze, persist=persist)
+
+    async def insert(self, r):
+        return await self.__write__(self.table.insert, r)
+
+    async def update(self, t, change_values):
+        return await self.__write__(self.table.update, t, change_values)
+
+    async def delete(self, t):
+        return await self.__write__(self.table.delete, t)
+
+    async def vacuum(self):
+        return await self.__write__(self.table.vacuum)
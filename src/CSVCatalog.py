@@ -1,18 +1,30 @@
-import pymysql
 import csv
 import json
+import re
+import weakref
+import CSVExpression
+import CSVPartition
 import DataTableExceptions
 from collections import defaultdict
 
+try:
+    import pymysql
+except ImportError:  # only needed to connect to the MySQL-backed catalog
+    pymysql = None
+
 # hardcoded table names and columns
 schema = "CSVCatalog"
 table_table = "CSVTables"
 column_table = "CSVColumns"
 index_table = "CSVIndexes"
+stats_table = "CSVStatistics"
+partition_table = "CSVPartitions"
 
 table_cols = ["table_name", "file_path"]
-column_cols = ["table_name", "column_name", "column_type", "not_null"]
+column_cols = ["table_name", "column_name", "column_type", "not_null", "encoding"]
 index_cols = ["table_name", "index_name", "index_type", "columns"]
+stats_cols = ["table_name", "column_name", "statistics"]
+partition_cols = ["table_name", "column_name", "partition_type", "bounds", "partitions", "directory"]
 
 
 def append_conditions(q, t):
@@ -23,6 +35,19 @@ def append_conditions(q, t):
     return q
 
 
+def connect(**kwargs):
+    if pymysql is None:
+        raise DataTableExceptions.DataTableException(
+            code=DataTableExceptions.DataTableException.not_implemented,
+            message="pymysql is required to connect to the CSVCatalog database")
+
+    return pymysql.connect(**kwargs)
+
+
+def escape(v):
+    return str(v).replace('\\', '\\\\').replace("'", "''")
+
+
 def run_q(cnx, q, fetch=False):
     # print(q)
     cursor = cnx.cursor()
@@ -37,6 +62,48 @@ def run_q(cnx, q, fetch=False):
     return result
 
 
+__schemas__ = weakref.WeakKeyDictionary()  # connection -> {table: set of columns}, or None
+
+
+def get_schema(cnx):
+    """
+    :return: {lowercase table name: set of lowercase column names} of the catalog database, or None if the
+        connection does not report it. Read once per connection.
+    """
+    if cnx not in __schemas__:
+        q = "SELECT TABLE_NAME, COLUMN_NAME FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = DATABASE()"
+        try:
+            res = run_q(cnx, q, fetch=True)
+        except Exception:
+            res = None
+        tables = defaultdict(set)
+        for table, column in res or ():
+            tables[table.lower()].add(column.lower())
+        __schemas__[cnx] = dict(tables) or None
+    return __schemas__[cnx]
+
+
+def has_schema(cnx, table, column=None):
+    """
+    Catalogs created by an older release lack the tables and columns added since, until sql/upgrade.sql is
+    run on them. Without schema information, the current schema is assumed.
+    :return: True if the catalog database has the table, and the column if given
+    """
+    tables = get_schema(cnx)
+    if tables is None:
+        return True
+    columns = tables.get(table.lower())
+    return columns is not None and (column is None or column.lower() in columns)
+
+
+def check_schema(cnx, table, column=None):
+    if not has_schema(cnx, table, column):
+        raise DataTableExceptions.DataTableException(
+            code=DataTableExceptions.DataTableException.invalid_operation,
+            message="The catalog has no {}; run sql/upgrade.sql to upgrade it".format(
+                table if column is None else table + "." + column))
+
+
 class ColumnDefinition:
     """
     Represents a column definition in the CSV Catalog.
@@ -44,17 +111,25 @@ class ColumnDefinition:
 
     # Allowed types for a column.
     column_types = ("text", "number")
+    # How text values are stored: 'dictionary' shares one object per distinct value, 'plain' keeps every
+    # cell separate, and 'auto' uses a dictionary if the column has few distinct values.
+    encodings = ("auto", "dictionary", "plain")
 
-    def __init__(self, column_name, column_type="text", not_null=False):
+    def __init__(self, column_name, column_type="text", not_null=False, encoding="auto"):
         """
         :param column_name: Cannot be None.
         :param column_type: Must be one of valid column_types.
         :param not_null: True or False
+        :param encoding: One of encodings. Only applies to text columns.
         """
         if column_type not in ColumnDefinition.column_types:
             raise DataTableExceptions.DataTableException(
                 code=DataTableExceptions.DataTableException.invalid_column_definition,
                 message="Invalid column type for column '{}'".format(column_name))
+        if encoding not in ColumnDefinition.encodings:
+            raise DataTableExceptions.DataTableException(
+                code=DataTableExceptions.DataTableException.invalid_column_definition,
+                message="Invalid encoding for column '{}'".format(column_name))
         if not_null not in [True, False]:
             raise DataTableExceptions.DataTableException(
                 code=DataTableExceptions.DataTableException.invalid_column_definition,
@@ -63,9 +138,10 @@ class ColumnDefinition:
         self.name = column_name
         self.type = column_type
         self.not_null = not_null
+        self.encoding = encoding
 
     def __str__(self):
-        return self.name.ljust(20) + self.type.ljust(20) + str(self.not_null)
+        return self.name.ljust(20) + self.type.ljust(20) + str(self.not_null).ljust(20) + self.encoding
 
     def __eq__(self, other):
         if isinstance(other, ColumnDefinition):
@@ -78,7 +154,8 @@ class ColumnDefinition:
     def to_json(self):
         d = {column_cols[1]: self.name,
              column_cols[2]: self.type,
-             column_cols[3]: self.not_null}
+             column_cols[3]: self.not_null,
+             column_cols[4]: self.encoding}
 
         return d
 
@@ -93,11 +170,16 @@ class IndexDefinition:
         """
         :param index_name: Name for index. Must be unique name for table.
         :param index_type: Valid index type.
+        :param columns: Column names, or expressions on a column such as 'lower(nameLast)' or
+            'substr(debut, 1, 4)' for a functional index (see CSVExpression).
         """
         if index_type not in IndexDefinition.index_types:
             raise DataTableExceptions.DataTableException(
                 code=DataTableExceptions.DataTableException.invalid_column_definition,
                 message="Invalid index type for index '{}' on columns {}".format(index_name, ",".join(columns)))
+        columns = [CSVExpression.normalize(col) for col in columns]
+        for col in columns:
+            CSVExpression.parse(col)  # raises if not a valid expression
         self.name = index_name
         self.type = index_type
         self.columns = columns
@@ -113,6 +195,49 @@ class IndexDefinition:
         return d
 
 
+class PartitionDefinition:
+    """
+    Represents the partitioning of a table on one column (see CSVPartition).
+    """
+
+    def __init__(self, column_name, partition_type="RANGE", bounds=None, partitions=None, directory=None):
+        """
+        :param column_name: Partition column.
+        :param partition_type: One of CSVPartition.partition_types.
+        :param bounds: For RANGE, the ascending values at which a new partition starts.
+        :param partitions: For HASH, the number of partitions.
+        :param directory: Directory holding a CSV file per partition, <table>_p<n>.csv (see
+            CSVPartition.split_file). If None, the partitions are kept in the table's one file.
+        """
+        if partition_type not in CSVPartition.partition_types:
+            raise DataTableExceptions.DataTableException(
+                code=DataTableExceptions.DataTableException.invalid_column_definition,
+                message="Invalid partition type for partitioning on '{}'".format(column_name))
+        if partition_type == "RANGE" and (not bounds or list(bounds) != sorted(set(bounds))):
+            raise DataTableExceptions.DataTableException(
+                code=DataTableExceptions.DataTableException.invalid_column_definition,
+                message="RANGE partitioning on '{}' needs ascending bounds".format(column_name))
+        if partition_type == "HASH" and (not isinstance(partitions, int) or partitions < 1):
+            raise DataTableExceptions.DataTableException(
+                code=DataTableExceptions.DataTableException.invalid_column_definition,
+                message="HASH partitioning on '{}' needs a number of partitions".format(column_name))
+
+        self.column = column_name
+        self.type = partition_type
+        self.bounds = list(bounds) if partition_type == "RANGE" else None
+        self.partitions = len(self.bounds) + 1 if partition_type == "RANGE" else partitions
+        self.directory = directory or None
+
+    def __str__(self):
+        string = self.column.ljust(20) + self.type.ljust(20) + str(self.partitions).ljust(20)
+        string += ','.join(str(bound) for bound in self.bounds or ())
+        return string + ("\n\tDirectory: " + self.directory if self.directory else "")
+
+    def to_json(self):
+        return {'column': self.column, 'type': self.type, 'bounds': self.bounds, 'partitions': self.partitions,
+                'directory': self.directory}
+
+
 class TableDefinition:
     """
     Represents the definition of a table in the CSVCatalog.
@@ -130,10 +255,10 @@ class TableDefinition:
         if cnx:
             self.cnx = cnx
         else:
-            self.cnx = pymysql.connect(host='localhost',
-                                       user='dbuser',
-                                       password='dbuser',
-                                       db=schema)  # hardcoded defaults
+            self.cnx = connect(host='localhost',
+                               user='dbuser',
+                               password='dbuser',
+                               db=schema)  # hardcoded defaults
 
         if not t_name:
             raise DataTableExceptions.DataTableException(
@@ -156,6 +281,8 @@ class TableDefinition:
         self.csv_f = csv_f
         self.column_definitions = []
         self.index_definitions = []
+        self.statistics = {}  # column name -> statistics from CSVTable.analyze()
+        self.partition_definition = None
 
         if column_definitions:
             for column in column_definitions:
@@ -182,7 +309,7 @@ class TableDefinition:
         string += "\nPath: " + self.csv_f
         string += "\nColumns:\n"
 
-        string += "\t" + "Column".ljust(20) + "Datatype".ljust(20) + "Not Null\n"
+        string += "\t" + "Column".ljust(20) + "Datatype".ljust(20) + "Not Null".ljust(20) + "Encoding\n"
         for col in self.column_definitions:
             string += '\t' + str(col) + '\n'
 
@@ -191,6 +318,11 @@ class TableDefinition:
         for ind in self.index_definitions:
             string += '\t' + str(ind) + '\n'
 
+        if self.partition_definition:
+            string += "\nPartitioning:\n"
+            string += "\t" + "Column".ljust(20) + "Type".ljust(20) + "Partitions".ljust(20) + "Bounds\n"
+            string += '\t' + str(self.partition_definition) + '\n'
+
         return string
 
     @classmethod
@@ -206,7 +338,8 @@ class TableDefinition:
             raise DataTableExceptions.DataTableException(
                 code=DataTableExceptions.DataTableException.invalid_file,
                 message="Table '{}' does not exist in CSVCatalog".format(table_name))
-        q = "SELECT {} FROM {} WHERE {}='{}'".format(', '.join(column_cols[1:]), column_table, column_cols[0], table_name)
+        cols = column_cols if has_schema(cnx, column_table, column_cols[4]) else column_cols[:4]
+        q = "SELECT {} FROM {} WHERE {}='{}'".format(', '.join(cols[1:]), column_table, column_cols[0], table_name)
         column_res = run_q(cnx, q, fetch=True)
         q = "SELECT {} FROM {} WHERE {}='{}'".format(', '.join(index_cols[1:]), index_table, index_cols[0], table_name)
         index_res = run_q(cnx, q, fetch=True)
@@ -214,16 +347,32 @@ class TableDefinition:
         cds = []
         for col in column_res:
             not_null = True if col[2].lower() == 'true' else False
-            args = [col[0], col[1], not_null]
+            args = [col[0], col[1], not_null, (col[3] if len(col) > 3 else None) or "auto"]
             cds.append(ColumnDefinition(*args))
         ids = []
         for ind in index_res:
-            columns = list(ind[2].split(','))
+            columns = re.split(r",(?![^(]*\))", ind[2])  # commas inside expressions do not separate columns
             args = [ind[0], ind[1], columns]
             ids.append(IndexDefinition(*args))
         table_name = table_res[0][0]
         csv_f = table_res[0][1]
-        table = TableDefinition(table_name, csv_f, cds, ids, init=False)
+        table = TableDefinition(table_name, csv_f, cds, ids, cnx=cnx, init=False)
+
+        stats_res = None
+        if has_schema(cnx, stats_table):
+            q = "SELECT {} FROM {} WHERE {}='{}'".format(', '.join(stats_cols[1:]), stats_table, stats_cols[0], table_name)
+            stats_res = run_q(cnx, q, fetch=True)
+        table.set_statistics({col[0]: json.loads(col[1]) for col in stats_res or ()}, init=False)
+
+        partition_res = None
+        if has_schema(cnx, partition_table):
+            q = "SELECT {} FROM {} WHERE {}='{}'".format(', '.join(partition_cols[1:]), partition_table,
+                                                           partition_cols[0], table_name)
+            partition_res = run_q(cnx, q, fetch=True)
+        if partition_res:
+            col = partition_res[0]
+            table.set_partitioning(PartitionDefinition(col[0], col[1], json.loads(col[2]) if col[2] else None,
+                                                       col[3], col[4]), init=False)
 
         return table
 
@@ -240,10 +389,16 @@ class TableDefinition:
                     message="Cannot add column definition for column '{}' ".format(c.name) +
                             "in table {} as column already exists".format(self.t_name))
 
+        values = [self.t_name, c.name, c.type, c.not_null, c.encoding]
+        if init and not has_schema(self.cnx, column_table, column_cols[4]):
+            if c.encoding != "auto":
+                check_schema(self.cnx, column_table, column_cols[4])
+            values = values[:4]  # the default, on a catalog without encodings
+
         self.column_definitions.append(c)
         if init:
-            q = "INSERT INTO {} ({}) VALUES ('{}', '{}', '{}', '{}')".format(column_table, ', '.join(column_cols),
-                                                                             self.t_name, c.name, c.type, c.not_null)
+            q = "INSERT INTO {} ({}) VALUES ({})".format(
+                column_table, ', '.join(column_cols[:len(values)]), ", ".join("'{}'".format(v) for v in values))
             run_q(self.cnx, q)
 
     def drop_column_definition(self, c, from_catalog=True):
@@ -286,6 +441,8 @@ class TableDefinition:
 
         json_table['columns'] = columns
         json_table['indexes'] = indexes
+        json_table['statistics'] = self.statistics
+        json_table['partitioning'] = self.partition_definition.to_json() if self.partition_definition else None
 
         return json_table
 
@@ -303,7 +460,8 @@ class TableDefinition:
             self.drop_column_definition(data[column_cols[1]])
             self.add_column_definition(ColumnDefinition(data[column_cols[1]],
                                                         data[column_cols[2]],
-                                                        not_null=True))
+                                                        not_null=True,
+                                                        encoding=data[column_cols[4]]))
 
     def define_index(self, index_name, columns, kind="INDEX", init=True):
         """
@@ -322,7 +480,8 @@ class TableDefinition:
                     run_q(self.cnx, delete)
                     self.index_definitions.remove(index)
 
-        if not all(col.lower() in self.columns for col in columns):  # check columns
+        columns = [CSVExpression.normalize(col) for col in columns]
+        if not all(CSVExpression.get_column(col).lower() in self.columns for col in columns):  # check columns
             raise DataTableExceptions.DataTableException(
                 code=DataTableExceptions.DataTableException.invalid_column_definition,
                 message="Cannot create index on table {} ".format(self.t_name) +
@@ -361,6 +520,55 @@ class TableDefinition:
             q = append_conditions(q, t)
             run_q(self.cnx, q)
 
+    def set_statistics(self, statistics, init=True):
+        """
+        Replace the column statistics of the table.
+        :param statistics: Dict of column name -> statistics, as computed by CSVTable.analyze().
+        :param init: if True, replaces the statistics stored in the catalog
+        """
+        if not all(col.lower() in self.columns for col in statistics):
+            raise DataTableExceptions.DataTableException(
+                code=DataTableExceptions.DataTableException.invalid_column_definition,
+                message="Cannot set statistics on table {} ".format(self.t_name) +
+                        "as columns are invalid")
+
+        if init:
+            check_schema(self.cnx, stats_table)
+            q = "DELETE FROM {} WHERE {}='{}'".format(stats_table, stats_cols[0], self.t_name)
+            run_q(self.cnx, q)
+            for col, stats in statistics.items():
+                q = "INSERT INTO {} ({}) VALUES ('{}', '{}', '{}')".format(
+                    stats_table, ', '.join(stats_cols),
+                    self.t_name, col, escape(json.dumps(stats, default=str)))
+                run_q(self.cnx, q)
+        self.statistics = dict(statistics)
+
+    def set_partitioning(self, partition_definition, init=True):
+        """
+        Partition the table, or remove its partitioning.
+        :param partition_definition: PartitionDefinition, or None.
+        :param init: if True, replaces the partitioning stored in the catalog
+        """
+        if partition_definition and partition_definition.column.lower() not in self.columns:
+            raise DataTableExceptions.DataTableException(
+                code=DataTableExceptions.DataTableException.invalid_column_definition,
+                message="Cannot partition table {} ".format(self.t_name) +
+                        "as column {} is invalid".format(partition_definition.column))
+
+        if init and partition_definition:
+            check_schema(self.cnx, partition_table)
+        if init and has_schema(self.cnx, partition_table):  # nothing to remove from a catalog without partitions
+            q = "DELETE FROM {} WHERE {}='{}'".format(partition_table, partition_cols[0], self.t_name)
+            run_q(self.cnx, q)
+            if partition_definition:
+                d = partition_definition
+                q = "INSERT INTO {} ({}) VALUES ('{}', '{}', '{}', '{}', {}, {})".format(
+                    partition_table, ', '.join(partition_cols), self.t_name, d.column, d.type,
+                    escape(json.dumps(d.bounds)) if d.bounds else '', d.partitions,
+                    "'{}'".format(escape(d.directory)) if d.directory else "NULL")
+                run_q(self.cnx, q)
+        self.partition_definition = partition_definition
+
     def get_column_by_name(self, column_name):
         for col in self.column_definitions:
             if col.name.lower() == column_name.lower():
@@ -378,11 +586,11 @@ class CSVCatalog:
 
     def __init__(self, dbhost='localhost', dbport=None, dbname='CSVCatalog',
                  dbuser='dbuser', dbpw='dbuser', debug_mode=None):
-        self.cnx = pymysql.connect(host=dbhost,
-                                   port=dbport,
-                                   user=dbuser,
-                                   password=dbuser,
-                                   db=dbname)
+        self.cnx = connect(host=dbhost,
+                           port=dbport,
+                           user=dbuser,
+                           password=dbuser,
+                           db=dbname)
         self.table_definitions = []
 
     def __str__(self):
@@ -393,7 +601,8 @@ class CSVCatalog:
 
         return string
 
-    def create_table(self, table_name, file_name, column_definitions=None, index_definitions=None):
+    def create_table(self, table_name, file_name, column_definitions=None, index_definitions=None,
+                     partition_definition=None):
         q = "SELECT * FROM {} WHERE {}='{}'".format(table_table, table_cols[0], table_name)
         dup_check = run_q(self.cnx, q, fetch=True)
         if dup_check:
@@ -408,7 +617,9 @@ class CSVCatalog:
                                                                 table_name, file_name)
             run_q(self.cnx, q)
             table = TableDefinition(table_name, file_name,
-                                    column_definitions, index_definitions)
+                                    column_definitions, index_definitions, cnx=self.cnx)
+            if partition_definition:
+                table.set_partitioning(partition_definition)
             self.table_definitions.append(table)
         except Exception as e:
             self.drop_table(table_name)
@@ -419,6 +630,12 @@ class CSVCatalog:
     def drop_table(self, table_name):
         # delete indexes, columns, and table definition from Catalog
         # more efficient than sending one query for each column/index
+        if has_schema(self.cnx, stats_table):
+            q = "DELETE FROM {} WHERE {}='{}'".format(stats_table, stats_cols[0], table_name)
+            run_q(self.cnx, q)
+        if has_schema(self.cnx, partition_table):
+            q = "DELETE FROM {} WHERE {}='{}'".format(partition_table, partition_cols[0], table_name)
+            run_q(self.cnx, q)
         q = "DELETE FROM {} WHERE {}='{}'".format(index_table, index_cols[0], table_name)
         run_q(self.cnx, q)
         q = "DELETE FROM {} WHERE {}='{}'".format(column_table, column_cols[0], table_name)
@@ -0,0 +1,233 @@
+"""
+Client for CSVServer. Tables returned by CSVClient.table() have the query API of CSVTable and run it on
+the server, so a script does not load the table or connect to the catalog itself.
+
+    with CSVClient(path='/tmp/csvdb.sock') as client:
+        teams = client.table('teams')
+        teams.find_by_template({'teamID': 'BOS'}, fields=['yearID', 'W'])
+        for row in teams.having('yearID >= 2010').order_by('W DESC').iter_by_template({}):
+            ...
+
+having, order_by and the joins return a RemoteTable for the derived table, which is computed on the
+server by the next query on it. A client is one connection, so use one per thread. Iterators may be
+nested: sending a query reads the rest of the current stream into memory first.
+"""
+import json
+import socket
+from collections import deque
+from itertools import count
+import DataTableExceptions
+
+
+class CSVClient:
+
+    def __init__(self, path=None, host="127.0.0.1", port=None, timeout=None):
+        """
+        :param path: Unix socket of the server.
+        :param host: TCP host, used if path is None.
+        :param port: TCP port, used if path is None.
+        :param timeout: Socket timeout in seconds, or None to wait for results however long they take.
+        """
+        if path is not None:
+            self.__socket__ = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.__socket__.settimeout(timeout)
+            self.__socket__.connect(path)
+        elif port is not None:
+            self.__socket__ = socket.create_connection((host, port), timeout=timeout)
+        else:
+            raise DataTableExceptions.DataTableException(
+                code=DataTableExceptions.DataTableException.invalid_method_call,
+                message="Usage: CSVClient(path=<unix socket>) or CSVClient(host=<host>, port=<port>)")
+        self.__file__ = self.__socket__.makefile("rb")
+        self.__ids__ = count(1)
+        self.__pending__ = None  # id of the request whose response is being received
+        self.__buffers__ = {}  # request id -> responses read ahead while another request was sent
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.__file__.close()
+        self.__socket__.close()
+
+    def table(self, t_name):
+        """
+        :return: RemoteTable for a table in the server's catalog
+        """
+        return RemoteTable(self, {'table': t_name, 'chain': []})
+
+    def request(self, ref, op, args=(), kwargs=None):
+        """
+        Sends a request and yields its streamed rows. The result value is the generator's return value.
+        """
+        self.__drain__()
+        request_id = next(self.__ids__)
+        message = {'id': request_id, 'table': ref, 'op': op, 'args': list(args), 'kwargs': kwargs or {}}
+        self.__socket__.sendall(json.dumps(message, default=str, separators=(',', ':')).encode() + b"\n")
+        self.__pending__ = request_id
+        buffer = self.__buffers__[request_id] = deque()
+
+        try:
+            while True:
+                response = buffer.popleft() if buffer else self.__read__()
+                if response.get('rows') is not None:
+                    yield from response['rows']
+                if response.get('done'):
+                    if self.__pending__ == request_id:
+                        self.__pending__ = None
+                    if response.get('error') is not None:
+                        raise DataTableExceptions.DataTableException(code=response['error']['code'],
+                                                                     message=response['error']['message'])
+                    return response.get('result')
+        finally:
+            del self.__buffers__[request_id]
+
+    def call(self, ref, op, args=(), kwargs=None):
+        """
+        :return: (streamed rows, result value) of a request
+        """
+        responses = self.request(ref, op, args, kwargs)
+        rows = []
+        while True:
+            try:
+                rows.append(next(responses))
+            except StopIteration as done:
+                return rows, done.value
+
+    def __read__(self):
+        line = self.__file__.readline()
+        if not line:
+            raise DataTableExceptions.DataTableException(
+                code=DataTableExceptions.DataTableException.io_error,
+                message="Connection closed by server")
+        return json.loads(line)
+
+    def __drain__(self):
+        """
+        Reads the rest of the stream still being sent before sending another request. Its rows are buffered
+        for the iterator reading it, or skipped if that iterator was closed.
+        """
+        while self.__pending__ is not None:
+            response = self.__read__()
+            buffer = self.__buffers__.get(self.__pending__)
+            if buffer is not None:
+                buffer.append(response)
+            if response.get('done'):
+                self.__pending__ = None
+
+
+class RemoteTable:
+    """
+    A table on a CSVServer, with the query API of CSVTable.
+    """
+
+    def __init__(self, client, ref):
+        self.__client__ = client
+        self.__ref__ = ref
+
+    def __str__(self):
+        return "RemoteTable({})".format(json.dumps(self.__ref__, default=str))
+
+    def __len__(self):
+        return self.__run__("len")[1]
+
+    def __iter__(self):
+        return self.iter_by_template({})
+
+    def __run__(self, op, *args, **kwargs):
+        return self.__client__.call(self.__ref__, op, args, kwargs)
+
+    def __derive__(self, op, *args, **kwargs):
+        return RemoteTable(self.__client__, {'table': self.__ref__['table'],
+                                             'chain': self.__ref__['chain'] + [[op, list(args), kwargs]]})
+
+    @staticmethod
+    def __get_ref__(table):
+        if isinstance(table, RemoteTable):
+            return table.__ref__
+        if isinstance(table, str):
+            return {'table': table, 'chain': []}
+        raise DataTableExceptions.DataTableException(
+            code=DataTableExceptions.DataTableException.invalid_method_call,
+            message="Expected a RemoteTable or a table name, got {}".format(table))
+
+    def find_by_template(self, t, fields=None, limit=None, offset=None):
+        """
+        :return: Matching rows, or None if no row matches, as CSVTable.find_by_template()
+        """
+        return self.__run__("find_by_template", t, fields, limit=limit, offset=offset)[0] or None
+
+    def iter_by_template(self, t, fields=None, limit=None, offset=None):
+        """
+        Streams matching rows as the server sends them.
+        """
+        return self.__client__.request(self.__ref__, "iter_by_template", [t, fields],
+                                       {'limit': limit, 'offset': offset})
+
+    def iter_having(self, *conds, fields=None):
+        return self.__client__.request(self.__ref__, "iter_having", conds, {'fields': fields})
+
+    def find_page(self, t, fields=None, page_size=100, cursor=None):
+        """
+        :return: (rows, next cursor), as CSVTable.find_page()
+        """
+        rows, cursor = self.__run__("find_page", t, fields, page_size=page_size, cursor=cursor)[1]
+        return rows, cursor
+
+    def having(self, *conds):
+        return self.__derive__("having", *conds)
+
+    def order_by(self, *cols):
+        return self.__derive__("order_by", *cols)
+
+    def join(self, right_r, on_fields, where_template=None, project_fields=None):
+        """
+        :param right_r: RemoteTable or table name.
+        """
+        return self.__derive__("join", self.__get_ref__(right_r), on_fields,
+                               where_template=where_template, project_fields=project_fields)
+
+    def semi_join(self, right_r, on_fields, where_template=None):
+        return self.__derive__("semi_join", self.__get_ref__(right_r), on_fields, where_template=where_template)
+
+    def anti_join(self, right_r, on_fields, where_template=None):
+        return self.__derive__("anti_join", self.__get_ref__(right_r), on_fields, where_template=where_template)
+
+    def multi_join(self, tables, conditions, where_template=None, project_fields=None):
+        """
+        :param tables: RemoteTables or table names.
+        :param conditions: (table, table, [on fields]), with tables given as in tables, or by name.
+        """
+        refs = [self.__get_ref__(table) for table in tables]
+        conditions = [[self.__get_ref__(ref) if isinstance(ref, RemoteTable) else ref for ref in condition[:2]]
+                      + list(condition[2:]) for condition in conditions]
+        return self.__derive__("multi_join", refs, conditions,
+                               where_template=where_template, project_fields=project_fields)
+
+    def explain(self, t):
+        return self.__run__("explain", t)[1]
+
+    def explain_join(self, right_r, on_fields, where_template=None):
+        return self.__run__("explain_join", self.__get_ref__(right_r), on_fields, where_template=where_template)[1]
+
+    def analyze(self, persist=True):
+        return self.__run__("analyze", persist=persist)[1]
+
+    def insert(self, r):
+        return self.__run__("insert", r)[1]
+
+    def update(self, t, change_values):
+        return self.__run__("update", t, change_values)[1]
+
+    def delete(self, t):
+        return self.__run__("delete", t)[1]
+
+    def vacuum(self):
+        return self.__run__("vacuum")[1]
+
+    def print_all(self):
+        for row in self:
+            print(row)
@@ -0,0 +1,83 @@
+"""
+Column expressions for functional indexes and predicates, such as lower(nameLast) or substr(debut,1,4).
+An expression is <function>(<column>[,<int>...]) and is referred to by its text, without spaces, in index
+definitions, templates and having conditions. Plain column names are not expressions.
+"""
+import re
+from functools import lru_cache
+import DataTableExceptions
+
+expression_re = re.compile(r"^(\w+)\((\w+)((?:,-?\d+)*)\)$")
+
+
+def substr(value, pos, length=None):
+    # SQL positions start at 1, and negative positions count from the end
+    if pos == 0:
+        return ''
+    start = pos - 1 if pos > 0 else max(len(value) + pos, 0)
+    return value[start:] if length is None else value[start:start + max(length, 0)]
+
+
+# name -> (function on the column value as a string, result type, min int args, max int args)
+functions = {'lower': (str.lower, "text", 0, 0),
+             'upper': (str.upper, "text", 0, 0),
+             'trim': (str.strip, "text", 0, 0),
+             'length': (len, "number", 0, 0),
+             'substr': (substr, "text", 1, 2)}
+
+
+def normalize(expression):
+    return expression.replace(' ', '')
+
+
+@lru_cache(maxsize=None)
+def parse(expression):
+    """
+    :param expression: Column name or expression.
+    :return: (function name, column, int arguments), or None for a plain column name
+    """
+    if '(' not in expression:
+        return None
+
+    match = expression_re.match(normalize(expression))
+    name = match.group(1).lower() if match else None
+    args = tuple(int(arg) for arg in match.group(3).split(',')[1:]) if match else ()
+    if name not in functions or not functions[name][2] <= len(args) <= functions[name][3]:
+        raise DataTableExceptions.DataTableException(
+            code=DataTableExceptions.DataTableException.invalid_column_definition,
+            message="Invalid expression '{}'. Supported: {}".format(expression, ", ".join(
+                "{}(<column>{})".format(f, ", <int>" * functions[f][2]) for f in functions)))
+
+    return name, match.group(2), args
+
+
+def get_column(expression):
+    """
+    :return: The column an expression is computed from, or the name itself for a plain column
+    """
+    parsed = parse(expression)
+    return parsed[1] if parsed else expression
+
+
+def result_type(expression, column_types):
+    """
+    :param column_types: Dict of column name -> type, as from CSVTable.__get_column_types__().
+    :return: "number" or "text", or the column's type for a plain column
+    """
+    parsed = parse(expression)
+    return functions[parsed[0]][1] if parsed else column_types.get(expression)
+
+
+def evaluate(expression, row):
+    """
+    :return: Value of the expression on a row. NULL in, NULL out.
+    """
+    parsed = parse(expression)
+    if parsed is None:
+        return row.get(expression)
+
+    name, column, args = parsed
+    value = row.get(column)
+    if value is None:
+        return None
+    return functions[name][0](str(value), *args)
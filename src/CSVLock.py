@@ -0,0 +1,202 @@
+"""
+Concurrency for CSVTable, so one loaded table can be shared by many threads.
+Queries read a snapshot: a view of the table's current version, pinned for the duration of the call (or of
+an iterator), which writers never modify in place. Writers are serialized by the table's write mutex, and
+hold its reader-writer lock exclusively only while applying a change in memory; if the current version is
+pinned, they first switch the table to a new version, copying what they change (see CSVTable.__writing__).
+So a long join or order_by does not block writers, and sees none of their changes.
+Lazily built index structures have a lock per index, so concurrent readers build each of them once.
+"""
+import inspect
+import threading
+from functools import wraps
+import DataTableExceptions
+
+
+class RWLock:
+    """
+    Reader-writer lock: any number of readers, or one writer. A waiting writer blocks new readers, so a
+    steady stream of queries cannot starve writers. Reentrant: a thread that holds the lock may acquire it
+    again, and the writer may also read, e.g. update() calling find_by_template(). A reader cannot
+    upgrade to writing.
+    """
+
+    def __init__(self):
+        self.__mutex__ = threading.Lock()
+        self.__condition__ = threading.Condition(self.__mutex__)
+        self.__readers__ = {}  # thread id -> read depth
+        self.__writer__ = None
+        self.__write_depth__ = 0
+        self.__writers_waiting__ = 0
+
+    def acquire_read(self):
+        me = threading.get_ident()
+        with self.__mutex__:
+            readers = self.__readers__
+            if me in readers or self.__writer__ == me:
+                readers[me] = readers.get(me, 0) + 1
+                return
+            while self.__writer__ is not None or self.__writers_waiting__:
+                self.__condition__.wait()
+            readers[me] = 1
+
+    def release_read(self):
+        me = threading.get_ident()
+        with self.__mutex__:
+            readers = self.__readers__
+            depth = readers[me] - 1
+            if depth:
+                readers[me] = depth
+            else:
+                del readers[me]
+                if not readers and self.__writers_waiting__:
+                    self.__condition__.notify_all()
+
+    def acquire_write(self):
+        me = threading.get_ident()
+        with self.__mutex__:
+            if self.__writer__ == me:
+                self.__write_depth__ += 1
+                return
+            if me in self.__readers__:  # waiting for the other readers could wait for this thread
+                raise DataTableExceptions.DataTableException(
+                    code=DataTableExceptions.DataTableException.invalid_operation,
+                    message="Cannot modify a table while reading it in the same thread")
+
+            self.__writers_waiting__ += 1
+            try:
+                while self.__writer__ is not None or self.__readers__:
+                    self.__condition__.wait()
+            finally:
+                self.__writers_waiting__ -= 1
+            self.__writer__ = me
+            self.__write_depth__ = 1
+
+    def release_write(self):
+        with self.__mutex__:
+            self.__write_depth__ -= 1
+            if not self.__write_depth__:
+                self.__writer__ = None
+                self.__condition__.notify_all()
+
+
+def read_locked(method):
+    """
+    Runs a table method on a snapshot of the table.
+    """
+    @wraps(method)
+    def locked(self, *args, **kwargs):
+        if self.__snapshot_of__ is not None:  # already reading a snapshot
+            return method(self, *args, **kwargs)
+        view = self.__pin__()
+        try:
+            return method(view, *args, **kwargs)
+        finally:
+            self.__unpin__(view)
+
+    return locked
+
+
+def read_locked_with(*params):
+    """
+    Like read_locked, for methods that also read the tables passed as params, either a table or a list of
+    tables as for multi_join. Each of them is replaced by a snapshot taken at the same time.
+    """
+    def decorator(method):
+        signature = inspect.signature(method)
+
+        @wraps(method)
+        def locked(self, *args, **kwargs):
+            bound = signature.bind(self, *args, **kwargs)
+            views = {}  # id(table) -> (table, snapshot)
+
+            def pin(table):
+                if getattr(table, '__snapshot_of__', True) is not None:  # not a table, or already a snapshot
+                    return table
+                if id(table) not in views:
+                    views[id(table)] = (table, table.__pin__())
+                return views[id(table)][1]
+
+            try:
+                bound.arguments['self'] = pin(self)
+                for param in params:
+                    arg = bound.arguments.get(param)
+                    bound.arguments[param] = [pin(a) for a in arg] if isinstance(arg, (list, tuple)) else pin(arg)
+                return method(*bound.args, **bound.kwargs)
+            finally:
+                for table, view in views.values():
+                    table.__unpin__(view)
+
+        return locked
+
+    return decorator
+
+
+def read_locked_iter(method):
+    """
+    Like read_locked, for methods returning a lazy iterator. The snapshot stays pinned until the iterator
+    is exhausted, closed or garbage collected, so the whole iteration sees one version of the table.
+    """
+    @wraps(method)
+    def locked(self, *args, **kwargs):
+        if self.__snapshot_of__ is not None:
+            return method(self, *args, **kwargs)
+        view = self.__pin__()
+        try:
+            rows = method(view, *args, **kwargs)
+        except BaseException:
+            self.__unpin__(view)
+            raise
+        return SnapshotIterator(self, view, rows)
+
+    return locked
+
+
+def write_locked(method):
+    """
+    Runs a table method with the table's write mutex, so writers run one at a time. Readers are only held
+    up while the change is applied in memory, see CSVTable.__writing__.
+    """
+    @wraps(method)
+    def locked(self, *args, **kwargs):
+        if self.__snapshot_of__ is not None:
+            raise DataTableExceptions.DataTableException(
+                code=DataTableExceptions.DataTableException.invalid_operation,
+                message="Cannot modify a snapshot")
+        with self.__write_mutex__:
+            return method(self, *args, **kwargs)
+
+    return locked
+
+
+class SnapshotIterator:
+    """
+    Iterator over rows of a snapshot, which releases the snapshot once it is exhausted or closed, or when it
+    is garbage collected.
+    """
+
+    def __init__(self, table, view, rows):
+        self.__table__ = table
+        self.__view__ = view
+        self.__rows__ = iter(rows)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.__view__ is None:
+            raise StopIteration
+        try:
+            return next(self.__rows__)
+        except StopIteration:
+            self.close()
+            raise
+
+    def close(self):
+        if self.__view__ is not None:
+            view, self.__view__ = self.__view__, None
+            self.__rows__ = iter(())
+            self.__table__.__unpin__(view)
+
+    def __del__(self):
+        self.close()
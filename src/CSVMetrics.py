@@ -0,0 +1,117 @@
+import json
+import threading
+import time
+from collections import defaultdict
+import DataTableExceptions
+
+
+class MetricsRegistry:
+    """
+    Collects per-call metrics from CSVTable operators.
+    Each call produces one record (a dict) with the table, operation, wall time, rows scanned,
+    rows returned, access path and index used. Records are aggregated per (table, operation),
+    passed to any registered listeners, and appended to the slow query log when they exceed the
+    threshold. Nothing is printed unless verbose is set.
+    Metrics never fail the call they measure: a listener that raises, or a slow query log that cannot be
+    written, is counted in listener_errors or slow_query_log_errors, with the exception in last_error.
+    """
+
+    def __init__(self, verbose=False, slow_query_log=None, slow_query_threshold=1.0):
+        """
+        :param verbose: If True, print timing and progress as the engine used to.
+        :param slow_query_log: File to append slow queries to, as JSON lines. None disables the log.
+        :param slow_query_threshold: Seconds a call must take to be logged as slow.
+        """
+        self.verbose = verbose
+        self.slow_query_log = slow_query_log
+        self.slow_query_threshold = slow_query_threshold
+        self.listeners = []
+        self.__lock__ = threading.Lock()  # tables are shared between threads, and so is their registry
+        self.totals = defaultdict(lambda: {'calls': 0, 'seconds': 0.0, 'rows_scanned': 0, 'rows_returned': 0})
+        self.listener_errors = 0
+        self.slow_query_log_errors = 0
+        self.last_error = None
+
+    def add_listener(self, listener):
+        """
+        :param listener: Callable taking one metrics record.
+        """
+        if not callable(listener):
+            raise DataTableExceptions.DataTableException(
+                code=DataTableExceptions.DataTableException.invalid_method_call,
+                message="Usage: <MetricsRegistry>.add_listener(<callable>)"
+            )
+        self.listeners.append(listener)
+
+    def remove_listener(self, listener):
+        self.listeners.remove(listener)
+
+    def set_slow_query_log(self, file_name, threshold=None):
+        """
+        :param file_name: File to append slow queries to. None disables the log.
+        :param threshold: Seconds a call must take to be logged. Unchanged if None.
+        """
+        self.slow_query_log = file_name
+        if threshold is not None:
+            self.slow_query_threshold = threshold
+
+    def record(self, table, operation, seconds, rows_scanned=None, rows_returned=None,
+               access_path=None, index=None, query=None):
+        """
+        Records one operator call.
+        :param table: Table name.
+        :param operation: Operator, e.g. 'find_by_template'.
+        :param seconds: Wall time of the call.
+        :param rows_scanned: Rows examined.
+        :param rows_returned: Rows in the result.
+        :param access_path: 'index', 'scan' or 'sort', for example.
+        :param index: Name of the index used, if any.
+        :param query: Short description of the arguments, for the slow query log.
+        :return: The record
+        """
+        metrics = {'time': time.time(), 'table': table, 'operation': operation, 'seconds': seconds,
+                   'rows_scanned': rows_scanned, 'rows_returned': rows_returned,
+                   'access_path': access_path, 'index': index, 'query': query}
+
+        with self.__lock__:
+            totals = self.totals[(table, operation)]
+            totals['calls'] += 1
+            totals['seconds'] += seconds
+            totals['rows_scanned'] += rows_scanned or 0
+            totals['rows_returned'] += rows_returned or 0
+
+        for listener in list(self.listeners):
+            try:
+                listener(metrics)
+            except Exception as e:
+                self.__error__('listener_errors', e, "Metrics listener {} failed".format(listener))
+
+        slow_query_log = self.slow_query_log
+        if slow_query_log and seconds >= self.slow_query_threshold:
+            try:
+                with self.__lock__, open(slow_query_log, "a") as f:  # one whole line per record
+                    f.write(json.dumps(metrics, default=str) + '\n')
+            except Exception as e:
+                self.__error__('slow_query_log_errors', e, "Could not write to slow query log " + str(slow_query_log))
+
+        return metrics
+
+    def __error__(self, counter, e, message):
+        with self.__lock__:
+            setattr(self, counter, getattr(self, counter) + 1)
+            self.last_error = e
+        if self.verbose:
+            print("{}: {}".format(message, e))
+
+    def summary(self):
+        """
+        :return: Aggregated totals, {(table, operation): {'calls', 'seconds', 'rows_scanned', 'rows_returned'}}
+        """
+        with self.__lock__:
+            return {key: dict(totals) for key, totals in self.totals.items()}
+
+    def reset(self):
+        with self.__lock__:
+            self.totals.clear()
+            self.listener_errors = self.slow_query_log_errors = 0
+            self.last_error = None
@@ -0,0 +1,163 @@
+"""
+Intra-query parallelism for scans, having and aggregate.
+The candidate rows of a scan are split into morsels of <CSVTable>.morsel_size rows, which a pool of
+<CSVTable>.parallel_degree processes evaluates: template matching, having conditions, and partial aggregates
+(see CSVTable.aggregate). The processes are forked from the table, so they read its rows without copying or
+pickling them, and send back only the rownums of the matching rows, or the partial aggregates of their
+morsels. Results are merged in morsel order, so rows come in rownum order as in a serial scan.
+
+    CSVTable.CSVTable.parallel_degree = os.cpu_count()
+
+The pool is kept for the next query, and forked again only once a query reads another table, or a version of
+the table its processes have not seen (any write, see CSVTable.__writes__). This process keeps only a weak
+reference to the table, so a table that is dropped is freed, and the pool is retired by the next query. Forking while other threads run
+(CSVServer, CSVAsync) could leave a process holding a lock another thread held at the time, so then the pool
+is not forked, and scans that cannot use the current pool run serially.
+
+Scans of fewer than <CSVTable>.parallel_min_rows candidate rows also run serially, as they gain less than the
+processes cost. Needs the fork start method (Linux); elsewhere every scan runs serially.
+"""
+import multiprocessing
+import threading
+import weakref
+from functools import partial
+
+__pool__ = None  # the pool, or None
+__pool_threads__ = ()  # threads of the pool itself
+__table__ = None  # in the pool's processes, the table they were forked with (see __start_worker__)
+__forked__ = None  # (weak reference to the table, id of its rows, row count, write count, processes) when forked
+__lock__ = threading.Lock()
+
+
+def available():
+    """
+    :return: True if scans can run in parallel in this process
+    """
+    return "fork" in multiprocessing.get_all_start_methods() and not multiprocessing.current_process().daemon
+
+
+def __version_of__(table):
+    # The row list (a writer copies it away from a pinned snapshot), the rows loaded so far, and the writes
+    # applied, which may have changed the list in place. A snapshot is a version of the table it was taken
+    # from, so queries through the snapshots of one version share a pool.
+    rows = table.__rows__
+    return id(rows), len(rows), table.__writes__, table.parallel_degree
+
+
+def __start_worker__(table_ref):
+    # Runs in each process of the pool, which was forked while the table was alive in the parent
+    global __table__
+    __table__ = table_ref()
+
+
+def __get_pool__(table):
+    """
+    :return: A pool whose processes were forked with the rows of table, forked now if need be, or None if
+        forking is unsafe as other threads are running
+    """
+    global __pool__, __pool_threads__, __forked__
+    with __lock__:
+        base = table.__snapshot_of__ or table
+        version = __version_of__(table)
+        if __pool__ is not None and __forked__[0]() is base and version == __forked__[1:]:
+            return __pool__
+        me = threading.current_thread()
+        if any(thread is not me and thread not in __pool_threads__ for thread in threading.enumerate()):
+            return None
+        __shutdown__()
+        __forked__ = (weakref.ref(base),) + version
+        threads = set(threading.enumerate())
+        __pool__ = multiprocessing.get_context("fork").Pool(table.parallel_degree, initializer=__start_worker__,
+                                                             initargs=(weakref.ref(table),))
+        __pool_threads__ = set(threading.enumerate()) - threads
+        return __pool__
+
+
+def __shutdown__():
+    global __pool__, __pool_threads__, __forked__
+    if __pool__ is not None:
+        __pool__.terminate()  # also joins the pool's threads
+    __pool__, __pool_threads__, __forked__ = None, (), None
+
+
+def shutdown():
+    """
+    Stops the pool's processes, which hold their own copies of the rows they were forked with. The next
+    parallel scan forks a new pool.
+    """
+    with __lock__:
+        __shutdown__()
+
+
+def get_morsels(table, t=None, conditions=(), rownums=None):
+    """
+    :param rownums: Candidate rownums, e.g. from partition pruning, or None to scan the table.
+    :return: List of morsels, (start, end) rownum ranges of the rows left by the zone maps or lists of
+        candidate rownums, or None if the scan should run serially
+    """
+    degree = table.parallel_degree
+    if not degree or degree < 2 or not table.__rows__ or not available():
+        return None
+    size = table.morsel_size
+    if rownums is not None:
+        if len(rownums) < table.parallel_min_rows:
+            return None
+        rownums = list(rownums)
+        morsels = [rownums[i:i + size] for i in range(0, len(rownums), size)]
+    else:
+        ranges = table.__get_zone_ranges__(t, conditions) or [(0, len(table.__rows__))]
+        if sum(end - start for start, end in ranges) < table.parallel_min_rows:
+            return None
+        morsels = [(i, min(i + size, end)) for start, end in ranges for i in range(start, end, size)]
+    return morsels if __get_pool__(table) is not None else None
+
+
+def __morsel_rows__(table, morsel):
+    rows = table.__rows__
+    rownums = range(*morsel) if isinstance(morsel, tuple) else morsel
+    return ((rownum, rows[rownum]) for rownum in rownums)
+
+
+def __run_morsel__(job):
+    function, morsel = job
+    return function(__table__, __morsel_rows__(__table__, morsel))
+
+
+def run(table, morsels, function):
+    """
+    Evaluates function(table, (rownum, row) pairs) on each morsel in the pool's processes. function and its
+    results must be picklable, e.g. a module level function or a functools.partial of one. If the pool
+    cannot be used, e.g. another thread started since get_morsels, the morsels are evaluated here.
+    :return: Iterator over the results, in morsel order
+    """
+    pool = __get_pool__(table)
+    if pool is None:
+        return (function(table, __morsel_rows__(table, morsel)) for morsel in morsels)
+    return pool.imap(__run_morsel__, [(function, morsel) for morsel in morsels])
+
+
+def __matching__(t, conditions, table, rows):
+    value = table.__get_value__
+    return [rownum for rownum, r in rows
+            if r is not None and table.matches_template(r, t)
+            and all(value(r, c[0]) is not None and c[1](value(r, c[0]), c[2]) for c in conditions)]
+
+
+def matches(t, conditions):
+    """
+    :return: Function returning the rownums of the rows that match the template and all parsed conditions
+    """
+    return partial(__matching__, t, conditions)
+
+
+def iter_matching(table, t=None, conditions=(), rownums=None):
+    """
+    Parallel scan of the rows that match a template and parsed having conditions.
+    :param rownums: Candidate rownums, or None to scan the table.
+    :return: Iterator over the matching rows in rownum order, or None if the scan should run serially
+    """
+    morsels = get_morsels(table, t, conditions, rownums)
+    if morsels is None:
+        return None
+    rows = table.__rows__
+    return (rows[rownum] for matching in run(table, morsels, matches(t, conditions)) for rownum in matching)
@@ -0,0 +1,140 @@
+"""
+Partitioning of a table on one column, as declared in the catalog (see CSVCatalog.PartitionDefinition).
+RANGE partitioning with bounds [b0, b1, ..., bk] has k + 2 partitions: values below b0, [b0, b1), ...,
+and values from bk up. NULL goes to partition 0, as in MySQL. HASH partitioning spreads the values over a
+fixed number of partitions by a hash that is the same in every process.
+Pruning maps predicates on the partition column to the partitions that can hold matching rows.
+"""
+import csv
+import operator
+import os
+import zlib
+from bisect import bisect_left, bisect_right
+
+partition_types = ("RANGE", "HASH")
+
+
+def count(partitioning):
+    """
+    :return: Number of partitions
+    """
+    if partitioning['type'] == "RANGE":
+        return len(partitioning['bounds']) + 1
+    return partitioning['partitions']
+
+
+def hash_value(value):
+    if isinstance(value, float) and value.is_integer():  # 2019.0 from a having condition is 2019
+        value = int(value)
+    return zlib.crc32(str(value).encode())
+
+
+def partition_of(partitioning, value):
+    """
+    :return: Partition holding rows with this value in the partition column
+    """
+    if value is None:
+        return 0
+    if partitioning['type'] == "RANGE":
+        return bisect_right(partitioning['bounds'], value)
+    return hash_value(value) % partitioning['partitions']
+
+
+def partition_file(partitioning, t_name, partition):
+    """
+    :return: CSV file of a partition, for partitions stored in their own files, or None
+    """
+    if not partitioning.get('directory'):
+        return None
+    return os.path.join(partitioning['directory'], "{}_p{}.csv".format(t_name.lower(), partition))
+
+
+def prune_condition(partitioning, op, value):
+    """
+    :param op: Operator function, as in parsed having conditions.
+    :return: Set of partitions that can hold rows where (partition column op value) holds, or None for all
+    """
+    try:
+        if op is operator.eq:
+            return {partition_of(partitioning, value)}
+        if partitioning['type'] != "RANGE" or value is None:
+            return None
+        bounds = partitioning['bounds']
+        if op in (operator.gt, operator.ge):
+            return set(range(bisect_right(bounds, value), len(bounds) + 1))
+        if op is operator.lt:
+            return set(range(bisect_left(bounds, value) + 1))
+        if op is operator.le:
+            return set(range(bisect_right(bounds, value) + 1))
+    except TypeError:  # e.g. a text value compared with numeric bounds
+        return None
+    return None
+
+
+def prune(partitioning, conditions):
+    """
+    :param conditions: (column, operator function, value) conditions, all of which must hold. A list value
+        with operator.eq is an IN list.
+    :return: Sorted list of the partitions that can hold matching rows, or None if there is no pruning
+    """
+    partitions = None
+    for col, op, value in conditions:
+        if col != partitioning['column']:
+            continue
+        if op is operator.eq and isinstance(value, list):
+            matching = set()
+            for v in value:
+                matching |= prune_condition(partitioning, op, v) or set(range(count(partitioning)))
+        else:
+            matching = prune_condition(partitioning, op, value)
+        if matching is not None:
+            partitions = matching if partitions is None else partitions & matching
+    return None if partitions is None else sorted(partitions)
+
+
+def prune_template(partitioning, t):
+    """
+    :param t: Template, or a list of templates to OR.
+    :return: Sorted list of the partitions that can hold matching rows, or None if there is no pruning
+    """
+    partitions = set()
+    for sub_t in t if isinstance(t, list) else [t]:
+        matching = prune(partitioning, [(col, operator.eq, value) for col, value in sub_t.items()])
+        if matching is None:
+            return None
+        partitions.update(matching)
+    return sorted(partitions)
+
+
+def split_file(partitioning, t_name, csv_f, convert=None):
+    """
+    Writes the rows of a CSV file to one file per partition, in the partitioning's directory, keeping the
+    header and the row order. Every partition gets a file, even if it has no rows.
+    :param convert: Function converting the partition column's text, e.g. CSVTable.number for a number
+        column. Empty text is NULL.
+    :return: List of the number of rows written per partition
+    """
+    os.makedirs(partitioning['directory'], exist_ok=True)
+    with open(csv_f, "r", newline='') as csvfile:
+        reader = csv.reader(csvfile, delimiter=",", quotechar='"')
+        header = next(reader)
+        position = header.index(partitioning['column'])
+        files = [open(partition_file(partitioning, t_name, partition), "w", newline='')
+                 for partition in range(count(partitioning))]
+        try:
+            writers = [csv.writer(f, delimiter=",", quotechar='"', quoting=csv.QUOTE_ALL) for f in files]
+            for writer in writers:
+                writer.writerow(header)
+            counts = [0] * len(files)
+            for record in reader:
+                if not record:
+                    continue
+                value = record[position] if position < len(record) else ''
+                value = None if value == '' else convert(value) if convert else value
+                partition = partition_of(partitioning, value)
+                writers[partition].writerow(record)
+                counts[partition] += 1
+        finally:
+            for f in files:
+                f.close()
+    return counts
@@ -0,0 +1,173 @@
+import math
+import operator
+import re
+from bisect import bisect_left, bisect_right
+from functools import lru_cache
+
+# Relative costs of the basic operations, in units of one sequential row check during a scan.
+scan_row_cost = 1.0
+index_lookup_cost = 2.0  # hash an index key and find its bucket
+index_row_cost = 1.2  # fetch a row by rownum from a bucket, then check it
+hash_build_cost = 1.5  # add a row to a hash join table
+hash_probe_cost = 1.0  # look up a row in a hash join table
+rownum_set_cost = 0.1  # add a rownum from an index bucket to a set for index merge
+sort_row_cost = 0.2  # per row per comparison level (n log n)
+merge_row_cost = 0.5  # advance one row in a merge join
+
+histogram_buckets = 16
+
+# Selectivities assumed when a column has not been analyzed, as in MySQL.
+default_eq_selectivity = 0.1
+default_range_selectivity = 1 / 3
+
+
+@lru_cache(maxsize=256)
+def like_regex(pattern):
+    """
+    :return: Compiled regex for an SQL LIKE pattern: % matches any run of characters, _ any one character.
+    """
+    return re.compile(''.join('.*' if ch == '%' else '.' if ch == '_' else re.escape(ch) for ch in pattern),
+                      re.DOTALL)
+
+
+def like(value, pattern):
+    """
+    SQL LIKE, as an operator function for having conditions. Case sensitive, like the index keys.
+    """
+    return like_regex(pattern).fullmatch(str(value)) is not None
+
+
+def like_prefix(pattern):
+    """
+    :return: The literal text before the first wildcard of a LIKE pattern, which bounds an index range scan.
+    """
+    return re.split(r"[%_]", pattern, maxsplit=1)[0]
+
+
+def analyze_column(values, row_count, buckets=histogram_buckets):
+    """
+    Computes statistics for one column.
+    :param values: Column values of the live rows, in rownum order. None is NULL.
+    :param row_count: Number of live rows.
+    :param buckets: Number of histogram buckets.
+    :return: Dict with row_count, distinct, null_frac, min, max, sorted and histogram. The histogram is
+        equi-depth: a list of bucket upper bounds, each bucket holding about the same number of values.
+    """
+    non_null = [v for v in values if v is not None]
+    ordered = sorted(non_null)
+    n = len(ordered)
+
+    histogram = []
+    if n:
+        for b in range(1, min(buckets, n) + 1):
+            histogram.append(ordered[math.ceil(b * n / min(buckets, n)) - 1])
+
+    return {'row_count': row_count,
+            'distinct': len(set(non_null)),
+            'null_frac': (row_count - n) / row_count if row_count else 0.0,
+            'min': ordered[0] if n else None,
+            'max': ordered[-1] if n else None,
+            'sorted': ordered == non_null,  # stored in order, so usable by merge join without a sort
+            'histogram': histogram}
+
+
+def fraction_below(stats, value, inclusive):
+    """
+    Fraction of non-null values below (or at, if inclusive) value, from the equi-depth histogram.
+    """
+    histogram = stats.get('histogram')
+    if not histogram:
+        return default_range_selectivity
+    try:
+        if inclusive:
+            return bisect_right(histogram, value) / len(histogram)
+        return bisect_left(histogram, value) / len(histogram)
+    except TypeError:  # value not comparable with the column
+        return default_range_selectivity
+
+
+def selectivity(stats, op, value):
+    """
+    Estimates the fraction of rows satisfying <column> <op> <value>.
+    :param stats: Column statistics from analyze_column, or None if not analyzed.
+    :param op: Operator function, as produced by CSVTable.__parse_conditions__.
+    :param value: Comparison value.
+    :return: Fraction between 0 and 1
+    """
+    if not stats:
+        return default_eq_selectivity if op in (operator.eq,) else default_range_selectivity
+
+    not_null = 1.0 - stats.get('null_frac', 0.0)
+    distinct = max(stats.get('distinct') or 1, 1)
+    low, high = stats.get('min'), stats.get('max')
+
+    try:
+        out_of_range = low is not None and (value < low or value > high)
+    except TypeError:
+        out_of_range = False
+
+    if op is operator.eq:
+        return 0.0 if out_of_range else not_null / distinct
+    if op is operator.ne:
+        return not_null if out_of_range else not_null * (1 - 1 / distinct)
+    if op is operator.lt:
+        return not_null * fraction_below(stats, value, False)
+    if op is operator.le:
+        return not_null * fraction_below(stats, value, True)
+    if op is operator.gt:
+        return not_null * (1 - fraction_below(stats, value, True))
+    if op is operator.ge:
+        return not_null * (1 - fraction_below(stats, value, False))
+    if op is like:
+        prefix = like_prefix(value)
+        if prefix == value:  # no wildcards
+            return selectivity(stats, operator.eq, value)
+        if not prefix:
+            return default_range_selectivity
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)  # smallest string above every string with the prefix
+        fraction = fraction_below(stats, upper, False) - fraction_below(stats, prefix, False)
+        return not_null * max(fraction, 1 / distinct)
+
+    return default_range_selectivity
+
+
+def scan_cost(rows):
+    return rows * scan_row_cost
+
+
+def index_cost(probes, rows_per_probe):
+    return probes * (index_lookup_cost + rows_per_probe * index_row_cost)
+
+
+def sort_cost(rows):
+    return rows * math.log2(rows) * sort_row_cost if rows > 1 else 0.0
+
+
+def hash_join_cost(build_rows, probe_rows):
+    return build_rows * hash_build_cost + probe_rows * hash_probe_cost
+
+
+def merge_join_cost(left_rows, right_rows, left_sorted, right_sorted):
+    cost = (left_rows + right_rows) * merge_row_cost
+    if not left_sorted:
+        cost += sort_cost(left_rows)
+    if not right_sorted:
+        cost += sort_cost(right_rows)
+    return cost
+
+
+def format_plan(plan, depth=0):
+    """
+    :param plan: Plan node, a dict with 'op' and optional 'children'.
+    :return: Indented, one line per node.
+    """
+    string = "  " * depth + "-> " + plan['op']
+    details = ["{}={}".format(k, round(v, 2) if isinstance(v, float) else v)
+               for k, v in plan.items() if k not in ('op', 'children')]
+    if details:
+        string += " (" + ", ".join(details) + ")"
+    string += "\n"
+    for child in plan.get('children', []):
+        string += format_plan(child, depth + 1)
+
+    return string
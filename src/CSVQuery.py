@@ -0,0 +1,337 @@
+import copy
+import operator
+import time
+from collections import OrderedDict
+from itertools import islice
+import CSVExpression
+import CSVLock
+import CSVParallel
+import CSVPlanner
+import DataTableExceptions
+
+
+def sort_key(col):
+    # NULLs sort first, as in MySQL
+    return lambda r: (r[col] is not None, r[col])
+
+
+class CSVQuery:
+    """
+    Lazy query on a CSVTable.
+    Builder methods only record clauses. Nothing runs until collect() or iteration, at which point
+    the clauses are planned together and executed as a single pass over the chosen access path.
+    """
+
+    def __init__(self, table):
+        """
+        :param table: CSVTable to query. Use <CSVTable>.query() rather than calling this directly.
+        """
+        self.__table__ = table
+        self.__template__ = {}
+        self.__conditions__ = []
+        self.__fields__ = None
+        self.__sorts__ = []
+        self.__limit__ = None
+        self.__offset__ = None
+        self.__contradiction__ = False  # where templates that can never both match
+
+    def __str__(self):
+        string = ""
+        depth = 0
+        for node in reversed(self.__plan__()):
+            string += "  " * depth + "-> " + node['op']
+            details = ["{}={}".format(k, v) for k, v in node.items() if k != 'op']
+            if details:
+                string += " (" + ", ".join(details) + ")"
+            string += "\n"
+            depth += 1
+
+        return string
+
+    def __iter__(self):
+        view = self.__table__.__pin__()
+        return CSVLock.SnapshotIterator(self.__table__, view, self.__on__(view).__execute__())
+
+    def __on__(self, view):
+        """
+        :return: A copy of this query reading view, a snapshot of its table
+        """
+        query = copy.copy(self)
+        query.__table__ = view
+        return query
+
+    def where(self, t):
+        """
+        Adds an equality template. Templates from repeated calls are ANDed.
+        :param t: Template, {<column>: <value>, ...}
+        :return: self
+        """
+        usage = "Usage: <CSVQuery>.where({<column>: <value>, ...})"
+        if not isinstance(t, (dict, OrderedDict)):
+            raise DataTableExceptions.DataTableException(
+                code=DataTableExceptions.DataTableException.invalid_method_call,
+                message=usage
+            )
+        for col, val in t.items():
+            if not self.__table__.__is_valid_column__(col):
+                raise DataTableExceptions.DataTableException(
+                    code=DataTableExceptions.DataTableException.unknown_column,
+                    message="Unknown column '{}' in where clause\n".format(col) + usage
+                )
+            col = CSVExpression.normalize(col)
+            if col in self.__template__ and self.__template__[col] != val:
+                self.__contradiction__ = True
+            self.__template__[col] = val
+
+        return self
+
+    def having(self, *conds):
+        """
+        Adds conditions in the same format as <CSVTable>.having(). Conditions are ANDed.
+        :return: self
+        """
+        usage = "Usage: <CSVQuery>.having('<column> = <val>', 'yearID >= 2000', ...)"
+        if not all(isinstance(cond, str) for cond in conds):
+            raise DataTableExceptions.DataTableException(
+                code=DataTableExceptions.DataTableException.invalid_method_call,
+                message=usage
+            )
+        self.__conditions__.extend(self.__table__.__parse_conditions__(conds, usage))
+
+        return self
+
+    def select(self, *fields):
+        """
+        Sets the projection. Accepts column names or a single list of column names.
+        :return: self
+        """
+        usage = "Usage: <CSVQuery>.select('<column>', ...)"
+        if len(fields) == 1 and isinstance(fields[0], list):
+            fields = fields[0]
+        if not all(isinstance(field, str) for field in fields):
+            raise DataTableExceptions.DataTableException(
+                code=DataTableExceptions.DataTableException.invalid_method_call,
+                message=usage
+            )
+        for field in fields:
+            if field not in self.__table__.__get_column_names__():
+                raise DataTableExceptions.DataTableException(
+                    code=DataTableExceptions.DataTableException.unknown_column,
+                    message="Unknown column '{}' in field list\n".format(field) + usage
+                )
+        self.__fields__ = list(fields)
+
+        return self
+
+    def order_by(self, *cols):
+        """
+        Adds sort columns in the same format as <CSVTable>.order_by().
+        :return: self
+        """
+        usage = "Usage: <CSVQuery>.order_by('<column> <ASC/DESC>', ...)"
+        if not all(isinstance(col, str) for col in cols):
+            raise DataTableExceptions.DataTableException(
+                code=DataTableExceptions.DataTableException.invalid_method_call,
+                message=usage
+            )
+        self.__sorts__.extend(self.__table__.__parse_sorts__(cols, usage))
+
+        return self
+
+    def limit(self, limit, offset=None):
+        """
+        :param limit: Maximum number of rows to return.
+        :param offset: Number of rows to skip first.
+        :return: self
+        """
+        usage = "Usage: <CSVQuery>.limit(<int>, offset=<int>)"
+        if not isinstance(limit, int) or offset is not None and not isinstance(offset, int):
+            raise DataTableExceptions.DataTableException(
+                code=DataTableExceptions.DataTableException.invalid_method_call,
+                message=usage
+            )
+        self.__limit__ = limit
+        self.__offset__ = offset
+
+        return self
+
+    def collect(self, show_time=False):
+        """
+        Runs the query.
+        :param show_time: Print the fetch time.
+        :return: List of rows
+        """
+        start_time = time.time()
+        with self.__table__.snapshot() as view:  # one consistent version, without blocking writers
+            query = self.__on__(view)
+            result = list(query.__execute__())
+            access = query.__plan__()[0]
+
+        self.__table__.__record__("query", start_time, show_time=show_time, rows_returned=len(result),
+                                  access_path={'IndexLookup': "index",
+                                               'IndexRangeScan': "index_range"}.get(access['op'], "scan"),
+                                  index=access.get('index'), query=str(self).strip())
+        return result
+
+    def explain(self):
+        """
+        EXPLAIN ANALYZE: runs the query and returns its plan with estimated and actual rows per node.
+        Estimates come from index bucket sizes and the statistics collected by <CSVTable>.analyze().
+        :return: Plan dict for the root node. Each node's input is its only child.
+        """
+        counts = {}
+        with self.__table__.snapshot() as table:
+            query = self.__on__(table)
+            returned = len(list(query.__execute__(counts)))
+            plan = query.__plan__()
+            template = plan[0].get('template', {})
+            root = None
+            est_rows = 0
+            for node in plan:
+                node = dict(node)
+                if node['op'] == 'Empty':
+                    actual = 0
+                elif node['op'] in ('IndexLookup', 'Scan'):
+                    _, est_rows = table.__estimate_rows__(template)
+                    actual = counts.get('access', 0)
+                elif node['op'] == 'IndexRangeScan':
+                    likes = [cond for cond in self.__conditions__ if cond[1] is CSVPlanner.like]
+                    _, est_rows = table.__estimate_rows__(template, likes)
+                    actual = counts.get('access', 0)
+                elif node['op'] == 'Filter':
+                    _, est_rows = table.__estimate_rows__(template, node['conditions'])
+                    actual = counts.get('filter', 0)
+                elif node['op'] == 'Sort':
+                    actual = counts.get('filter', 0)
+                elif node['op'] == 'Limit':
+                    est_rows = max(est_rows - node['offset'], 0)
+                    if node['limit'] is not None:
+                        est_rows = min(est_rows, node['limit'])
+                    actual = returned
+                else:  # Project
+                    actual = returned
+
+                node['estimated_rows'] = est_rows
+                node['actual_rows'] = actual
+                if root is not None:
+                    node['children'] = [root]
+                root = node
+
+        return root
+
+    def __plan__(self):
+        """
+        Builds the operator tree, leaf first.
+        Equality conditions on text columns are pushed into the template so they can pick an index;
+        number conditions stay as filters since having() parses their values as floats, which do not
+        match index keys built from ints. Without an index for the template, a LIKE filter with a literal
+        prefix can still narrow the rows by an index range scan.
+        :return: List of plan nodes, each a dict with an 'op' entry.
+        """
+        table = self.__table__
+        template = dict(self.__template__)
+        conditions = []
+        for cond in self.__conditions__:
+            col, op, val = cond
+            if op is operator.eq and CSVExpression.result_type(col, table.__get_column_types__()) != "number":
+                if col in template and template[col] != val:
+                    self.__contradiction__ = True
+                template[col] = val
+            else:
+                conditions.append(cond)
+
+        plan = []
+        index = table.__get_access_path__(template) if getattr(table, 'indexes', None) else None
+        prefix_index = None
+        if not index and conditions and getattr(table, 'indexes', None):
+            _, prefix_index = table.__get_having_candidates__(conditions)
+        if self.__contradiction__:
+            plan.append({'op': 'Empty'})
+        elif index:
+            plan.append({'op': 'IndexLookup', 'index': index['index_name'], 'template': template})
+        elif prefix_index:  # LIKE with a literal prefix
+            plan.append({'op': 'IndexRangeScan', 'index': prefix_index, 'template': template})
+        else:
+            plan.append({'op': 'Scan', 'template': template})
+        if conditions:
+            plan.append({'op': 'Filter', 'conditions': conditions})
+        if self.__sorts__:
+            plan.append({'op': 'Sort', 'sorts': self.__sorts__})
+        if self.__limit__ is not None or self.__offset__:
+            plan.append({'op': 'Limit', 'limit': self.__limit__, 'offset': self.__offset__ or 0})
+        if self.__fields__ is not None:
+            plan.append({'op': 'Project', 'fields': self.__fields__})
+
+        return plan
+
+    def __execute__(self, counts=None):
+        """
+        Runs the plan as one generator pipeline. Scan, filter and project are fused into one pass;
+        without a sort, the limit stops the pass as soon as enough rows have been produced.
+        :param counts: If a dict, filled with the rows leaving the access path ('access') and the
+            filter ('filter'), for explain().
+        """
+        table = self.__table__
+        plan = self.__plan__()
+        access = plan[0]
+        if access['op'] == 'Empty' or not table.__rows__:
+            return
+
+        conditions = []
+        for node in plan:
+            if node['op'] == 'Filter':
+                conditions = node['conditions']
+
+        rows = table.__rows__
+        template = access['template']
+        value = table.__get_value__
+        rownums = None
+        if access['op'] == 'IndexLookup':
+            index = table.indexes[access['index']]
+            key, _ = table.__create_key_template__(template, index['columns'])
+            candidates = (rows[rownum] for rownum in index['index'].get(key, []))
+        elif access['op'] == 'IndexRangeScan':
+            rownums, _ = table.__get_having_candidates__(conditions)
+            candidates = iter(table.__iter_zones__(template, conditions)) if rownums is None \
+                else (rows[rownum] for rownum in rownums)
+        else:
+            candidates = iter(table.__iter_zones__(template, conditions))  # skips blocks by zone map
+
+        # a limit without a sort stops the serial pass early, so only scans without one run in parallel
+        parallel = None if counts is not None or access['op'] == 'IndexLookup' \
+            or self.__limit__ is not None and not self.__sorts__ \
+            else CSVParallel.iter_matching(table, template, conditions, rownums=rownums)
+        if parallel is not None:
+            matching = parallel
+        elif counts is None:
+            matching = (r for r in candidates
+                        if r is not None and table.matches_template(r, template)
+                        and all(value(r, c[0]) is not None and c[1](value(r, c[0]), c[2]) for c in conditions))
+        else:
+            counts['access'] = counts['filter'] = 0
+
+            def counted(candidates):
+                for r in candidates:
+                    if r is not None and table.matches_template(r, template):
+                        counts['access'] += 1
+                        if all(value(r, c[0]) is not None and c[1](value(r, c[0]), c[2]) for c in conditions):
+                            counts['filter'] += 1
+                            yield r
+
+            matching = counted(candidates)
+
+        if self.__sorts__:
+            matching = list(matching)  # sorts row references only, rows are not copied
+            for col, desc in reversed(self.__sorts__):
+                matching.sort(key=sort_key(col), reverse=desc)
+
+        start = self.__offset__ or 0
+        stop = start + self.__limit__ if self.__limit__ is not None else None
+        matching = islice(matching, start, stop)
+
+        fields = self.__fields__
+        for r in matching:
+            if fields is None:
+                yield r
+            else:
+                yield {field: r[field] for field in fields}
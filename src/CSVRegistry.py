@@ -0,0 +1,129 @@
+"""
+Process-wide registry of loaded tables, so each table is loaded and indexed once per process.
+get_table(t_name) returns the loaded CSVTable, loading it on first use. With a memory budget, the least
+recently used tables are evicted once the estimated footprint of the loaded tables (see
+CSVTable.memory_usage) exceeds it, and loaded again when next requested. Writes go to the CSV file as they
+are made, so an evicted table loses nothing.
+
+    CSVRegistry.set_memory_budget(2 * 1024 ** 3)
+    people = CSVRegistry.get_table('people')
+"""
+import threading
+from collections import OrderedDict
+import CSVTable
+
+
+class TableRegistry:
+
+    def __init__(self, memory_budget=None):
+        """
+        :param memory_budget: Bytes the loaded tables may use, or None for no limit.
+        """
+        self.memory_budget = memory_budget
+        self.__tables__ = OrderedDict()  # name -> table, least recently used first
+        self.__footprints__ = {}  # name -> (estimated bytes, len and write count of the table when estimated)
+        self.__lock__ = threading.Lock()
+        self.__loading__ = {}  # name -> lock held while the table loads, so concurrent callers share one load
+        self.evictions = 0
+
+    def get_table(self, t_name):
+        """
+        :return: The loaded CSVTable for t_name
+        """
+        t_name = t_name.lower()
+        with self.__lock__:
+            table = self.__tables__.get(t_name)
+            if table is not None:
+                self.__tables__.move_to_end(t_name)
+                return table
+            loading = self.__loading__.setdefault(t_name, threading.Lock())
+
+        with loading:
+            with self.__lock__:
+                table = self.__tables__.get(t_name)
+            if table is None:  # not loaded meanwhile by another thread
+                table = CSVTable.CSVTable(t_name)
+                footprint = table.memory_usage()['total']
+                with self.__lock__:
+                    self.__tables__[t_name] = table
+                    self.__footprints__[t_name] = (footprint, len(table), table.__writes__)
+                    self.__loading__.pop(t_name, None)
+                    self.__evict__(keep=t_name)
+        return table
+
+    def __footprint__(self, t_name):
+        """
+        :return: Estimated bytes of a loaded table, estimated again if it has been written since
+        """
+        table = self.__tables__[t_name]
+        footprint, length, writes = self.__footprints__[t_name]
+        if (length, writes) != (len(table), table.__writes__):
+            footprint = table.memory_usage()['total']
+            self.__footprints__[t_name] = (footprint, len(table), table.__writes__)
+        return footprint
+
+    def __evict__(self, keep=None):
+        """
+        Evicts least recently used tables until the loaded tables fit the budget. Never evicts keep, the
+        table just requested, even if it alone exceeds the budget.
+        """
+        if self.memory_budget is None:
+            return
+        total = sum(self.__footprint__(t_name) for t_name in self.__tables__)
+        for t_name in list(self.__tables__):
+            if total <= self.memory_budget:
+                break
+            if t_name == keep:
+                continue
+            total -= self.__footprint__(t_name)
+            self.__remove__(t_name)
+            self.evictions += 1
+
+    def __remove__(self, t_name):
+        # Callers still holding the table keep using it; the registry loads a new copy on the next request
+        self.__tables__.pop(t_name, None)
+        self.__footprints__.pop(t_name, None)
+
+    def set_memory_budget(self, memory_budget):
+        with self.__lock__:
+            self.memory_budget = memory_budget
+            self.__evict__()
+
+    def evict(self, t_name=None):
+        """
+        Unloads one table, or all of them if t_name is None.
+        """
+        with self.__lock__:
+            for name in [t_name.lower()] if t_name else list(self.__tables__):
+                self.__remove__(name)
+
+    def loaded_tables(self):
+        """
+        :return: Names of the loaded tables, least recently used first
+        """
+        with self.__lock__:
+            return list(self.__tables__)
+
+    def memory_usage(self):
+        """
+        :return: {'total': bytes, 'budget': bytes or None, 'tables': {name: <CSVTable>.memory_usage()}}
+        """
+        with self.__lock__:
+            tables = dict(self.__tables__)
+        usage = {t_name: table.memory_usage() for t_name, table in tables.items()}
+        return {'total': sum(u['total'] for u in usage.values()), 'budget': self.memory_budget, 'tables': usage}
+
+
+registry = TableRegistry()
+
+
+def get_table(t_name):
+    return registry.get_table(t_name)
+
+
+def set_memory_budget(memory_budget):
+    registry.set_memory_budget(memory_budget)
+
+
+def memory_usage():
+    return registry.memory_usage()
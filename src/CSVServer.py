@@ -0,0 +1,225 @@
+"""
+Local query server, keeping tables loaded between scripts.
+Tables are loaded from the catalog once, on first use or with --preload, and queries from any number of
+clients run against them (see CSVAsync), so a script pays neither the load and index build nor the catalog
+connection. Clients connect over a Unix socket or TCP with CSVClient.
+
+    python CSVServer.py --socket /tmp/csvdb.sock --preload people teams
+
+The protocol is JSON lines. A request names a table, optionally a chain of having/order_by/join steps to
+derive a table from it, and an operation:
+    {"id": 1, "table": {"table": "teams", "chain": [["having", ["yearID >= 2010"], {}]]},
+     "op": "find_by_template", "args": [{"lgID": "AL"}], "kwargs": {"fields": ["teamID"]}}
+Rows are streamed back in batches, {"id": 1, "rows": [...]}, and every request ends with
+{"id": 1, "done": true, "result": ...} or {"id": 1, "done": true, "error": {"code": ..., "message": ...}}.
+Requests on one connection are answered in order.
+"""
+import argparse
+import asyncio
+import json
+import DataTableExceptions
+import CSVAsync
+
+# Operations streaming the rows of the (derived) table they are applied to
+row_ops = ("find_by_template", "iter_by_template", "iter_having", "rows")
+# Operations returning a value
+value_ops = ("find_page", "explain", "explain_join", "analyze", "len", "insert", "update", "delete", "vacuum")
+# Operations deriving a new table, allowed in a chain
+derived_ops = ("having", "order_by", "join", "semi_join", "anti_join", "multi_join")
+write_ops = ("analyze", "insert", "update", "delete", "vacuum")
+
+
+class CSVServer:
+    """
+    Serves the tables of the catalog to CSVClient connections.
+    """
+
+    def __init__(self, path=None, host="127.0.0.1", port=None, batch_size=1000):
+        """
+        :param path: Unix socket to listen on.
+        :param host: TCP host, used if path is None.
+        :param port: TCP port, used if path is None.
+        :param batch_size: Rows per streamed message.
+        """
+        if path is None and port is None:
+            raise DataTableExceptions.DataTableException(
+                code=DataTableExceptions.DataTableException.invalid_method_call,
+                message="Usage: CSVServer(path=<unix socket>) or CSVServer(host=<host>, port=<port>)")
+        self.path = path
+        self.host = host
+        self.port = port
+        self.batch_size = batch_size
+        self.__tables__ = {}  # name -> task loading the AsyncCSVTable, so concurrent requests share one load
+        self.__server__ = None
+
+    async def get_table(self, t_name):
+        """
+        :return: The loaded table, loading it first if this is the first request for it
+        """
+        if not isinstance(t_name, str):
+            raise DataTableExceptions.DataTableException(
+                code=DataTableExceptions.DataTableException.invalid_method_call,
+                message="Table name must be a string")
+        t_name = t_name.lower()
+        if t_name not in self.__tables__:
+            self.__tables__[t_name] = asyncio.ensure_future(CSVAsync.AsyncCSVTable.open(t_name))
+        try:
+            return await asyncio.shield(self.__tables__[t_name])
+        except Exception:
+            self.__tables__.pop(t_name, None)  # not cached, so a later request retries
+            raise
+
+    async def preload(self, *t_names):
+        await asyncio.gather(*(self.get_table(t_name) for t_name in t_names))
+
+    def loaded_tables(self):
+        return sorted(t_name for t_name, task in self.__tables__.items() if task.done() and not task.exception())
+
+    async def resolve(self, ref):
+        """
+        :param ref: {"table": name, "chain": [[op, args, kwargs], ...]}, as sent by CSVClient.
+        :return: (AsyncCSVTable, True if it is a derived table)
+        """
+        if not isinstance(ref, dict) or not isinstance(ref.get('chain', []), list):
+            raise DataTableExceptions.DataTableException(
+                code=DataTableExceptions.DataTableException.invalid_method_call,
+                message="Invalid table reference: {}".format(ref))
+        table = await self.get_table(ref.get('table'))
+        chain = ref.get('chain', [])
+        for i, (op, args, kwargs) in enumerate(chain):
+            if op not in derived_ops:
+                raise DataTableExceptions.DataTableException(
+                    code=DataTableExceptions.DataTableException.invalid_method_call,
+                    message="Unknown operation {} in chain".format(op))
+            args, kwargs = await self.__resolve_args__(op, args, kwargs, {'table': ref['table'], 'chain': chain[:i]},
+                                                       table)
+            table = await getattr(table, op)(*args, **kwargs)
+        return table, bool(ref.get('chain'))
+
+    async def __resolve_args__(self, op, args, kwargs, ref, table):
+        """
+        Replaces table references in the arguments of the joins by the tables.
+        :param ref: Reference to the table the operation is applied to.
+        :param table: That table, resolved.
+        """
+        args, kwargs = list(args), dict(kwargs)
+        if op in ("join", "semi_join", "anti_join", "explain_join") and args:
+            args[0] = (await self.resolve(args[0]))[0]
+        elif op == "multi_join" and len(args) >= 2 and isinstance(args[0], list) and isinstance(args[1], list):
+            refs = args[0]
+            tables = [(await self.resolve(ref))[0] for ref in refs]
+            # conditions name tables by reference, or by name as in CSVTable.multi_join
+            args[0] = tables[:]
+            refs, tables = [ref] + refs, [table] + tables
+            args[1] = [[tables[refs.index(r)] if isinstance(r, dict) and r in refs else r
+                        for r in condition[:2]] + list(condition[2:]) for condition in args[1]]
+        return args, kwargs
+
+    async def execute(self, request, send):
+        """
+        Runs one request, sending streamed rows with send(message).
+        :return: The result value
+        """
+        op, args, kwargs = request.get('op'), request.get('args', []), request.get('kwargs', {})
+        if op not in row_ops + value_ops + derived_ops or not isinstance(args, list) or not isinstance(kwargs, dict):
+            raise DataTableExceptions.DataTableException(
+                code=DataTableExceptions.DataTableException.invalid_method_call,
+                message="Unknown operation {}".format(op))
+
+        table, derived = await self.resolve(request.get('table'))
+        if op in write_ops and derived:
+            raise DataTableExceptions.DataTableException(
+                code=DataTableExceptions.DataTableException.invalid_operation,
+                message="Cannot {} a derived table".format(op))
+        if op in derived_ops:  # a derived table returned on its own: send its rows
+            args, kwargs = await self.__resolve_args__(op, args, kwargs, request['table'], table)
+            table, op, args, kwargs = await getattr(table, op)(*args, **kwargs), "rows", [], {}
+
+        if op in row_ops:
+            if op == "iter_having":
+                rows = table.iter_having(*args, batch_size=self.batch_size, **kwargs)
+            else:
+                rows = table.iter(*(args or [{}]), batch_size=self.batch_size, **kwargs)
+            batch = []
+            async for row in rows:
+                batch.append(row)
+                if len(batch) == self.batch_size:
+                    await send({'rows': batch})
+                    batch = []
+            if batch:
+                await send({'rows': batch})
+            return None
+
+        if op == "len":
+            return len(table)
+        if op == "explain_join":
+            args, kwargs = await self.__resolve_args__(op, args, kwargs, request['table'], table)
+        return await getattr(table, op)(*args, **kwargs)
+
+    async def handle(self, reader, writer):
+        """
+        Serves one connection until the client closes it.
+        """
+        async def send(message):
+            writer.write(json.dumps(dict(message, id=request_id), default=str, separators=(',', ':')).encode() + b"\n")
+            await writer.drain()
+
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                request_id = None
+                try:
+                    request = json.loads(line)
+                    request_id = request.get('id')
+                    result = await self.execute(request, send)
+                    await send({'done': True, 'result': result})
+                except DataTableExceptions.DataTableException as e:
+                    await send({'done': True, 'error': {'code': e.code, 'message': e.message}})
+                except (ConnectionError, asyncio.CancelledError):
+                    raise
+                except Exception as e:  # report bad requests, keep serving
+                    await send({'done': True, 'error': {'code': None, 'message': repr(e)}})
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def start(self):
+        limit = 1 << 24  # requests may carry large rows or templates
+        if self.path is not None:
+            self.__server__ = await asyncio.start_unix_server(self.handle, path=self.path, limit=limit)
+        else:
+            self.__server__ = await asyncio.start_server(self.handle, host=self.host, port=self.port, limit=limit)
+        return self.__server__
+
+    async def serve_forever(self, preload=()):
+        server = await self.start()
+        await self.preload(*preload)
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        if self.__server__ is not None:
+            self.__server__.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve CSVDatabase tables to CSVClient connections.")
+    parser.add_argument("--socket", help="Unix socket path")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int)
+    parser.add_argument("--preload", nargs="*", default=[], help="Tables to load at startup")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Rows per streamed message")
+    args = parser.parse_args()
+
+    server = CSVServer(path=args.socket, host=args.host, port=args.port, batch_size=args.batch_size)
+    try:
+        asyncio.run(server.serve_forever(preload=args.preload))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
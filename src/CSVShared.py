@@ -0,0 +1,410 @@
+"""
+Shared-memory table store, so several worker processes can serve one loaded table.
+A publisher process writes a table's typed column data and indexes into a shared memory segment; other
+processes attach to it read-only without copying or parsing anything, and rows are decoded from the
+segment as they are read. Each publish is a new version in its own segment, and a small control segment
+holds the current version, so readers switch to the new data on refresh() once the publisher republishes
+after writes.
+
+    CSVShared.publish(CSVTable.CSVTable('people'))  # in the loader process, again after each batch of writes
+    people = CSVShared.attach('people')  # in each worker
+"""
+import json
+import struct
+from array import array
+from bisect import bisect_left
+from collections.abc import Mapping
+from multiprocessing import resource_tracker, shared_memory
+import DataTableExceptions
+import CSVTable
+
+prefix = "csvdb"
+alignment = 8
+
+
+def control_name(t_name):
+    return "{}_{}".format(prefix, t_name.lower())
+
+
+def segment_name(t_name, version):
+    return "{}_{}_{}".format(prefix, t_name.lower(), version)
+
+
+class AttachedMemory(shared_memory.SharedMemory):
+    """
+    SharedMemory that can be closed while rows or indexes still hold views of it; the mapping is then
+    released with the last view.
+    """
+
+    def close(self):
+        try:
+            super().close()
+        except BufferError:
+            pass
+
+
+def open_segment(name):
+    """
+    Attaches to an existing segment without taking ownership of it: the publisher unlinks it.
+    """
+    try:
+        return AttachedMemory(name=name, track=False)  # Python 3.13+
+    except TypeError:
+        shm = AttachedMemory(name=name)
+        resource_tracker.unregister(shm._name, "shared_memory")  # otherwise unlinked when this process exits
+        return shm
+
+
+def read_version(t_name):
+    """
+    :return: The current published version of a table, or None if it has not been published
+    """
+    try:
+        control = open_segment(control_name(t_name))
+    except FileNotFoundError:
+        return None
+    try:
+        return struct.unpack_from("q", control.buf)[0]
+    finally:
+        control.close()
+
+
+class SharedStrings:
+    """
+    Read-only sequence of strings stored as one UTF-8 blob and an array of offsets. UTF-8 byte order is code
+    point order, so a sorted list of strings stays sorted, and bisect works on it directly.
+    """
+
+    def __init__(self, blob, offsets):
+        self.__blob__ = blob
+        self.__offsets__ = offsets
+
+    def __len__(self):
+        return len(self.__offsets__) - 1
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return bytes(self.__blob__[self.__offsets__[i]:self.__offsets__[i + 1]]).decode()
+
+
+class SharedIndex(Mapping):
+    """
+    Read-only index in the layout of CSVTable indexes, key -> sorted rownums. Keys are sorted, so a lookup is
+    a binary search, and the buckets are slices of one postings array.
+    """
+
+    def __init__(self, keys, starts, postings):
+        self.keys_list = keys
+        self.__starts__ = starts
+        self.__postings__ = postings
+
+    def __getitem__(self, key):
+        i = bisect_left(self.keys_list, key)
+        if i == len(self.keys_list) or self.keys_list[i] != key:
+            raise KeyError(key)
+        return self.__postings__[self.__starts__[i]:self.__starts__[i + 1]]
+
+    def __iter__(self):
+        return iter(self.keys_list)
+
+    def __len__(self):
+        return len(self.keys_list)
+
+
+class SharedRows:
+    """
+    Read-only list of rows over the column arrays of a segment. Each access builds the row dict, and a slice
+    builds a list of them.
+    """
+
+    def __init__(self, columns, row_count):
+        """
+        :param columns: List of (column name, function from rownum to value).
+        """
+        self.__columns__ = columns
+        self.__row_count__ = row_count
+
+    def __len__(self):
+        return self.__row_count__
+
+    def __getitem__(self, rownum):
+        if isinstance(rownum, slice):  # e.g. the sample of CSVTable.memory_usage
+            return [self[i] for i in range(*rownum.indices(self.__row_count__))]
+        if rownum < 0:
+            rownum += self.__row_count__
+        if not 0 <= rownum < self.__row_count__:
+            raise IndexError(rownum)
+        r = {col: get(rownum) for col, get in self.__columns__}
+        r['rownum'] = rownum
+        return r
+
+    def __iter__(self):
+        for rownum in range(self.__row_count__):
+            yield self[rownum]
+
+
+class SegmentWriter:
+    """
+    Lays out arrays for a segment: a JSON header describing where each array is, then the arrays.
+    """
+
+    def __init__(self):
+        self.arrays = []
+        self.size = 0
+
+    def add(self, data, typecode):
+        """
+        :return: [offset, length in items, typecode], to record in the header
+        """
+        data = array(typecode, data) if typecode != "B" else bytes(data)
+        offset = self.size
+        self.arrays.append((offset, data))
+        self.size += -(-len(data) * (data.itemsize if typecode != "B" else 1) // alignment) * alignment
+        return [offset, len(data), typecode]
+
+    def add_strings(self, strings):
+        encoded = [s.encode() for s in strings]
+        offsets = [0]
+        for s in encoded:
+            offsets.append(offsets[-1] + len(s))
+        return {'blob': self.add(b"".join(encoded), "B"), 'offsets': self.add(offsets, "q")}
+
+    def write(self, name, header):
+        header = json.dumps(header, default=str).encode()
+        start = 8 + -(-len(header) // alignment) * alignment
+        shm = shared_memory.SharedMemory(name=name, create=True, size=max(start + self.size, 1))
+        struct.pack_into("q", shm.buf, 0, len(header))
+        shm.buf[8:8 + len(header)] = header
+        for offset, data in self.arrays:
+            raw = data if isinstance(data, bytes) else data.tobytes()
+            shm.buf[start + offset:start + offset + len(raw)] = raw
+        return shm
+
+
+def encode_column(writer, values, column_type):
+    if column_type == "number":
+        # kind: 0 NULL, 1 int, 2 float, so ints and floats come back as they were loaded
+        kinds = [0 if v is None else 2 if isinstance(v, float) else 1 for v in values]
+        if 2 in kinds:
+            if any(kind == 1 and abs(v) > 2 ** 53 for v, kind in zip(values, kinds)):
+                raise DataTableExceptions.DataTableException(
+                    code=DataTableExceptions.DataTableException.invalid_operation,
+                    message="Cannot publish integers above 2^53 in a column that also holds decimals")
+            data = writer.add([v if v is not None else 0.0 for v in values], "d")
+        else:
+            data = writer.add([v if v is not None else 0 for v in values], "q")
+        return {'type': "number", 'values': data, 'kinds': writer.add(kinds, "B")}
+
+    dictionary = {}
+    codes = [-1 if v is None else dictionary.setdefault(str(v), len(dictionary)) for v in values]
+    return {'type': "text", 'codes': writer.add(codes, "i"), 'dictionary': writer.add_strings(list(dictionary))}
+
+
+def publish(table):
+    """
+    Publishes the table's current rows and indexes as a new version, then retires the previous version.
+    Processes already attached to it keep reading it until they refresh(). Deleted rows are left out and
+    the others renumbered, as by vacuum().
+    :param table: A loaded CSVTable.
+    :return: The new version number
+    """
+    with table.snapshot() as view:
+        rows = [r for r in view.__rows__ or () if r is not None]
+        new_rownums = {r['rownum']: i for i, r in enumerate(rows)}
+        writer = SegmentWriter()
+
+        columns = {}
+        column_types = view.__get_column_types__()
+        for col in view.__get_column_names__():
+            columns[col] = encode_column(writer, [r.get(col) for r in rows], column_types[col])
+
+        indexes = {}
+        for index_name, idx in view.indexes.items():
+            keys = sorted(idx['index'])
+            starts = [0]
+            postings = []
+            for key in keys:
+                postings.extend(new_rownums[rownum] for rownum in idx['index'][key])
+                starts.append(len(postings))
+            indexes[index_name] = {'index_type': idx['index_type'], 'columns': idx['columns'],
+                                   'selectivity': idx.get('selectivity'), 'keys': writer.add_strings(keys), 'starts': writer.add(starts, "q"),
+                                   'postings': writer.add(postings, "i")}
+
+        description = dict(view.__description__ or {})
+        description['statistics'] = getattr(view, '__statistics__', None) or description.get('statistics')
+        header = {'table': view.__table_name__, 'row_count': len(rows), 'description': description,
+                  'columns': columns, 'indexes': indexes}
+
+    t_name = header['table']
+    old_version = read_version(t_name)
+    version = (old_version or 0) + 1
+    while True:
+        header['version'] = version
+        try:
+            shm = writer.write(segment_name(t_name, version), header)
+            break
+        except FileExistsError:  # left over from a publisher that did not exit cleanly
+            version += 1
+    shm.close()  # stays until unlinked
+
+    try:
+        control = shared_memory.SharedMemory(name=control_name(t_name), create=True, size=8)
+    except FileExistsError:
+        control = open_segment(control_name(t_name))
+    struct.pack_into("q", control.buf, 0, version)
+    control.close()
+
+    if old_version is not None:
+        try:
+            old = shared_memory.SharedMemory(name=segment_name(t_name, old_version))
+            old.close()
+            old.unlink()  # attached readers keep their mapping
+        except FileNotFoundError:
+            pass
+
+    return version
+
+
+def unpublish(t_name):
+    """
+    Removes a table's current version and control segment. Attached readers keep their data.
+    """
+    for name in (segment_name(t_name, read_version(t_name)), control_name(t_name)):
+        try:
+            shm = shared_memory.SharedMemory(name=name)
+            shm.close()
+            shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+class Segment:
+    """
+    An attached version: the header and typed views of its arrays.
+    """
+
+    def __init__(self, t_name):
+        while True:  # the publisher may retire a version between reading the control segment and attaching
+            version = read_version(t_name)
+            if version is None:
+                raise DataTableExceptions.DataTableException(
+                    code=DataTableExceptions.DataTableException.invalid_operation,
+                    message="Table {} has not been published".format(t_name))
+            try:
+                self.shm = open_segment(segment_name(t_name, version))
+                break
+            except FileNotFoundError:
+                continue
+
+        header_length = struct.unpack_from("q", self.shm.buf)[0]
+        self.header = json.loads(bytes(self.shm.buf[8:8 + header_length]).decode())
+        self.start = 8 + -(-header_length // alignment) * alignment
+        self.version = self.header['version']
+
+    def view(self, spec):
+        offset, length, typecode = spec
+        start = self.start + offset
+        if typecode == "B":
+            return self.shm.buf[start:start + length]
+        return self.shm.buf[start:start + length * array(typecode).itemsize].cast(typecode)
+
+    def strings(self, spec):
+        return SharedStrings(self.view(spec['blob']), self.view(spec['offsets']))
+
+    def column_reader(self, spec, cache_limit):
+        """
+        :return: Function from rownum to the column value
+        """
+        if spec['type'] == "number":
+            values, kinds = self.view(spec['values']), self.view(spec['kinds'])
+            types = (None, int, float)
+            return lambda rownum: types[kinds[rownum]](values[rownum]) if kinds[rownum] else None
+
+        codes = self.view(spec['codes'])
+        dictionary = self.strings(spec['dictionary'])
+        if len(dictionary) <= cache_limit:  # small enough to decode once per process
+            dictionary = [dictionary[i] for i in range(len(dictionary))]
+        return lambda rownum: dictionary[codes[rownum]] if codes[rownum] >= 0 else None
+
+    def indexes(self):
+        indexes = {}
+        for index_name, spec in self.header['indexes'].items():
+            keys = self.strings(spec['keys'])
+            indexes[index_name] = {'index_name': index_name, 'index_type': spec['index_type'],
+                                   'columns': spec['columns'],
+                                   'index': SharedIndex(keys, self.view(spec['starts']), self.view(spec['postings'])),
+                                   'sorted_keys': keys, 'selectivity': spec['selectivity']}
+        return indexes
+
+
+class SharedCSVTable(CSVTable.CSVTable):
+    """
+    Read-only CSVTable over a published segment. All query operators work as on a loaded table; writes go
+    through the publisher, followed by publish().
+    """
+
+    def __init__(self, t_name, auto_refresh=False):
+        """
+        :param t_name: Table name, as published.
+        :param auto_refresh: Check for a newer version before every query, rather than only on refresh().
+        """
+        super().__init__(t_name, load=False)
+        self.auto_refresh = auto_refresh
+        self.__segment__ = None
+        self.__attach__(Segment(t_name))
+
+    def __attach__(self, segment):
+        header = segment.header
+        self.__description__ = header['description']
+        for cached in ('__column_names__', '__column_types__', '__not_null_cols__'):
+            self.__dict__.pop(cached, None)
+        self.__statistics__ = header['description'].get('statistics') or {}
+        self.__file_name__ = header['description'].get('definition', {}).get('path', "DERIVED")
+        columns = [(col, segment.column_reader(spec, self.dictionary_max_distinct))
+                   for col, spec in header['columns'].items()]
+        self.__rows__ = SharedRows(columns, header['row_count'])
+        self.__rownum__ = header['row_count'] - 1
+        self.indexes = segment.indexes()
+        self.__segment__ = segment
+        self.__vacuum_epoch__ = segment.version  # rownums change between versions, so find_page cursors do too
+
+    @property
+    def version(self):
+        return self.__segment__.version
+
+    def refresh(self):
+        """
+        Switches to the latest published version. Snapshots of the old version keep reading it.
+        :return: True if a newer version was attached
+        """
+        if read_version(self.__table_name__) in (None, self.__segment__.version):
+            return False
+        segment = Segment(self.__table_name__)
+        self.__lock__.acquire_write()
+        try:
+            self.__attach__(segment)
+        finally:
+            self.__lock__.release_write()
+        return True
+
+    def __pin__(self):
+        if self.auto_refresh:
+            self.refresh()
+        return super().__pin__()
+
+    def __read_only__(self, *args, **kwargs):
+        raise DataTableExceptions.DataTableException(
+            code=DataTableExceptions.DataTableException.invalid_operation,
+            message="Shared table {} is read-only; write in the publishing process".format(self.__table_name__))
+
+    insert = update = delete = vacuum = __read_only__
+
+
+def attach(t_name, auto_refresh=False):
+    """
+    :return: SharedCSVTable reading the latest published version of t_name
+    """
+    return SharedCSVTable(t_name, auto_refresh=auto_refresh)
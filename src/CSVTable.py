@@ -1,12 +1,30 @@
+import base64
+import bisect
 import csv
 import copy
+import hashlib
+import heapq
+import json
+import os
 import sys
+import threading
 import time
 import operator
 import re
 from collections import defaultdict, OrderedDict
+from contextlib import contextmanager
+from functools import partial
+from itertools import chain, islice, product
+from operator import itemgetter
 import DataTableExceptions
 import CSVCatalog
+import CSVExpression
+import CSVLock
+import CSVMetrics
+import CSVParallel
+import CSVPartition
+import CSVPlanner
+import CSVQuery
 
 max_rows_to_print = 10
 null_sym = '\033[1m' + "NULL" + '\033[0m'
@@ -57,71 +75,485 @@ def print_rows(rows, all=False):
     print(string)
 
 
+def number(value):
+    return float(value) if '.' in value else int(value)
+
+
+aggregate_functions = ("count", "sum", "avg", "min", "max")
+
+
+def intern_value(dictionary, value):
+    # the one shared copy of value in a dictionary encoded column
+    return dictionary.setdefault(value, value)
+
+
+def export_rows(rows, file_name, fields=None):
+    """
+    Streams rows into a file, one row at a time, so an iterator such as iter_by_template can be
+    exported in constant memory. Writes JSON lines if file_name ends in .jsonl, otherwise CSV.
+    :param rows: Iterable of row dicts.
+    :param file_name: Output file path.
+    :param fields: Columns to write. Defaults to the columns of the first row, excluding rownum.
+    :return: Number of rows written
+    """
+    rows = iter(rows)
+    count = 0
+    try:
+        first = next(rows)
+    except StopIteration:
+        first = None
+    if fields is None:
+        fields = [col for col in first.keys() if col != 'rownum'] if first else []
+
+    try:
+        with open(file_name, "w", newline='') as f:
+            if file_name.lower().endswith('.jsonl'):
+                write = lambda r: f.write(json.dumps({field: r.get(field) for field in fields}) + '\n')
+            else:
+                writer = csv.DictWriter(f, fields, extrasaction='ignore',
+                                        delimiter=",", quotechar='"', quoting=csv.QUOTE_ALL)
+                writer.writeheader()
+                write = writer.writerow
+
+            if first is not None:
+                write(first)
+                count += 1
+            for r in rows:
+                write(r)
+                count += 1
+    except IOError:
+        raise DataTableExceptions.DataTableException(
+            code=DataTableExceptions.DataTableException.io_error,
+            message="Export failed; error while writing to file " + file_name
+        )
+
+    return count
+
+
 class CSVTable:
     # Table engine needs to load table definition information.
-    __catalog__ = CSVCatalog.CSVCatalog()
-
-    def __init__(self, t_name, load=True):
+    # Connected on first use, so another catalog (e.g. a local stand-in) can be assigned beforehand.
+    __catalog__ = None
+    # Per-call metrics and the slow query log. Replace, or add listeners, to collect them elsewhere.
+    __metrics__ = CSVMetrics.MetricsRegistry()
+    # delete() runs vacuum() once the deleted rows exceed threshold + scale_factor * rows, as in PostgreSQL
+    autovacuum_threshold = 50
+    autovacuum_scale_factor = 0.2
+    __tombstones__ = 0  # deleted rows still in __rows__ as None
+    __vacuum_epoch__ = 0  # incremented by vacuum(), which renumbers rows
+    # Text columns with encoding 'auto' are dictionary encoded while they have at most this many distinct values
+    dictionary_max_distinct = 1024
+    __dictionaries__ = {}  # column -> {value: value}, the one shared copy of each distinct value
+    __snapshot_of__ = None  # for a snapshot view, the table it was taken from
+    __version__ = 0  # incremented when a writer copies the rows and indexes away from pinned snapshots
+    __writes__ = 0  # incremented by every write applied in memory, pinned or not (see __writing__)
+    __partitioning__ = None  # from the catalog, see CSVPartition
+    __partitions__ = None  # partition -> sorted rownums of its live rows, for a partitioned table
+    __loaded_partitions__ = None  # partitions loaded, if not all of them
+    __owned_partitions__ = None  # partitions whose rownum lists belong to this version, if not all
+    # Rows per zone map block (see __build_zone_maps__); None disables zone maps
+    zone_map_block_size = 1024
+    # Directory to save zone maps in, so the next load of the unchanged file reuses them; None keeps them in memory
+    zone_map_cache_dir = None
+    __zone_maps__ = None
+    # Processes evaluating a scan, having or aggregate in parallel (see CSVParallel); 1 runs them serially
+    parallel_degree = 1
+    parallel_min_rows = 100000  # smaller scans run serially
+    morsel_size = 10000  # rows per unit of parallel work
+
+    def __init__(self, t_name, load=True, partitions=None):
         """
         Constructor.
         :param t_name: Name for table.
         :param load: Load data from a CSV file. If load=False, this is a derived table and engine will
             add rows instead of loading from file.
+        :param partitions: For a partitioned table, load and index only some partitions: a list of partition
+            numbers, or a template or list of having-style conditions that the rows needed match, e.g.
+            ['yearID >= 2015']. The table then holds only the rows of those partitions, as if queried with
+            MySQL's PARTITION clause. None loads all of them.
         """
 
         self.__table_name__ = t_name
         self.__description__ = None
+        self.__lock__ = CSVLock.RWLock()  # see CSVLock
+        self.__write_mutex__ = threading.RLock()
+        self.__pins__ = {}  # version -> number of snapshots reading it
+        self.__pins_lock__ = threading.Lock()
+        self.__shared_indexes__ = set()  # names of indexes still shared with snapshots of older versions
+        self.__index_locks__ = {}  # index name -> lock for the parts of the index built lazily by readers
         if load:
             self.__load_info__()  # Load metadata
+            self.__partitioning__ = self.__description__.get('partitioning')
+            self.__loaded_partitions__ = self.__select_partitions__(partitions)
             self.__rows__ = None
             self.__load__()  # Load rows from the CSV file.
+            self.__build_partitions__()
+            if not self.__load_zone_maps__():
+                self.__build_zone_maps__()
+                self.__save_zone_maps__()
             self.__build_indexes__()
         else:
             self.__file_name__ = "DERIVED"
+            self.indexes = {}
 
     def __load_info__(self):
         """
         Loads metadata from catalog and sets __description__ to hold the information.
         :return:
         """
+        if CSVTable.__catalog__ is None:
+            CSVTable.__catalog__ = CSVCatalog.CSVCatalog()
         self.__description__ = self.__catalog__.get_table(self.__table_name__).describe_table()
+        self.__statistics__ = self.__description__.get('statistics') or {}
 
     def __load__(self):
 
         try:
-            self.__deleted_rows__ = []
-            fn = self.__get_file_name__()
-            with open(fn, "r") as csvfile:
-                reader = csv.DictReader(csvfile, delimiter=",", quotechar='"')
-
-                column_names = self.__get_column_names__()
-                column_types = self.__get_column_types__()
-                not_null_columns = self.__get_not_null_columns__()
-
-                for r in reader:
-                    projected_r = self.project([r], column_names)[0]
-
-                    for k, v in projected_r.items():  # convert numerical data types
-                        if v == '':
-                            if k in not_null_columns:
-                                raise DataTableExceptions.DataTableException(
-                                    code=DataTableExceptions.DataTableException.cannot_be_null,
-                                    message="Cannot load table {}. NULL value found in column {}.".format(self.__table_name__, k))
-                            else:
-                                projected_r[k] = None
-                        elif column_types[k] == "number":
-                            if '.' in v:
-                                projected_r[k] = float(v)
-                            else:
-                                projected_r[k] = int(v)
-
-                    self.__add_row__(projected_r)
+            self.__tombstones__ = 0
+            column_types = self.__get_column_types__()
+            encodings = self.__get_encodings__()
+            dictionaries = {col: {} for col in self.__get_column_names__()
+                            if column_types[col] == "text" and encodings[col] != "plain"}
+            not_null_columns = self.__get_not_null_columns__()
+            rows = self.__rows__ = self.__rows__ or []  # rows are appended here rather than by __add_row__
+            partitioning, loaded = self.__partitioning__, self.__loaded_partitions__
+            # some partitions of a single file: the rows of the others are read but not kept
+            keep = partitioning['column'] if loaded is not None and not partitioning.get('directory') else None
+
+            for fn in self.__get_file_names__():
+                with open(fn, "r", newline='') as csvfile:
+                    reader = csv.reader(csvfile, delimiter=",", quotechar='"')
+                    header = next(reader, None)
+                    if header is None:  # empty file
+                        continue
+
+                    converters = self.__get_converters__(header, dictionaries)
+                    names = [col for col, _, _ in converters]
+                    positions = [pos for _, pos, _ in converters]
+                    get_values = itemgetter(*positions) if len(positions) > 1 else lambda record: (record[positions[0]],)
+                    converting = [(col, convert) for col, _, convert in converters if convert]
+                    width = max(positions) + 1
+
+                    for count, record in enumerate(reader, 1):
+                        if not record:  # blank line
+                            continue
+                        if len(record) < width:  # missing trailing fields are NULL
+                            record += [''] * (width - len(record))
+
+                        values = get_values(record)
+                        r = dict(zip(names, values))
+                        if '' in values:
+                            for col in names:
+                                if r[col] == '':
+                                    if col in not_null_columns:
+                                        raise DataTableExceptions.DataTableException(
+                                            code=DataTableExceptions.DataTableException.cannot_be_null,
+                                            message="Cannot load table {}. NULL value found in column {}.".format(self.__table_name__, col))
+                                    r[col] = None
+                        for col, convert in converting:
+                            if r[col] is not None:
+                                r[col] = convert(r[col])
+                        if keep and CSVPartition.partition_of(partitioning, r[keep]) not in loaded:
+                            continue
+                        r['rownum'] = len(rows)
+                        rows.append(r)
+
+                        if count % 4096 == 0 and any(len(dictionaries[col]) > self.dictionary_max_distinct
+                                                     and encodings[col] == "auto" for col in dictionaries):
+                            converting = [(col, convert) for col, _, convert in
+                                          self.__get_converters__(header, dictionaries) if convert]
+
+                    self.__get_converters__(header, dictionaries)  # drops dictionaries that grew too large
+
+            self.__rownum__ = len(rows) - 1
+            self.__dictionaries__ = dictionaries
 
         except IOError as e:
             raise DataTableExceptions.DataTableException(
                 code=DataTableExceptions.DataTableException.invalid_file,
                 message="Could not read file = " + fn)
 
+    def __get_file_names__(self):
+        """
+        :return: CSV files holding the loaded rows: the table's file, or for partitions stored in their own
+            files, the file of each loaded partition
+        """
+        file_name = self.__get_file_name__()  # the catalog's file, also for partitions in their own files
+        partitioning = self.__partitioning__
+        if not partitioning or not partitioning.get('directory'):
+            return [file_name]
+        partitions = range(CSVPartition.count(partitioning))
+        return [CSVPartition.partition_file(partitioning, self.__table_name__, partition) for partition in partitions
+                if self.__loaded_partitions__ is None or partition in self.__loaded_partitions__]
+
+    def __select_partitions__(self, partitions):
+        """
+        :param partitions: As for the constructor.
+        :return: Set of the partitions to load, or None for all
+        """
+        if partitions is None:
+            return None
+        usage = "Usage: CSVTable(<table name>, partitions=[<partition>, ...] or {template} or ['<condition>', ...])"
+        if not self.__partitioning__:
+            raise DataTableExceptions.DataTableException(
+                code=DataTableExceptions.DataTableException.invalid_method_call,
+                message="Table {} is not partitioned\n".format(self.__table_name__) + usage)
+
+        n = CSVPartition.count(self.__partitioning__)
+        if isinstance(partitions, (dict, OrderedDict)):
+            selected = CSVPartition.prune_template(self.__partitioning__, partitions)
+        elif isinstance(partitions, list) and all(isinstance(p, str) for p in partitions):
+            selected = CSVPartition.prune(self.__partitioning__, self.__parse_conditions__(partitions, usage))
+        elif isinstance(partitions, list) and all(isinstance(p, int) and 0 <= p < n for p in partitions):
+            selected = partitions
+        else:
+            raise DataTableExceptions.DataTableException(
+                code=DataTableExceptions.DataTableException.invalid_method_call,
+                message=usage)
+        return None if selected is None or len(set(selected)) == n else set(selected)
+
+    def __build_partitions__(self):
+        """
+        Sorts the rownums of the live rows into their partitions.
+        """
+        partitioning = self.__partitioning__
+        if not partitioning:
+            return
+        partitions = [[] for _ in range(CSVPartition.count(partitioning))]
+        col = partitioning['column']
+        for row in self.__rows__ or ():
+            if row is not None:
+                partitions[CSVPartition.partition_of(partitioning, row.get(col))].append(row['rownum'])
+        self.__partitions__ = partitions
+        self.__owned_partitions__ = None  # new lists, shared with no snapshot
+
+    def __own_partition__(self, partition):
+        """
+        :return: The rownum list of a partition, copied first if it is still shared with a snapshot
+        """
+        owned = self.__owned_partitions__
+        if owned is not None and partition not in owned:
+            self.__partitions__[partition] = list(self.__partitions__[partition])
+            owned.add(partition)
+        return self.__partitions__[partition]
+
+    def __check_partition_loaded__(self, partition):
+        if self.__loaded_partitions__ is not None and partition not in self.__loaded_partitions__:
+            raise DataTableExceptions.DataTableException(
+                code=DataTableExceptions.DataTableException.invalid_operation,
+                message="Partition {} of table {} is not loaded".format(partition, self.__table_name__))
+
+    def __build_zone_maps__(self):
+        """
+        Zone maps: for each block of zone_map_block_size rownums, the min, max and NULL count of each
+        column, so that scans skip the blocks that cannot match (see __iter_zones__). Effective when the file
+        is sorted or clustered on the column, e.g. by year or ID. Writes only widen them, replacing the block's
+        zone map rather than changing it, and deleted rows stay counted until vacuum rebuilds them, so a
+        snapshot sharing them stays correct.
+        """
+        block_size = self.zone_map_block_size
+        rows = self.__rows__
+        if not block_size or rows is None:
+            self.__zone_maps__ = None
+            return
+        zones = []
+        for start in range(0, len(rows), block_size):
+            block = [r for r in rows[start:start + block_size] if r is not None]
+            zones.append({col: self.__get_zone__([r.get(col) for r in block]) for col in self.__get_column_names__()})
+        self.__zone_maps__ = zones
+
+    @staticmethod
+    def __get_zone__(values):
+        """
+        :return: [min, max, NULL count] of values, with min and max None if all are NULL, or None if the
+            values cannot be compared
+        """
+        not_null = [v for v in values if v is not None]
+        try:
+            return [min(not_null), max(not_null), len(values) - len(not_null)] if not_null \
+                else [None, None, len(values)]
+        except TypeError:
+            return None
+
+    def __widen_zones__(self, rownum, r, inserting=False):
+        """
+        Widens the zone map of rownum's block to cover new values: a new row, or the changed values of one.
+        The block's zone map is replaced by a widened copy, as snapshots may be reading it.
+        """
+        zones = self.__zone_maps__
+        if zones is None:
+            return
+        block = rownum // self.zone_map_block_size
+        if block == len(zones):
+            zones.append({col: [None, None, 0] for col in self.__get_column_names__()})
+        zone = zones[block] = dict(zones[block])
+        for col, value in r.items():
+            z = zone.get(col)
+            if z is None:
+                continue
+            if value is None:
+                zone[col] = [z[0], z[1], z[2] + 1]
+            else:
+                try:
+                    zone[col] = [value, value, z[2]] if z[0] is None else [min(z[0], value), max(z[1], value), z[2]]
+                except TypeError:
+                    zone[col] = None
+        if inserting:  # columns missing from an inserted row are NULL
+            for col, z in list(zone.items()):
+                if col not in r and z is not None:
+                    zone[col] = [z[0], z[1], z[2] + 1]
+
+    def __zone_may_match__(self, zone, t, conditions):
+        """
+        :return: False if no row of a block with this zone map can match the template and the parsed having
+            conditions
+        """
+        if isinstance(t, list):
+            return any(self.__zone_may_match__(zone, sub_t, conditions) for sub_t in t) if t else True
+
+        def contains(z, value):
+            if value is None:
+                return z[2] > 0
+            return z[0] is not None and z[0] <= value <= z[1]
+
+        try:
+            for col, value in (t or {}).items():
+                z = zone.get(col)  # None for expressions
+                if z is not None and not any(contains(z, v) for v in (value if isinstance(value, list) else [value])):
+                    return False
+            for col, op, value in conditions:
+                z = zone.get(col)
+                if z is None:
+                    continue
+                low, high = z[0], z[1]
+                if low is None:  # all NULL, which no condition matches
+                    return False
+                if op is operator.eq and not low <= value <= high or op is operator.lt and not low < value \
+                        or op is operator.le and not low <= value or op is operator.gt and not high > value \
+                        or op is operator.ge and not high >= value or op is operator.ne and low == high == value:
+                    return False
+                if op is CSVPlanner.like and isinstance(low, str):
+                    prefix = CSVPlanner.like_prefix(value)
+                    if prefix and (high < prefix or low[:len(prefix)] > prefix):
+                        return False
+        except TypeError:  # e.g. a text value compared with a number column
+            return True
+        return True
+
+    def __get_zone_ranges__(self, t=None, conditions=()):
+        """
+        :return: (start, end) rownum ranges of the blocks whose zone maps allow a match for the template and
+            parsed having conditions, adjacent blocks merged, or None if no block is skipped
+        """
+        zones = self.__zone_maps__
+        if not zones or not t and not conditions:
+            return None
+        block_size = self.zone_map_block_size
+        blocks = [block for block, zone in enumerate(zones) if self.__zone_may_match__(zone, t, conditions)]
+        if len(blocks) == len(zones):
+            return None
+        n_rows = len(self.__rows__ or ())
+        blocks += range(len(zones), -(-n_rows // block_size))  # rows not yet covered, if any
+        ranges = []
+        for block in blocks:
+            if ranges and ranges[-1][1] == block * block_size:
+                ranges[-1] = (ranges[-1][0], min((block + 1) * block_size, n_rows))
+            else:
+                ranges.append((block * block_size, min((block + 1) * block_size, n_rows)))
+        return ranges
+
+    def __iter_zones__(self, t=None, conditions=()):
+        """
+        :return: The rows of the blocks whose zone maps allow a match for the template and parsed having
+            conditions, in rownum order, including deleted rows as None. All rows if no block is skipped.
+        """
+        rows = self.__rows__ or []
+        ranges = self.__get_zone_ranges__(t, conditions)
+        if ranges is None:
+            return rows
+        return chain.from_iterable(rows[start:end] for start, end in ranges)
+
+    def __get_zone_map_file__(self):
+        """
+        :return: File the zone maps are saved in, in zone_map_cache_dir, or None if they are not saved: no
+            cache directory is set, the table is partitioned into several files or only some partitions are
+            loaded. The name includes a digest of the CSV file's path, so files of the same name do not collide.
+        """
+        if self.zone_map_cache_dir is None or self.__loaded_partitions__ is not None \
+                or (self.__partitioning__ or {}).get('directory') or not self.zone_map_block_size:
+            return None
+        file_name = os.path.abspath(self.__get_file_name__())
+        digest = hashlib.sha1(file_name.encode()).hexdigest()[:12]
+        return os.path.join(self.zone_map_cache_dir, "{}.{}.zones.json".format(os.path.basename(file_name), digest))
+
+    def __get_zone_map_stamp__(self):
+        stat = os.stat(self.__get_file_name__())
+        return [stat.st_size, stat.st_mtime_ns, self.zone_map_block_size, self.__get_column_names__()]
+
+    def __save_zone_maps__(self):
+        """
+        Saves the zone maps with the size and time of the CSV file, so they are only reused for the same
+        file. Rownums match the rows of the file only while there are no deleted rows.
+        """
+        file_name = self.__get_zone_map_file__()
+        if file_name is None or self.__zone_maps__ is None or self.__tombstones__:
+            return
+        try:
+            saved = json.dumps({'stamp': self.__get_zone_map_stamp__(), 'zones': self.__zone_maps__})
+            os.makedirs(self.zone_map_cache_dir, exist_ok=True)
+            with open(file_name, "w") as f:
+                f.write(saved)
+        except (OSError, TypeError, ValueError):  # e.g. a read-only directory; they are rebuilt on load
+            pass
+
+    def __load_zone_maps__(self):
+        """
+        :return: True if saved zone maps for the current CSV file were loaded
+        """
+        file_name = self.__get_zone_map_file__()
+        if file_name is None or not os.path.exists(file_name):
+            return False
+        try:
+            with open(file_name, "r") as f:
+                saved = json.load(f)
+            zones = saved['zones']
+            if saved['stamp'] != self.__get_zone_map_stamp__() \
+                    or len(zones) != -(-len(self.__rows__ or ()) // self.zone_map_block_size):
+                return False
+        except (OSError, ValueError, KeyError, TypeError):
+            return False
+        self.__zone_maps__ = zones
+        return True
+
+    def __get_pruned_partitions__(self, t=None, conditions=None):
+        """
+        Partition pruning: the partitions that can hold rows matching a template, or parsed having
+        conditions, on the partition column.
+        :return: Sorted list of partitions, or None if the table is not partitioned or nothing is pruned
+        """
+        if not self.__partitioning__ or self.__partitions__ is None:
+            return None
+        if t is not None:
+            partitions = CSVPartition.prune_template(self.__partitioning__, t)
+        else:
+            partitions = CSVPartition.prune(self.__partitioning__, conditions)
+        if partitions is None or len(partitions) == len(self.__partitions__):
+            return None
+        return partitions
+
+    def __prune_partitions__(self, t=None, conditions=None):
+        """
+        :return: Sorted rownums of the rows in the partitions left by pruning (see __get_pruned_partitions__),
+            or None if a full scan is as cheap
+        """
+        partitions = self.__get_pruned_partitions__(t, conditions)
+        if partitions is None:
+            return None
+        rownums = [self.__partitions__[partition] for partition in partitions]
+        if sum(len(r) for r in rownums) * CSVPlanner.index_row_cost > CSVPlanner.scan_cost(len(self.__rows__ or ())):
+            return None
+        return rownums[0] if len(rownums) == 1 else sorted(chain.from_iterable(rownums))
+
     def __get_column_names__(self):
         if not hasattr(self, '__column_names__'):
             self.__column_names__ = [col['column_name'] for col in self.__description__['columns']]
@@ -131,6 +563,21 @@ class CSVTable:
 
         return self.__column_names__
 
+    def __is_valid_column__(self, col):
+        """
+        :return: True if col is a column of the table, or an expression on one (see CSVExpression)
+        """
+        try:
+            return CSVExpression.get_column(col) in self.__get_column_names__()
+        except DataTableExceptions.DataTableException:
+            return False
+
+    def __get_value__(self, row, col):
+        """
+        :return: Value of a column, or of an expression on a column, in row
+        """
+        return row[col] if col in row else CSVExpression.evaluate(col, row)
+
     def __get_column_types__(self):
         if not hasattr(self, '__column_types__'):
             self.__column_types__ = {col['column_name']: col['column_type'] for col in self.__description__['columns']}
@@ -143,6 +590,77 @@ class CSVTable:
 
         return self.__not_null_cols__
 
+    def __get_converters__(self, header, dictionaries):
+        """
+        Resolves each column to its position in the CSV header, once per load, with the function that converts
+        its text. Columns with encoding 'auto' whose dictionary has grown too large are removed from
+        dictionaries and read as plain text from then on.
+        :param header: Column names from the first line of the CSV file.
+        :param dictionaries: Dict of column name -> dictionary for the dictionary encoded columns.
+        :return: List of (column name, position, converter or None to keep the text, not null)
+        """
+        positions = {name: pos for pos, name in enumerate(header)}  # as DictReader, the last duplicate wins
+        column_types = self.__get_column_types__()
+        encodings = self.__get_encodings__()
+
+        converters = []
+        for col in self.__get_column_names__():
+            if col not in positions:
+                raise DataTableExceptions.DataTableException(-2, "Invalid field in project")
+
+            if column_types[col] == "number":
+                convert = number
+            elif col in dictionaries:
+                if len(dictionaries[col]) > self.dictionary_max_distinct and encodings[col] == "auto":
+                    del dictionaries[col]  # too many distinct values to be worth sharing
+                    convert = None
+                else:
+                    convert = partial(intern_value, dictionaries[col])
+            else:
+                convert = None
+            converters.append((col, positions[col], convert))
+
+        return converters
+
+    def __get_encodings__(self):
+        """
+        :return: Dict of column name -> encoding ('auto', 'dictionary' or 'plain')
+        """
+        return {col['column_name']: col.get('encoding') or "auto" for col in self.__description__['columns']}
+
+    def __encode_row__(self, r):
+        """
+        Replaces text values in dictionary encoded columns with their shared copy, adding new values to the
+        dictionary. A column with encoding 'auto' stops being encoded once it has too many distinct values.
+        Called inside __writing__. Snapshots share the dictionaries, so a new value replaces them rather than
+        modifying them.
+        :param r: Row or change values, modified in place.
+        """
+        for col, value in r.items():
+            dictionary = self.__dictionaries__.get(col)
+            if dictionary is None or not isinstance(value, str):
+                continue
+            if value in dictionary:
+                r[col] = dictionary[value]
+                continue
+            dictionaries = dict(self.__dictionaries__)
+            if len(dictionary) >= self.dictionary_max_distinct and self.__get_encodings__()[col] == "auto":
+                dictionaries.pop(col)
+            else:
+                dictionaries[col] = dict(dictionary)
+                dictionaries[col][value] = value
+            self.__dictionaries__ = dictionaries
+
+    def __outside_dictionary__(self, t):
+        """
+        :return: True if the template compares a dictionary encoded column with a value that is not in its
+            dictionary, so no row can match and a scan can be skipped
+        """
+        if isinstance(t, list):
+            return all(self.__outside_dictionary__(sub_t) for sub_t in t)
+        return any(col in self.__dictionaries__ and val is not None and not isinstance(val, list)
+                   and val not in self.__dictionaries__[col] for col, val in t.items())
+
     def __get_file_name__(self):
         if not hasattr(self, '__file_name__'):
             self.__file_name__ = self.__description__['definition']['path']
@@ -151,10 +669,11 @@ class CSVTable:
 
     def __len__(self):
         if self.__rows__:
-            return len(self.__rows__) - self.__rows__.count(None)  # exclude deleted rows
+            return len(self.__rows__) - self.__tombstones__  # exclude deleted rows
         else:
             return 0
 
+    @CSVLock.read_locked
     def __str__(self, all=False, rownums=False):
         """
         You can do something simple here. The details of the string returned depend on what properties you
@@ -195,6 +714,107 @@ class CSVTable:
 
         return string
 
+    def __pin__(self):
+        """
+        Takes a snapshot: a view of the table sharing its current rows and indexes, which writers will not
+        modify in place while it is pinned. Release it with __unpin__.
+        :return: The view, a read-only CSVTable
+        """
+        self.__lock__.acquire_read()  # not in the middle of applying a write
+        try:
+            view = object.__new__(type(self))
+            view.__dict__.update(self.__dict__)
+            with self.__pins_lock__:
+                self.__pins__[self.__version__] = self.__pins__.get(self.__version__, 0) + 1
+        finally:
+            self.__lock__.release_read()
+        view.__snapshot_of__ = self
+        return view
+
+    def __unpin__(self, view):
+        with self.__pins_lock__:
+            count = self.__pins__[view.__version__] - 1
+            if count:
+                self.__pins__[view.__version__] = count
+            else:
+                del self.__pins__[view.__version__]
+
+    @contextmanager
+    def snapshot(self):
+        """
+        Snapshot isolation across several queries: with table.snapshot() as snap, every query on snap reads the
+        table as it was when the snapshot was taken, whatever is written meanwhile. Writers are not blocked.
+        The snapshot is read-only and is released when the with block ends.
+        """
+        view = self.__pin__()
+        try:
+            yield view
+        finally:
+            self.__unpin__(view)
+
+    @contextmanager
+    def __writing__(self):
+        """
+        Applies a write to the rows and indexes in memory. Holds the reader-writer lock exclusively, so no
+        snapshot is taken halfway through. If the current version is pinned by a snapshot, the table first
+        moves to a new version: the rows list is copied, and each index is copied when a writer first changes
+        it (see __own_index__ and __own_bucket__). Writers replace changed rows rather than modifying them.
+        Once no snapshot of an older version remains, the old versions are garbage and nothing more is copied.
+        """
+        self.__lock__.acquire_write()
+        try:
+            with self.__pins_lock__:
+                pinned = self.__version__ in self.__pins__
+                older_pinned = any(version != self.__version__ for version in self.__pins__)
+            if pinned:
+                if self.__rows__ is not None:
+                    self.__rows__ = list(self.__rows__)
+                self.indexes = dict(self.indexes)
+                self.__shared_indexes__ = set(self.indexes)
+                if self.__partitions__ is not None:
+                    self.__partitions__ = list(self.__partitions__)
+                    self.__owned_partitions__ = set()
+                if self.__zone_maps__ is not None:
+                    self.__zone_maps__ = list(self.__zone_maps__)  # blocks are replaced when widened, so stay shared
+                self.__version__ += 1
+            elif not older_pinned:
+                self.__shared_indexes__ = set()
+                for idx in self.indexes.values():
+                    idx.pop('owned', None)
+                self.__owned_partitions__ = None
+            yield
+        finally:
+            self.__writes__ += 1
+            self.__lock__.release_write()
+
+    def __own_index__(self, index_name):
+        """
+        :return: The index, copied first if it is still shared with a snapshot. Its buckets stay shared until
+            they are changed; 'owned' holds the keys whose buckets belong to this version.
+        """
+        if index_name in self.__shared_indexes__:
+            idx = dict(self.indexes[index_name])
+            idx['index'] = defaultdict(list, idx['index'])
+            if 'values' in idx:
+                idx['values'] = dict(idx['values'])
+            if 'sorted_keys' in idx:
+                idx['sorted_keys'] = list(idx['sorted_keys'])
+            idx['owned'] = set()
+            self.indexes[index_name] = idx
+            self.__shared_indexes__.discard(index_name)
+        return self.indexes[index_name]
+
+    def __own_bucket__(self, idx, key):
+        """
+        :return: The bucket for key, copied first if it is still shared with a snapshot, or None
+        """
+        bucket = idx['index'].get(key)
+        owned = idx.get('owned')
+        if bucket is not None and owned is not None and key not in owned:
+            bucket = idx['index'][key] = list(bucket)
+            owned.add(key)
+        return bucket
+
     def __add_row__(self, r):
         if not hasattr(self, '__rownum__'):
             self.__rownum__ = -1
@@ -222,7 +842,7 @@ class CSVTable:
             return
 
         if count < (n - 1):
-            n_dots = count // (n // bar_len)
+            n_dots = count // max(n // bar_len, 1)
             bar = '[' + ('.' * n_dots).ljust(bar_len) + '] ' + str(count * 100 // n).rjust(3) + '%'
         else:
             bar = '[' + ('.' * bar_len).ljust(bar_len) + '] ' + '100%'
@@ -251,26 +871,36 @@ class CSVTable:
         to_drop = []
         for index_name in self.indexes:
             index = defaultdict(list)
+            values = {}  # key -> column values, for index-only lookups
             data = self.indexes[index_name]
             columns = data['columns']
             rows = self.__rows__
             n = len(rows)
 
-            print("{}: Building index {} on {}\n\t\t\t\t\t".format(self.__table_name__, index_name, ','.join(columns)), end='')
-            self.__show_loading_bar__(0, 0)
+            verbose = self.__metrics__.verbose
+            if verbose:
+                print("{}: Building index {} on {}\n\t\t\t\t\t".format(self.__table_name__, index_name, ','.join(columns)), end='')
+                self.__show_loading_bar__(0, 0)
+            step = max(n // 100, 1)  # redraw the bar once per percent, not once per row
             start_time = time.time()
 
             for row in rows:
-                key, _ = self.__create_key_template__(row, columns)
+                key, key_t = self.__create_key_template__(row, columns)
 
                 if len(key) > 0:
-                    index[key].append(row['rownum'])
+                    bucket = index[key]
+                    if not bucket:
+                        values[key] = tuple(key_t.values())
+                    bucket.append(row['rownum'])
 
-                self.__show_loading_bar__(row['rownum'], n)
+                if verbose and row['rownum'] % step == 0:
+                    self.__show_loading_bar__(row['rownum'], n)
 
-            print("  {:.4f}s".format(time.time() - start_time))
+            if verbose:
+                self.__show_loading_bar__(n - 1, n)
+            self.__record__("build_index", start_time, label=None, rows_scanned=n, index=index_name)
             data['selectivity'] = self.__get_index_selectivity__(index)
-            if data['selectivity'] < 1.0:
+            if n and data['selectivity'] < 1.0:  # an empty table has no duplicates
                 if data['index_type'] == "UNIQUE":
                     print("Warning: Skipping unique index '{}' as it fails unique constraint.".format(data['index_name']))
                     to_drop.append(data['index_name'])
@@ -283,89 +913,341 @@ class CSVTable:
                     )
 
             data['index'] = index
+            data['values'] = values
+            data.pop('sorted_keys', None)
 
         for ind_name in to_drop:
             self.indexes.pop(ind_name)
 
     def __update_indexes__(self, fields, rownums=None, add=False, remove=False, inserting=False):
+        fields = set(CSVExpression.get_column(field) for field in fields)
+        columns = {ind_name: [CSVExpression.get_column(col) for col in ind['columns']]
+                   for ind_name, ind in self.indexes.items()}  # expression indexes change with their column
         if inserting:
-            indexes = [ind_name for ind_name, ind in self.indexes.items() if all(col in fields for col in ind['columns'])]
+            indexes = [ind_name for ind_name in self.indexes if all(col in fields for col in columns[ind_name])]
         else:
-            indexes = [ind_name for ind_name, ind in self.indexes.items() if any(col in fields for col in ind['columns'])]
+            indexes = [ind_name for ind_name in self.indexes if any(col in fields for col in columns[ind_name])]
 
         if rownums is None:
             rownums = range(len(self.__rows__))
         for index_name in indexes:
+            idx = self.__own_index__(index_name)
+            changes = {}  # key -> (key template, rownums), so each bucket is changed once per batch
             for rownum in rownums:
-                key, _ = self.__create_key_template__(self.__rows__[rownum], self.indexes[index_name]['columns'])
+                key, key_t = self.__create_key_template__(self.__rows__[rownum], idx['columns'])
                 if len(key) > 0:
-                    if add:
-                        self.indexes[index_name]['index'][key].append(rownum)
-                    if remove:
-                        self.indexes[index_name]['index'][key].remove(rownum)
-            self.indexes[index_name]['selectivity'] = self.__get_index_selectivity__(self.indexes[index_name]['index'])
+                    changes.setdefault(key, (key_t, []))[1].append(rownum)
+
+            for key, (key_t, key_rownums) in changes.items():
+                if add:
+                    self.__add_to_bucket__(idx, key, key_t, key_rownums)
+                if remove:
+                    self.__remove_from_bucket__(idx, key, key_rownums)
+            idx['selectivity'] = None  # recomputed when next needed, see __get_selectivity__
+
+    def __add_to_bucket__(self, idx, key, key_t, rownums):
+        """
+        Adds rownums to a bucket, keeping it sorted by rownum for find_page and index-only reads.
+        New rows have the highest rownums, so this is usually an append.
+        """
+        bucket = self.__own_bucket__(idx, key)
+        if bucket is None:
+            bucket = idx['index'][key] = []
+            if 'owned' in idx:
+                idx['owned'].add(key)
+            idx.setdefault('values', {})[key] = tuple(key_t.values())
+            if 'sorted_keys' in idx:
+                bisect.insort(idx['sorted_keys'], key)
+
+        rownums = sorted(rownums)
+        if not bucket or bucket[-1] < rownums[0]:
+            bucket.extend(rownums)
+        elif len(rownums) == 1:
+            bisect.insort(bucket, rownums[0])
+        else:
+            bucket[:] = list(heapq.merge(bucket, rownums))
+
+    def __remove_from_bucket__(self, idx, key, rownums):
+        """
+        Removes rownums from a bucket. A few rownums are found by bisection and deleted in place, which
+        costs O(log k) comparisons plus a memory move, instead of list.remove's O(k) comparisons; larger
+        batches filter the bucket in one pass. Emptied buckets are dropped so distinct counts stay exact.
+        """
+        bucket = self.__own_bucket__(idx, key)
+        if not bucket:
+            return
+
+        if len(rownums) <= 64:
+            for rownum in rownums:
+                i = bisect.bisect_left(bucket, rownum)
+                if i < len(bucket) and bucket[i] == rownum:
+                    del bucket[i]
+        else:
+            removed = set(rownums)
+            bucket[:] = [rownum for rownum in bucket if rownum not in removed]
+
+        if not bucket:
+            del idx['index'][key]
+            idx.get('values', {}).pop(key, None)
+            sorted_keys = idx.get('sorted_keys')
+            if sorted_keys:
+                i = bisect.bisect_left(sorted_keys, key)
+                if i < len(sorted_keys) and sorted_keys[i] == key:
+                    del sorted_keys[i]
+
+    def __get_selectivity__(self, idx):
+        """
+        :return: Selectivity of the index, recomputed only if the index changed since it was last computed
+        """
+        selectivity = idx.get('selectivity')
+        if selectivity is None:
+            with self.__get_index_lock__(idx):
+                selectivity = idx.get('selectivity')
+                if selectivity is None:
+                    selectivity = idx['selectivity'] = self.__get_index_selectivity__(idx['index'])
+        return selectivity
+
+    def __get_index_lock__(self, idx):
+        """
+        :return: Lock for the lazily built parts of an index. Writers hold the table's write lock instead.
+        """
+        lock = self.__index_locks__.get(idx['index_name'])
+        if lock is None:
+            lock = self.__index_locks__.setdefault(idx['index_name'], threading.Lock())  # atomic
+        return lock
 
     def __get_index_selectivity__(self, index):
         """
         :param index: Index (dict) with key->rownums pairs
         :return: Index selectivity
         """
+        if not self.__rows__:
+            return 0.0
         return len(index) / len(self.__rows__)
 
     def __create_key_template__(self, r, cols):
         key = ""
         t = {}
         for col in cols:
-            key += str(r[col]) + '_'
-            t[col] = r[col]
+            value = r[col] if col in r else CSVExpression.evaluate(col, r)  # index on an expression
+            key += str(value) + '_'
+            t[col] = value
         key = key.rstrip('_')
 
         return key, t
 
+    def __get_index_for_columns__(self, cols):
+        """
+        Returns the most selective index whose columns are all in cols, preferring the primary key.
+        :param cols: Column names.
+        :return: Index or None
+        """
+        pk_index = self.indexes.get('PRIMARY')
+        if pk_index and all(col in cols for col in pk_index['columns']):
+            return pk_index
+
+        possible_inds = [index for index_name, index in self.indexes.items()
+                         if index_name != "PRIMARY" and all(col in cols for col in index['columns'])]
+        if len(possible_inds) == 0:
+            return None
+        return max(possible_inds, key=self.__get_selectivity__)
+
     def __get_access_path__(self, tmp):
         """
-        Returns best index matching the set of keys in the template.
+        Returns the cheapest index matching the set of keys in the template.
+        Index costs use the size of the template key's bucket, which is exact, rather than the average.
+        Columns with IN lists are left to matches_template; see __get_index_merge__ for those.
         :param tmp: Query template.
-        :return: Index or None
+        :return: Index or None if a scan is cheaper
         """
+        if isinstance(tmp, list):  # OR'ed templates have no single bucket
+            return None
+        tmp = {col: val for col, val in tmp.items() if not isinstance(val, list)}
+
         pk_index = self.indexes.get('PRIMARY')
         if pk_index:
             # if primary key exists with necessary columns, it is obviously the most selective
             if all(col in list(tmp.keys()) for col in pk_index['columns']):
                 return pk_index
 
-        # compile list of valid indexes
-        possible_inds = []
+        best_ind = None
+        best_cost = CSVPlanner.scan_cost(len(self.__rows__ or ()))
         for index_name, index in self.indexes.items():
-            if index_name == "PRIMARY":
+            if index_name == "PRIMARY" or not all(col in tmp for col in index['columns']):
                 continue
-            if all(col in list(tmp.keys()) for col in index['columns']):
-                possible_inds.append(index)
 
-        if len(possible_inds) == 0:
-            return None
+            key, _ = self.__create_key_template__(tmp, index['columns'])
+            cost = CSVPlanner.index_cost(1, len(index['index'].get(key, ())))
+            if cost < best_cost or cost == best_cost and best_ind is not None \
+                    and self.__get_selectivity__(index) > self.__get_selectivity__(best_ind):
+                best_ind = index
+                best_cost = cost
+
+        return best_ind
+
+    def __get_index_keys__(self, t, cols):
+        """
+        :return: Keys to probe in an index on cols. An IN list gives one key per value, so a template with
+            several IN lists gives one key per combination.
+        """
+        values = [t[col] if isinstance(t[col], list) else [t[col]] for col in cols]
+        return [self.__create_key_template__(dict(zip(cols, combination)), cols)[0]
+                for combination in product(*values)]
+
+    def __use_index_merge__(self, t):
+        """
+        :return: True if the template needs __get_index_merge__: it is a list of OR'ed templates, has an
+            IN list, or is covered by no primary key but by more than one index.
+        """
+        if isinstance(t, list) or any(isinstance(val, list) for val in t.values()):
+            return True
+        pk_index = self.indexes.get('PRIMARY')
+        if pk_index and all(col in t for col in pk_index['columns']):
+            return False
+        return sum(all(col in t for col in index['columns']) for index in self.indexes.values()) > 1
+
+    def __probe_template__(self, t):
+        """
+        Rownums that may match a template (without ORs), found from index buckets alone. Every index
+        whose columns are all in the template is a candidate; an IN list unions the buckets of its values.
+        Starting from the smallest, further indexes are intersected in while building their rownum set is
+        expected to cost less than fetching and checking the rows it would remove.
+        :return: (set of rownums, names of the indexes used), or (None, []) if no index applies
+        """
+        n = max(len(self.__rows__ or ()), 1)
+        candidates = []
+        for index_name, index in self.indexes.items():
+            if not all(col in t for col in index['columns']):
+                continue
+            buckets = [index['index'].get(key, ()) for key in self.__get_index_keys__(t, index['columns'])]
+            candidates.append((sum(len(bucket) for bucket in buckets), index_name, index['columns'], buckets))
+        candidates.sort(key=lambda c: c[0])
+
+        rownums = None
+        used = []
+        covered = set()
+        for size, index_name, columns, buckets in candidates:
+            if rownums is not None:
+                if covered.issuperset(columns):  # e.g. a prefix of an index already used
+                    continue
+                # sizes only grow and rownums only shrink, so no later index pays off either
+                if size * CSVPlanner.rownum_set_cost >= len(rownums) * (1 - size / n) * CSVPlanner.index_row_cost:
+                    break
+            probed = set()
+            for bucket in buckets:
+                probed.update(bucket)
+            rownums = probed if rownums is None else rownums & probed
+            used.append(index_name)
+            covered.update(columns)
+
+        return rownums, used
+
+    def __get_index_merge__(self, t):
+        """
+        Index merge: answers IN lists and ORs by unioning index probes, and templates covered only by
+        several partial indexes by intersecting their rownum sets, before any row is touched.
+        :param t: Template, or a list of templates to OR.
+        :return: (sorted rownums to check against the template, names of the indexes used), or (None, [])
+            if some OR'ed template has no usable index or checking the rownums would cost more than a scan
+        """
+        rownums = set()
+        used = []
+        for sub_t in t if isinstance(t, list) else [t]:
+            probed, names = self.__probe_template__(sub_t)
+            if probed is None:  # this part needs a scan, so the whole OR does
+                return None, []
+            rownums |= probed
+            used.extend(name for name in names if name not in used)
+
+        if len(rownums) * CSVPlanner.index_row_cost > CSVPlanner.scan_cost(len(self.__rows__ or ())):
+            return None, []
+        return sorted(rownums), used
+
+    def __get_column_stats__(self, col):
+        """
+        :return: Statistics for col from the last analyze(). If it has not been analyzed, a distinct count
+            taken from a single-column index or the dictionary of col, or None.
+        """
+        stats = getattr(self, '__statistics__', {}).get(col)
+        if stats:
+            return stats
+
+        for index in self.indexes.values():
+            if index['columns'] == [col] and index.get('index') is not None:
+                return {'row_count': len(self), 'distinct': len(index['index']), 'null_frac': 0.0}
+        if col in self.__dictionaries__:  # may include values no live row has any more
+            return {'row_count': len(self), 'distinct': len(self.__dictionaries__[col]), 'null_frac': 0.0}
+        return None
+
+    def __estimate_distinct__(self, cols):
+        """
+        :return: Estimated number of distinct values of the combination of cols
+        """
+        n = max(len(self), 1)
+        for index in self.indexes.values():
+            if sorted(index['columns']) == sorted(cols) and index.get('index') is not None:
+                return max(len(index['index']), 1)
+
+        distinct = 1
+        for col in cols:
+            stats = self.__get_column_stats__(col)
+            distinct *= stats['distinct'] if stats and stats.get('distinct') else n * CSVPlanner.default_eq_selectivity
+        return max(min(distinct, n), 1)
+
+    def __estimate_rows__(self, t, conditions=()):
+        """
+        Estimates how many rows match a template and parsed having conditions.
+        :return: (index that would be used for the template or None, estimated rows)
+        """
+        if isinstance(t, list):  # OR'ed templates, assumed disjoint
+            rows = sum(self.__estimate_rows__(sub_t, conditions)[1] for sub_t in t)
+            return None, min(rows, len(self))
+
+        def index_rows(idx):
+            return sum(len(idx['index'].get(key, ())) for key in self.__get_index_keys__(t, idx['columns']))
+
+        index = self.__get_access_path__(t) if t else None
+        if index is None and t and any(isinstance(val, list) for val in t.values()):
+            covering = [idx for idx in self.indexes.values() if all(col in t for col in idx['columns'])]
+            index = min(covering, key=index_rows, default=None)
+        if index:
+            rows = index_rows(index)
+            remaining = [col for col in t if col not in index['columns']]
         else:
-            # select index with highest selectivity
-            ind_selx = [ind['selectivity'] for ind in possible_inds]
-            best_ind = possible_inds[ind_selx.index(max(ind_selx))]
-            return best_ind
+            rows = len(self)
+            remaining = list(t)
+
+        for col in remaining:
+            values = t[col] if isinstance(t[col], list) else [t[col]]
+            rows *= min(sum(CSVPlanner.selectivity(self.__get_column_stats__(col), operator.eq, val)
+                            for val in values), 1.0)
+        for col, op, val in conditions:
+            rows *= CSVPlanner.selectivity(self.__get_column_stats__(col), op, val)
+
+        return index, rows
 
     def matches_template(self, row, t):
         """
         :param row: A single dictionary representing a row in the table.
-        :param t: A template
+        :param t: A template. A list value is an IN list; a list of templates matches if any of them does.
         :return: True if the row matches the template.
         """
         if t is None:
             return True
         if row is None:
             return False
+        if isinstance(t, list):
+            return any(self.matches_template(row, sub_t) for sub_t in t)
 
         try:
-            if any(row.get(n) != t[n] for n in t.keys()):
-                return False
-            else:
-                return True
+            for n, v in t.items():
+                value = row[n] if n in row else CSVExpression.evaluate(n, row)
+                if isinstance(v, list):
+                    if value not in v:
+                        return False
+                elif value != v:
+                    return False
+            return True
         except Exception as e:
             raise (e)
 
@@ -394,6 +1276,21 @@ class CSVTable:
             # happens if the requested field not in rows.
             raise DataTableExceptions.DataTableException(-2, "Invalid field in project")
 
+    def __record__(self, operation, start_time, show_time=False, label="Fetch time", **metrics):
+        """
+        Records metrics for an operator call that started at start_time. See CSVMetrics.MetricsRegistry.record.
+        :param show_time: Print the time even if the registry is not verbose.
+        :param label: Label for the printed time, or None to print it after a loading bar.
+        """
+        seconds = time.time() - start_time
+        if show_time or self.__metrics__.verbose:
+            if label:
+                print("{}: {:.4f}s".format(label, seconds))
+            else:  # follows a loading bar
+                print("  {:.4f}s".format(seconds))
+
+        return self.__metrics__.record(self.__table_name__, operation, seconds, **metrics)
+
     def __get_sub_where_clause__(self, t):
         sub_t = {}
         columns = self.__get_column_names__()
@@ -424,87 +1321,209 @@ class CSVTable:
 
         return result
 
-    def __find_by_template_scan__(self, t, fields=None, rownums=None):
+    def __project_row__(self, r, fields):
         """
-        Returns rows that match the template and the requested fields if any.
-        Returns all rows if template is None and all columns if fields is None.
+        Projects a single row. Returns the row itself if fields is None.
         """
-        if self.__rows__ is not None:
-
-            result = []
+        if fields is None:
+            return r
+        try:
+            return {field: r[field] for field in fields}
+        except KeyError:
+            raise DataTableExceptions.DataTableException(-2, "Invalid field in project")
 
-            rows = self.__rows__
-            if rownums:
-                for rownum in rownums:
-                    if self.matches_template(rows[rownum], t):
-                        result.append(rows[rownum])
-            else:
-                # Add the rows that match the template to the newly created table.
-                for r in rows:
-                    if self.matches_template(r, t):
-                        result.append(r)
+    def __iter_by_template_scan__(self, t, fields=None, rownums=None):
+        """
+        Generator version of __find_by_template_scan__.
+        """
+        matching = CSVParallel.iter_matching(self, t, rownums=rownums or None)
+        if matching is not None:
+            for r in matching:
+                yield self.__project_row__(r, fields)
+            return
 
-            result = self.project(result, fields)
+        rows = self.__rows__
+        if rownums:
+            candidates = (rows[rownum] for rownum in rownums)
         else:
-            result = None
+            candidates = self.__iter_zones__(t)
 
-        return result
+        for r in candidates:
+            if self.matches_template(r, t):
+                yield self.__project_row__(r, fields)
 
-    def __find_by_template_index__(self, t, idx, fields=None, rownums=None):
+    def __is_index_only__(self, t, idx, fields):
         """
-        Find using a selected index
+        :return: True if the index covers the query: the template is on exactly the index columns and the
+            fields are index columns (or rownum), so results can be built from index entries alone.
         """
-        if self.__rows__ is not None:
-            result = []
+        return fields is not None and isinstance(t, dict) and 'values' in idx and set(t) == set(idx['columns']) \
+            and all(f in idx['columns'] and CSVExpression.parse(f) is None or f == 'rownum' for f in fields)
 
-            index = idx['index']
-            idx_cols = idx['columns']
-            key, _ = self.__create_key_template__(t, idx_cols)
+    def __get_covering_index__(self, t, fields):
+        """
+        :return: An index that answers the template and fields on its own (see __is_index_only__), or None
+        """
+        return next((idx for idx in self.indexes.values() if self.__is_index_only__(t, idx, fields)), None)
 
-            if index.get(key) is None:
-                return None
+    def __iter_index_only__(self, t, idx, fields, rownums=None):
+        """
+        Index-only (covering index) lookup. Rows are rebuilt from the key values stored with the index and
+        the rownums in its buckets, without reading __rows__. IN lists probe one key each; the buckets are
+        merged so rows still come in rownum order. Only valid if __is_index_only__.
+        """
+        def entries(bucket, values):
+            for rownum in bucket:
+                if not rownums or rownum in rownums:
+                    yield rownum, values
+
+        if rownums and not isinstance(rownums, (set, frozenset)):
+            rownums = set(rownums)
+        columns = idx['columns']
+        streams = []
+        for key in self.__get_index_keys__(t, columns):
+            bucket = idx['index'].get(key)
+            if not bucket:
+                continue
+            values = dict(zip(columns, idx['values'][key]))
+            if self.matches_template(values, t):  # keys are strings, so '2000' would also find 2000
+                streams.append(entries(bucket, values))
 
-            if rownums:
-                # when doing equijoin, probe rows have already been found from where clause,
-                # so we simply take the intersection of these rows with the on template rows
-                rownums = set(index[key]) & set(rownums)
-            else:
-                rownums = index[key]
+        for rownum, values in heapq.merge(*streams, key=lambda e: e[0]):
+            yield {field: rownum if field == 'rownum' else values[field] for field in fields}
 
-            for rownum in rownums:
-                r = self.__rows__[rownum]
-                if self.matches_template(r, t):
-                    result.append(r)
+    def __iter_by_template_index__(self, t, idx, fields=None, rownums=None):
+        """
+        Generator version of __find_by_template_index__.
+        """
+        if self.__is_index_only__(t, idx, fields):
+            yield from self.__iter_index_only__(t, idx, fields, rownums=rownums)
+            return
+
+        index = idx['index']
+        key, _ = self.__create_key_template__(t, idx['columns'])
+        bucket = index.get(key)
+        if bucket is None:
+            return
+
+        if rownums:
+            # when doing equijoin, probe rows have already been found from where clause,
+            # so we simply take the intersection of these rows with the on template rows
+            if not isinstance(rownums, (set, frozenset)):
+                rownums = set(rownums)
+            bucket = [rownum for rownum in bucket if rownum in rownums]
+
+        for rownum in bucket:
+            r = self.__rows__[rownum]
+            if self.matches_template(r, t):
+                yield self.__project_row__(r, fields)
 
-            result = self.project(result, fields)
+    def __find_by_template_scan__(self, t, fields=None, rownums=None):
+        """
+        Returns rows that match the template and the requested fields if any.
+        Returns all rows if template is None and all columns if fields is None.
+        """
+        if self.__rows__ is not None:
+            result = list(self.__iter_by_template_scan__(t, fields, rownums=rownums))
         else:
             result = None
 
         return result
 
-    def find_by_template(self, t, fields=None, limit=None, offset=None, rownums=None, show_time=True):
+    def __find_by_template_index__(self, t, idx, fields=None, rownums=None):
         """
-        Returns rows which match template
+        Find using a selected index
         """
-        usage = "Usage: <CSVTable>.find_by_template({where clause}, fields=[], limit=<int>, offset=<int>)"
-        if not isinstance(t, (dict, OrderedDict)) or fields and not isinstance(fields, list) \
+        if self.__rows__ is not None:
+            key, _ = self.__create_key_template__(t, idx['columns'])
+            if idx['index'].get(key) is None:
+                return None
+
+            result = list(self.__iter_by_template_index__(t, idx, fields, rownums=rownums))
+        else:
+            result = None
+
+        return result
+
+    @staticmethod
+    def __normalize_template__(t):
+        """
+        :return: The template, or list of templates, with expression keys written without spaces, as index
+            definitions and having conditions write them
+        """
+        if isinstance(t, list):
+            return [CSVTable.__normalize_template__(sub_t) for sub_t in t]
+        if not any(' ' in col for col in t):
+            return t
+        return type(t)((CSVExpression.normalize(col), val) for col, val in t.items())
+
+    def __check_find_args__(self, t, fields, limit, offset, usage):
+        """
+        :return: The template, normalized, so expressions match the functional indexes on them
+        """
+        templates = t if isinstance(t, list) and t else [t]
+        if not all(isinstance(sub_t, (dict, OrderedDict)) for sub_t in templates) \
+                or fields and not isinstance(fields, list) \
                 or limit and not isinstance(limit, int) or offset and not isinstance(offset, int):
             raise DataTableExceptions.DataTableException(
                 code=DataTableExceptions.DataTableException.invalid_method_call,
                 message=usage
             )
-
-        start_time = time.time()
-        if not all(col in self.__get_column_names__() for col in t.keys()):
+        if not all(self.__is_valid_column__(col) for sub_t in templates for col in sub_t.keys()):
             raise DataTableExceptions.DataTableException(
                 code=DataTableExceptions.DataTableException.invalid_column_definition,
                 message="Invalid columns in where template")
+        return self.__normalize_template__(t)
+
+    def __find__(self, t, fields=None, rownums=None):
+        """
+        find_by_template without argument checks or metrics, for use inside other operators.
+        :return: (rows, access path, names of the indexes used, number of rows examined)
+        """
+        merged = None
+        if self.__use_index_merge__(t):
+            covering = self.__get_covering_index__(t, fields)
+            if covering:  # IN lists on the columns of a covering index
+                result = list(self.__iter_index_only__(t, covering, fields, rownums=rownums))
+                return result, "index_only", [covering['index_name']], len(result)
+            merged, used = self.__get_index_merge__(t)
+        if merged is not None:
+            if rownums:
+                rownums = rownums if isinstance(rownums, (set, frozenset)) else set(rownums)
+                merged = [rownum for rownum in merged if rownum in rownums]
+            result = list(self.__iter_by_template_scan__(t, fields, rownums=merged)) if merged else []
+            return result, "index_merge", used, len(merged)
 
         index = self.__get_access_path__(t)
         if index:
             result = self.__find_by_template_index__(t, index, fields, rownums=rownums)
-        else:
-            result = self.__find_by_template_scan__(t, fields, rownums=rownums)
+            key, _ = self.__create_key_template__(t, index['columns'])
+            return result, "index_only" if self.__is_index_only__(t, index, fields) else "index", \
+                [index['index_name']], len(index['index'].get(key, ()))
+
+        if self.__outside_dictionary__(t):
+            return [], "dictionary", [], 0
+        pruned = self.__prune_partitions__(t) if not rownums else None
+        if pruned is not None:
+            result = list(self.__iter_by_template_scan__(t, fields, rownums=pruned)) if pruned else []
+            return result, "partition", [], len(pruned)
+        result = self.__find_by_template_scan__(t, fields, rownums=rownums)
+        return result, "scan", [], len(rownums) if rownums else len(self.__rows__ or ())
+
+    @CSVLock.read_locked
+    def find_by_template(self, t, fields=None, limit=None, offset=None, rownums=None, show_time=False):
+        """
+        Returns rows which match template.
+        A list value is an IN list, {'teamID': ['NYA', 'BOS']}, and a list of templates is an OR,
+        [{'teamID': 'NYA'}, {'lgID': 'NL'}]. These, and templates covered only by several partial indexes,
+        are answered by index merge: rownums from the index buckets are unioned or intersected first, and
+        only the surviving rows are read.
+        """
+        usage = "Usage: <CSVTable>.find_by_template({where clause}, fields=[], limit=<int>, offset=<int>)"
+        start_time = time.time()
+        t = self.__check_find_args__(t, fields, limit, offset, usage)
+
+        result, access_path, indexes, scanned = self.__find__(t, fields, rownums=rownums)
 
         if offset:
             result = result[offset:]
@@ -512,10 +1531,131 @@ class CSVTable:
             if len(result) > limit:
                 result = result[:limit]
 
-        if show_time:
-            print("Fetch time: {:.4f}s".format(time.time() - start_time))
+        self.__record__("find_by_template", start_time, show_time=show_time,
+                        rows_scanned=scanned, rows_returned=len(result) if result else 0,
+                        access_path=access_path, index=",".join(indexes) or None, query=t)
         return result
 
+    @CSVLock.read_locked_iter
+    def iter_by_template(self, t, fields=None, limit=None, offset=None):
+        """
+        Lazy version of find_by_template. Rows are yielded one at a time from the index or scan path,
+        so the caller may stop early and memory use does not grow with the number of matches.
+        :return: Iterator over matching (projected) rows
+        """
+        usage = "Usage: <CSVTable>.iter_by_template({where clause}, fields=[], limit=<int>, offset=<int>)"
+        t = self.__check_find_args__(t, fields, limit, offset, usage)  # checked now, not on first next()
+
+        if self.__rows__ is None:
+            return iter([])
+        merged = covering = None
+        if self.__use_index_merge__(t):
+            covering = self.__get_covering_index__(t, fields)
+            merged = self.__get_index_merge__(t)[0] if covering is None else None
+        if covering:
+            result = self.__iter_index_only__(t, covering, fields)
+        elif merged is not None:
+            result = self.__iter_by_template_scan__(t, fields, rownums=merged) if merged else iter([])
+        else:
+            index = self.__get_access_path__(t)
+            if index:
+                result = self.__iter_by_template_index__(t, index, fields)
+            elif self.__outside_dictionary__(t):
+                result = iter([])
+            else:
+                pruned = self.__prune_partitions__(t)
+                if pruned is not None:
+                    result = self.__iter_by_template_scan__(t, fields, rownums=pruned) if pruned else iter([])
+                else:
+                    result = self.__iter_by_template_scan__(t, fields)
+
+        start = offset or 0
+        return islice(result, start, start + limit if limit else None)
+
+    def __get_cursor_digest__(self, t, fields):
+        # rownums change on vacuum, so cursors from before one do not match
+        query = json.dumps([self.__table_name__, t, fields, self.__vacuum_epoch__], sort_keys=True, default=str)
+        return hashlib.sha1(query.encode()).hexdigest()[:16]
+
+    def __encode_cursor__(self, t, fields, pos):
+        # pos is a rownum, valid on either access path, so the cursor need not record the index key
+        cursor = {'q': self.__get_cursor_digest__(t, fields), 'p': pos}
+        return base64.urlsafe_b64encode(json.dumps(cursor).encode()).decode()
+
+    def __decode_cursor__(self, cursor, t, fields):
+        """
+        :return: Row position the cursor resumes after.
+        """
+        try:
+            decoded = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+            pos = decoded['p']
+            valid = decoded['q'] == self.__get_cursor_digest__(t, fields) and isinstance(pos, int)
+        except Exception:
+            valid = False
+        if not valid:
+            raise DataTableExceptions.DataTableException(
+                code=DataTableExceptions.DataTableException.invalid_method_call,
+                message="Invalid cursor for this query on table {}".format(self.__table_name__)
+            )
+
+        return pos
+
+    @CSVLock.read_locked
+    def find_page(self, t, fields=None, page_size=100, cursor=None):
+        """
+        Keyset pagination over the rows matching a template. Rows are returned in rownum order, and
+        each call resumes directly after the last row of the previous page, either by bisecting the
+        index bucket, which every write keeps sorted by rownum (see __add_to_bucket__), or by starting the
+        scan at that row, so every page costs the same regardless of depth. Rows written behind the cursor
+        are not revisited; vacuum() expires cursors, as it renumbers rows.
+        :param t: Template, as for find_by_template.
+        :param fields: Fields to return.
+        :param page_size: Maximum number of rows per page.
+        :param cursor: Cursor returned by the previous call, or None for the first page.
+        :return: (rows, next cursor). The next cursor is None on the last page.
+        """
+        usage = "Usage: <CSVTable>.find_page({where clause}, fields=[], page_size=<int>, cursor=<cursor>)"
+        start_time = time.time()
+        t = self.__check_find_args__(t, fields, page_size, None, usage)
+        if not isinstance(page_size, int) or page_size < 1 or cursor is not None and not isinstance(cursor, str):
+            raise DataTableExceptions.DataTableException(
+                code=DataTableExceptions.DataTableException.invalid_method_call,
+                message=usage
+            )
+
+        after = self.__decode_cursor__(cursor, t, fields) if cursor else -1
+        rows = self.__rows__ or []
+
+        index = self.__get_access_path__(t) if getattr(self, 'indexes', None) else None
+        if index:
+            key, _ = self.__create_key_template__(t, index['columns'])
+            bucket = index['index'].get(key, [])
+            positions = (bucket[i] for i in range(bisect.bisect_right(bucket, after), len(bucket)))
+        else:
+            positions = range(after + 1, len(rows))
+
+        page = []
+        last = None
+        has_more = False
+        scanned = 0
+        for pos in positions:
+            scanned += 1
+            r = rows[pos]
+            if not self.matches_template(r, t):
+                continue
+            if len(page) == page_size:
+                has_more = True
+                break
+            page.append(self.__project_row__(r, fields))
+            last = pos
+
+        next_cursor = self.__encode_cursor__(t, fields, last) if has_more else None
+        self.__record__("find_page", start_time, rows_scanned=scanned, rows_returned=len(page),
+                        access_path="index" if index else "scan",
+                        index=index['index_name'] if index else None, query=t)
+        return page, next_cursor
+
+    @CSVLock.write_locked
     def insert(self, r):
         """
         Inserts row into table
@@ -548,18 +1688,25 @@ class CSVTable:
         p_ind = self.indexes.get("PRIMARY")
         if p_ind:
             key, _ = self.__create_key_template__(r, p_ind['columns'])
-            if len(p_ind['index'][key]) > 0:
+            if p_ind['index'].get(key):
                 raise DataTableExceptions.DataTableException(
                     code=DataTableExceptions.DataTableException.duplicate_row_pk,
                     message="Insert failed; duplicate entry for key PRIMARY."
                 )
 
+        partition = None
+        if self.__partitioning__:
+            partition = CSVPartition.partition_of(self.__partitioning__, r.get(self.__partitioning__['column']))
+            self.__check_partition_loaded__(partition)
+        file_name = CSVPartition.partition_file(self.__partitioning__, self.__table_name__, partition) \
+            if partition is not None and self.__partitioning__.get('directory') else self.__file_name__
+
         # __file_name__ = "../data/Pitching2.csv"
         try:
-            with open(self.__file_name__, "r") as csvfile:
-                reader = csv.DictReader(open(self.__file_name__, "r"), delimiter=",", quotechar='"')
+            with open(file_name, "r") as csvfile:
+                reader = csv.DictReader(open(file_name, "r"), delimiter=",", quotechar='"')
                 fields = reader.fieldnames
-            with open(self.__file_name__, "a") as csvfile:
+            with open(file_name, "a") as csvfile:
                 writer = csv.DictWriter(csvfile, fields,
                                         delimiter=",", quotechar='"', quoting=csv.QUOTE_ALL)
                 writer.writerow(r)
@@ -569,9 +1716,17 @@ class CSVTable:
                 message="Insert failed; error while writing to file"
             )
 
-        rownum = self.__add_row__(copy.deepcopy(r))
-        self.__update_indexes__(r.keys(), [rownum], add=True, inserting=True)
-
+        row = copy.deepcopy(r)
+        with self.__writing__():
+            self.__encode_row__(row)
+            rownum = self.__add_row__(row)
+            self.__update_indexes__(r.keys(), [rownum], add=True, inserting=True)
+            if partition is not None:
+                self.__own_partition__(partition).append(rownum)
+            self.__widen_zones__(rownum, row, inserting=True)
+        self.__save_zone_maps__()
+
+    @CSVLock.write_locked
     def delete(self, t):
         """
         Delete rows matching template
@@ -589,43 +1744,152 @@ class CSVTable:
                 message=usage
             )
         for col in t.keys():
-            if col not in self.__get_column_names__():
+            if not self.__is_valid_column__(col):
                 raise DataTableExceptions.DataTableException(
                     code=DataTableExceptions.DataTableException.unknown_column,
                     message="Unknown column '{}' in where clause\n".format(col) + usage
                 )
 
-        rows_to_delete = self.find_by_template(t, show_time=False)
+        rows_to_delete = self.find_by_template(t, show_time=False) or []
         rownums = set([row['rownum'] for row in rows_to_delete])
 
         try:
-            rows = []
-            with open(self.__file_name__, "r") as csvfile:
-                reader = csv.DictReader(open(self.__file_name__, "r"), delimiter=",", quotechar='"')
-                for r in reader:
-                    while (reader.line_num - 2) in self.__deleted_rows__:
-                        reader.line_num += 1  # account for deleted rows
-                    if (reader.line_num - 2) in rownums:
-                        continue
-                    else:
-                        rows.append(r)
-                fields = reader.fieldnames
-            with open(self.__file_name__, "w") as csvfile:
-                writer = csv.DictWriter(csvfile, fields,
-                                        delimiter=",", quotechar='"', quoting=csv.QUOTE_ALL)
-                writer.writeheader()
-                writer.writerows(rows)
+            for file_name, file_rownums, _ in self.__get_files_to_rewrite__(rownums):
+                self.__rewrite_file__(file_name, file_rownums, lambda r, rownum: None if rownum in rownums else r)
+        except DataTableExceptions.DataTableException:
+            raise
         except Exception:
             raise DataTableExceptions.DataTableException(
                 code=DataTableExceptions.DataTableException.io_error,
                 message="Delete failed; error while writing to file"
             )
 
-        self.__update_indexes__(t.keys(), rownums, remove=True)
-        self.__deleted_rows__.extend(list(rownums))
+        with self.__writing__():
+            self.__update_indexes__(self.__get_column_names__(), rownums, remove=True)  # index-only reads skip rows
+            if self.__partitions__ is not None:
+                self.__move_partitions__(rownums, None)
+            for rownum in rownums:
+                self.__rows__[rownum] = None
+            self.__tombstones__ += len(rownums)
+
+        if self.__tombstones__ > self.autovacuum_threshold + self.autovacuum_scale_factor * len(self.__rows__):
+            self.vacuum()
+
+    def __iter_live_rownums__(self):
+        """
+        :return: Rownums of the rows not deleted, in order. These match the data rows of the CSV file.
+        """
+        return (r['rownum'] for r in self.__rows__ or () if r is not None)
+
+    def __get_files_to_rewrite__(self, rownums):
+        """
+        :return: (file name, rownums of the rows in the file in order, partition or None) for each file that
+            holds one of rownums. Partitions stored in their own files are rewritten only if they hold one.
+        """
+        partitioning = self.__partitioning__
+        if not partitioning or not partitioning.get('directory'):
+            if self.__loaded_partitions__ is not None:  # the file holds rows that were not loaded
+                raise DataTableExceptions.DataTableException(
+                    code=DataTableExceptions.DataTableException.invalid_operation,
+                    message="Cannot rewrite {}; only some of its partitions are loaded".format(self.__file_name__))
+            return [(self.__file_name__, list(self.__iter_live_rownums__()), None)] if rownums else []
+
+        files = []
+        for partition, partition_rownums in enumerate(self.__partitions__):
+            if any(rownum in rownums for rownum in partition_rownums):
+                files.append((CSVPartition.partition_file(partitioning, self.__table_name__, partition),
+                              partition_rownums, partition))
+        return files
+
+    def __rewrite_file__(self, file_name, file_rownums, edit, extra=()):
+        """
+        Rewrites a CSV file of the table.
+        :param file_rownums: Rownums of the rows in the file, in order.
+        :param edit: Function (record, rownum) returning the record to write, or None to drop the row.
+        :param extra: (rownum, record) pairs to add, placed among the other rows by rownum.
+        """
+        rows = []
+        with open(file_name, "r") as csvfile:
+            reader = csv.DictReader(csvfile, delimiter=",", quotechar='"')
+            for r, rownum in zip(reader, file_rownums):  # deleted rows are not in the file
+                r = edit(r, rownum)
+                if r is not None:
+                    rows.append((rownum, r))
+            fields = reader.fieldnames
+        if extra:
+            rows = sorted(rows + list(extra), key=lambda e: e[0])
+        with open(file_name, "w") as csvfile:
+            writer = csv.DictWriter(csvfile, fields,
+                                    delimiter=",", quotechar='"', quoting=csv.QUOTE_ALL)
+            writer.writeheader()
+            writer.writerows(r for _, r in rows)
+
+    def __move_partitions__(self, rownums, partition):
+        """
+        Moves rows to another partition, or removes them from their partitions if partition is None.
+        Called with the rows before they change.
+        """
+        col = self.__partitioning__['column']
+        moving = defaultdict(set)  # old partition -> rownums
         for rownum in rownums:
-            self.__rows__[rownum] = None
+            old = CSVPartition.partition_of(self.__partitioning__, self.__rows__[rownum].get(col))
+            if old != partition:
+                moving[old].add(rownum)
+        changed = {}  # partition -> its new rownum list
+        for old, moved in moving.items():
+            changed[old] = [rownum for rownum in self.__partitions__[old] if rownum not in moved]
+            if partition is not None:
+                changed[partition] = sorted(changed.get(partition, self.__partitions__[partition]) + list(moved))
+        for p, partition_rownums in changed.items():
+            self.__partitions__[p] = partition_rownums
+            if self.__owned_partitions__ is not None:
+                self.__owned_partitions__.add(p)
+
+    @CSVLock.write_locked
+    def vacuum(self):
+        """
+        Compacts the row store. Deleted rows (tombstones) are dropped, the live rows are renumbered
+        0..n-1 in their current order, and every index bucket is rewritten in one pass. Renumbering keeps
+        the order of rownums, so buckets stay sorted. Runs automatically from delete() once the tombstones
+        exceed autovacuum_threshold + autovacuum_scale_factor * rows. find_page cursors taken before a
+        vacuum are no longer valid.
+        :return: Number of tombstones removed
+        """
+        if not self.__tombstones__:
+            return 0
 
+        start_time = time.time()
+        with self.__writing__():
+            rows = self.__rows__
+            new_rownums = [None] * len(rows)
+            live = []
+            for r in rows:
+                if r is not None:
+                    new_rownums[r['rownum']] = len(live)
+                    if r['rownum'] != len(live):
+                        r = dict(r, rownum=len(live))  # snapshots may still read the old row
+                    live.append(r)
+
+            for index_name in list(self.indexes):
+                index = self.__own_index__(index_name)['index']
+                for key, bucket in index.items():
+                    index[key] = [new_rownums[rownum] for rownum in bucket]
+                self.indexes[index_name].pop('owned', None)  # every bucket is new
+                self.indexes[index_name]['selectivity'] = None
+
+            removed = len(rows) - len(live)
+            self.__rows__ = live
+            self.__rownum__ = len(live) - 1
+            self.__tombstones__ = 0
+            self.__vacuum_epoch__ += 1
+            self.__build_partitions__()
+            self.__build_zone_maps__()
+        self.__save_zone_maps__()
+
+        self.__record__("vacuum", start_time, rows_scanned=len(rows), rows_returned=len(live))
+        return removed
+
+    @CSVLock.write_locked
     def update(self, t, change_values):
         """
         Update rows matching template with new values
@@ -643,51 +1907,191 @@ class CSVTable:
                 message=usage
             )
         for col in t.keys():
-            if col not in self.__get_column_names__():
+            if not self.__is_valid_column__(col):
                 raise DataTableExceptions.DataTableException(
                     code=DataTableExceptions.DataTableException.unknown_column,
                     message="Unknown column '{}' in where clause\n".format(col) + usage
                 )
 
-        rows_to_update = self.find_by_template(t, show_time=False)
+        rows_to_update = self.find_by_template(t, show_time=False) or []
         rownums = set([row['rownum'] for row in rows_to_update])
 
+        partition = None  # where the rows move, if the partition column changes
+        if self.__partitioning__ and self.__partitioning__['column'] in change_values:
+            partition = CSVPartition.partition_of(self.__partitioning__, change_values[self.__partitioning__['column']])
+            if rownums:
+                self.__check_partition_loaded__(partition)
+        moved = []  # (rownum, record) of rows leaving the file of their partition
+
+        def edit(r, rownum, from_partition=None):
+            if rownum in rownums:
+                for k, v in change_values.items():
+                    r[k] = v
+                if partition is not None and from_partition is not None and from_partition != partition:
+                    moved.append((rownum, r))
+                    return None
+            return r
+
         try:
-            rows = []
-            with open(self.__file_name__, "r") as csvfile:
-                reader = csv.DictReader(open(self.__file_name__, "r"), delimiter=",", quotechar='"')
-                for r in reader:
-                    while (reader.line_num - 2) in self.__deleted_rows__:
-                        reader.line_num += 1  # account for deleted rows
-                    if (reader.line_num - 2) in rownums:
-                        for k, v in change_values.items():
-                            r[k] = v
-                    rows.append(r)
-                fields = reader.fieldnames
-            with open(self.__file_name__, "w") as csvfile:
-                writer = csv.DictWriter(csvfile, fields,
-                                        delimiter=",", quotechar='"', quoting=csv.QUOTE_ALL)
-                writer.writeheader()
-                writer.writerows(rows)
+            for file_name, file_rownums, from_partition in self.__get_files_to_rewrite__(rownums):
+                self.__rewrite_file__(file_name, file_rownums, partial(edit, from_partition=from_partition))
+            if moved:
+                self.__rewrite_file__(CSVPartition.partition_file(self.__partitioning__, self.__table_name__, partition),
+                                      self.__partitions__[partition], lambda r, rownum: r, extra=moved)
+        except DataTableExceptions.DataTableException:
+            raise
         except Exception:
             raise DataTableExceptions.DataTableException(
                 code=DataTableExceptions.DataTableException.io_error,
                 message="Update failed; error while writing to file"
             )
 
-        relevant_inds = [ind_name for ind_name, ind in self.indexes.items() if any(col in t.keys() for col in ind['columns'])]
-        for index_name in relevant_inds:  # remove old indexes
+        change_values = dict(change_values)
+        with self.__writing__():
+            self.__encode_row__(change_values)
+            if partition is not None:
+                self.__move_partitions__(rownums, partition)
+            # only indexes on the changed columns move, and each row is removed from them once
+            self.__update_indexes__(change_values.keys(), rownums, remove=True)  # remove old indexes
+            for rownum in rownums:  # new row versions, as snapshots may still read the old ones
+                row = dict(self.__rows__[rownum])
+                row.update(change_values)
+                self.__rows__[rownum] = row
+            self.__update_indexes__(change_values.keys(), rownums, add=True)
             for rownum in rownums:
-                key, _ = self.__create_key_template__(self.__rows__[rownum], self.indexes[index_name]['columns'])
-                if len(key) > 0:
-                    self.indexes[index_name]['index'][key].remove(rownum)
+                self.__widen_zones__(rownum, change_values)
+        if rownums:
+            self.__save_zone_maps__()
 
-        self.__update_indexes__(t.keys(), rownums, remove=True)  # remove old indexes
-        for rownum in rownums:  # update internal values
-            for k, v in change_values.items():
-                self.__rows__[rownum][k] = v
-        self.__update_indexes__(t.keys(), rownums, add=True)
+    def __plan_join__(self, right_r, on_fields, where_template=None):
+        """
+        Chooses the join strategy, and which table is the outer side, by estimated cost.
+        IndexNestedLoopJoin probes an index on the inner table once per outer row, HashJoin builds a hash
+        table on the inner rows and probes it with the outer rows, and MergeJoin walks both sides in key
+        order (sorting first unless the statistics say the column is stored in order).
+        :return: Plan dict. 'children' holds the outer and inner access plans, in that order.
+        """
+        where_template = where_template or {}
+        sides = []
+        for table in (self, right_r):
+            sub_t = table.__get_sub_where_clause__(where_template)
+            index, est_rows = table.__estimate_rows__(sub_t)
+            on_stats = table.__get_column_stats__(on_fields[0]) if len(on_fields) == 1 else None
+            sides.append({'table': table,
+                          'distinct': table.__estimate_distinct__(on_fields),
+                          'sorted': bool(on_stats and on_stats.get('sorted')),
+                          'plan': {'op': 'IndexLookup' if index else 'Scan',
+                                   'table': table.__table_name__,
+                                   'index': index['index_name'] if index else None,
+                                   'template': sub_t,
+                                   'estimated_rows': est_rows}})
+        left, right = sides
+        left_rows = left['plan']['estimated_rows']
+        right_rows = right['plan']['estimated_rows']
+
+        candidates = []
+        for outer, inner in ((left, right), (right, left)):
+            probe_index = inner['table'].__get_index_for_columns__(on_fields)
+            if probe_index:
+                per_probe = len(inner['table']) / max(len(probe_index['index']), 1)
+                cost = CSVPlanner.index_cost(outer['plan']['estimated_rows'], per_probe)
+                candidates.append((cost, 'IndexNestedLoopJoin', outer, inner, probe_index))
+            cost = CSVPlanner.hash_join_cost(inner['plan']['estimated_rows'], outer['plan']['estimated_rows'])
+            candidates.append((cost, 'HashJoin', outer, inner, None))
+        cost = CSVPlanner.merge_join_cost(left_rows, right_rows, left['sorted'], right['sorted'])
+        candidates.append((cost, 'MergeJoin', left, right, None))
+
+        cost, op, outer, inner, probe_index = min(candidates, key=lambda c: c[0])
+        return {'op': op,
+                'on': on_fields,
+                'index': probe_index['index_name'] if probe_index else None,
+                'estimated_rows': left_rows * right_rows / max(left['distinct'], right['distinct'], 1),
+                'estimated_cost': cost,
+                'outer': outer['table'],
+                'inner': inner['table'],
+                'children': [outer['plan'], inner['plan']]}
+
+    def __get_join_input__(self, t):
+        """
+        :return: Live rows matching the template, in rownum order.
+        """
+        if not t:
+            return [r for r in self.__rows__ or () if r is not None]
+        rows = self.__find__(t)[0]
+        return rows or []
+
+    def __execute_join__(self, plan):
+        """
+        Runs a join plan from __plan_join__.
+        :return: Generator of (outer row, list of matching inner rows). Rows with NULL in an on field
+            never match.
+        """
+        outer, inner = plan['outer'], plan['inner']
+        outer_plan, inner_plan = plan['children']
+        on_fields = plan['on']
+
+        def join_key(r):
+            key = tuple(r.get(field) for field in on_fields)
+            return None if any(v is None for v in key) else key
+
+        outer_rows = outer.__get_join_input__(outer_plan['template'])
+        outer_plan['actual_rows'] = len(outer_rows)
+
+        if plan['op'] == 'IndexNestedLoopJoin':
+            probe_index = inner.indexes[plan['index']]
+            inner_rownums = None
+            if inner_plan['template']:
+                # rows passing the where clause are found once, then intersected with each probe
+                inner_rownums = set(r['rownum'] for r in inner.__get_join_input__(inner_plan['template']))
+                inner_plan['actual_rows'] = len(inner_rownums)
+                if not inner_rownums:
+                    return
+            else:
+                inner_plan['actual_rows'] = len(inner)
 
+            for l_r in outer_rows:
+                if join_key(l_r) is None:
+                    continue
+                on_template = outer.__get_on_template__(l_r, on_fields)
+                matches = list(inner.__iter_by_template_index__(on_template, probe_index, rownums=inner_rownums))
+                if matches:
+                    yield l_r, matches
+
+        elif plan['op'] == 'HashJoin':
+            inner_rows = inner.__get_join_input__(inner_plan['template'])
+            inner_plan['actual_rows'] = len(inner_rows)
+            hash_table = defaultdict(list)
+            for r in inner_rows:
+                key = join_key(r)
+                if key is not None:
+                    hash_table[key].append(r)
+
+            for l_r in outer_rows:
+                matches = hash_table.get(join_key(l_r))
+                if matches:
+                    yield l_r, matches
+
+        else:  # MergeJoin
+            inner_rows = inner.__get_join_input__(inner_plan['template'])
+            inner_plan['actual_rows'] = len(inner_rows)
+            outer_keyed = [(join_key(r), r) for r in outer_rows]
+            inner_keyed = [(join_key(r), r) for r in inner_rows]
+            outer_keyed = [kr for kr in outer_keyed if kr[0] is not None]
+            inner_keyed = [kr for kr in inner_keyed if kr[0] is not None]
+            outer_keyed.sort(key=lambda kr: kr[0])  # stable, and close to linear when already in order
+            inner_keyed.sort(key=lambda kr: kr[0])
+
+            i = 0
+            for key, l_r in outer_keyed:
+                while i < len(inner_keyed) and inner_keyed[i][0] < key:
+                    i += 1
+                j = i
+                while j < len(inner_keyed) and inner_keyed[j][0] == key:
+                    j += 1
+                if j > i:
+                    yield l_r, [kr[1] for kr in inner_keyed[i:j]]
+
+    @CSVLock.read_locked_with('right_r')
     def join(self, right_r, on_fields, where_template=None, project_fields=None):
         """
         Implements a JOIN on two CSVTables.
@@ -698,7 +2102,6 @@ class CSVTable:
         :return: Joined table
         """
         usage = "Usage: <CSVTable>.join(<CSVTable>, on_fields=[...], where_template={...}, project_fields=[...])"
-        left_r = self
 
         if not isinstance(right_r, CSVTable) or not isinstance(on_fields, list) or \
                 where_template and not isinstance(where_template, (dict, OrderedDict)) or \
@@ -709,57 +2112,33 @@ class CSVTable:
             )
 
         # on_fields must be present in both tables
-        if not all(on_field in left_r.__get_column_names__() for on_field in on_fields) \
+        if not on_fields or not all(on_field in self.__get_column_names__() for on_field in on_fields) \
                 or not all(on_field in right_r.__get_column_names__() for on_field in on_fields):
             raise DataTableExceptions.DataTableException(
                 code=DataTableExceptions.DataTableException.unknown_column,
                 message="Could not perform equijoin; invalid on clause\n" + usage)
 
-        # switch scan and probe tables based on index selectivity
-        on_template = left_r.__get_on_template__({}, on_fields)
-        left_index = left_r.__get_access_path__(on_template)
-        right_index = right_r.__get_access_path__(on_template)
-        left_sel = left_index['selectivity'] if left_index else 0
-        right_sel = right_index['selectivity'] if right_index else 0
-        if left_sel > right_sel:
-            print("Using index {} on {}".format(left_index['index_name'], self.__table_name__))
-            left_r = right_r
-            right_r = self
-        else:
-            print("Using index {} on {}".format(right_index['index_name'], right_r.__table_name__))
-
-        scan_rows = left_r.__rows__
-        probe_rows = right_r.__rows__
-        probe_rownums = None
-
-        # where
-        if where_template:
-            scan_rows = left_r.find_by_template(left_r.__get_sub_where_clause__(where_template))
-            probe_rows = right_r.find_by_template(right_r.__get_sub_where_clause__(where_template))
-            probe_rownums = [row['rownum'] for row in probe_rows]
-
-        join_result = []
-        count = 0
-        n = len(scan_rows)
-        self.__show_loading_bar__(0, 0)
         start_time = time.time()
-        # equijoin + project
-        for l_r in scan_rows:
-            on_template = left_r.__get_on_template__(l_r, on_fields)
-            current_right_rows = right_r.find_by_template(on_template, rownums=probe_rownums, show_time=False)
+        plan = self.__plan_join__(right_r, on_fields, where_template)
+        left_r, right_r = plan['outer'], plan['inner']  # columns of the outer table come first
 
-            if current_right_rows is not None and len(current_right_rows) > 0:
-                new_rows = self.__join_rows__(l_r, current_right_rows,
-                                              on_fields, project_fields)
-                join_result.extend(new_rows)
+        verbose = self.__metrics__.verbose
+        if verbose:
+            print(CSVPlanner.format_plan(self.__get_printable_plan__(plan)), end='')
 
-            count += 1
-            self.__show_loading_bar__(count, n)
+        join_result = []
+        for l_r, current_right_rows in self.__execute_join__(plan):
+            join_result.extend(self.__join_rows__(l_r, current_right_rows, on_fields, project_fields))
 
         join_name = left_r.__table_name__ + '_' + right_r.__table_name__ + '_' + '_'.join(on_fields)
         join_table = CSVTable(join_name, load=False)
 
-        join_table.__column_names__ = list(join_result[0].keys())
+        if project_fields:
+            join_table.__column_names__ = list(project_fields)
+        else:
+            join_table.__column_names__ = list(left_r.__get_column_names__()) + \
+                [col for col in right_r.__get_column_names__()
+                 if col not in left_r.__get_column_names__() and col not in on_fields]
         join_table.__column_types__ = {}
         for col in join_table.__get_column_names__():
             join_table.__column_types__[col] = left_r.__get_column_types__().get(col) or right_r.__get_column_types__().get(col)
@@ -802,25 +2181,512 @@ class CSVTable:
 
         join_table.__update_indexes__(join_table.__column_names__, add=True, inserting=True)
 
-        print("  {:.4f}s".format(time.time() - start_time))
+        plan['actual_rows'] = len(join_result)
+        join_table.__plan__ = self.__get_printable_plan__(plan)
+        self.__record__("join", start_time, rows_scanned=plan['children'][0].get('actual_rows'),
+                        rows_returned=len(join_result), access_path=plan['op'], index=plan['index'],
+                        query=on_fields)
         return join_table
 
-    def having(self, *conds):
+    def __plan_multi_join_step__(self, tables, bases, conditions, joined, rows, i):
         """
-        Returns derived table with rows satisfying given conditions.
-        Supports = < <= > >= !=
+        Costs joining tables[i] to the intermediate result of the tables in joined.
+        :return: (cost, estimated rows out, plan step), or None if no condition connects them
         """
-        if len(conds) == 0:
-            return self
+        conds = [c for c in conditions if c[0] == i and c[1] in joined or c[1] == i and c[0] in joined]
+        if not conds:
+            return None  # never plan a cross product
+
+        out_rows = rows * bases[i]['estimated_rows']
+        for a, b, fields in conds:
+            out_rows /= max(tables[a].__estimate_distinct__(fields), tables[b].__estimate_distinct__(fields), 1)
+
+        a, b, fields = conds[0]
+        options = [(CSVPlanner.hash_join_cost(bases[i]['estimated_rows'], rows), 'HashJoin', None)]
+        probe_index = tables[i].__get_index_for_columns__(fields)
+        if probe_index:
+            per_probe = len(tables[i]) / max(len(probe_index['index']), 1)
+            options.append((CSVPlanner.index_cost(rows, per_probe), 'IndexNestedLoopJoin', probe_index['index_name']))
+        cost, op, index_name = min(options, key=lambda o: o[0])
+
+        return cost, out_rows, {'op': op, 'table': i, 'with': a if b == i else b, 'on': fields,
+                                'index': index_name, 'filters': conds[1:], 'estimated_rows': out_rows}
+
+    def __plan_multi_join__(self, tables, conditions, where_template):
+        """
+        Chooses a left-deep join order. Dynamic programming over connected subsets of tables (as in System R)
+        for up to 10 tables, otherwise greedily adding the cheapest next join.
+        :param conditions: List of (table position, table position, on fields).
+        :return: Plan dict with 'first', the position of the first table, and 'steps', the joins in order
+        """
+        bases = []
+        for table in tables:
+            sub_t = table.__get_sub_where_clause__(where_template or {})
+            index, est_rows = table.__estimate_rows__(sub_t)
+            bases.append({'op': 'IndexLookup' if index else 'Scan', 'table': table.__table_name__,
+                          'index': index['index_name'] if index else None, 'template': sub_t,
+                          'estimated_rows': est_rows})
+
+        n = len(tables)
+        # subset of table positions -> (cost, estimated rows, first table, steps)
+        best = {frozenset([i]): (bases[i]['estimated_rows'], bases[i]['estimated_rows'], i, [])
+                for i in range(n)}
+        if n <= 10:
+            for size in range(1, n):
+                for joined in [subset for subset in best if len(subset) == size]:
+                    cost, rows, first, steps = best[joined]
+                    for i in range(n):
+                        if i in joined:
+                            continue
+                        step = self.__plan_multi_join_step__(tables, bases, conditions, joined, rows, i)
+                        if step is None:
+                            continue
+                        new = joined | {i}
+                        if new not in best or cost + step[0] < best[new][0]:
+                            best[new] = (cost + step[0], step[1], first, steps + [step[2]])
+            plan = best.get(frozenset(range(n)))
+        else:
+            joined = min(best, key=lambda subset: best[subset][1])
+            plan = best[joined]
+            while plan and len(joined) < n:
+                cost, rows, first, steps = plan
+                options = [self.__plan_multi_join_step__(tables, bases, conditions, joined, rows, i)
+                           for i in range(n) if i not in joined]
+                options = [option for option in options if option is not None]
+                if not options:
+                    plan = None
+                    break
+                step = min(options, key=lambda o: o[0])
+                joined = joined | {step[2]['table']}
+                plan = (cost + step[0], step[1], first, steps + [step[2]])
+
+        if plan is None:
+            raise DataTableExceptions.DataTableException(
+                code=DataTableExceptions.DataTableException.invalid_operation,
+                message="Could not perform join; every table must be connected by a join condition")
+
+        cost, rows, first, steps = plan
+        return {'op': 'MultiJoin', 'order': [tables[first].__table_name__] + [tables[st['table']].__table_name__ for st in steps],
+                'estimated_rows': rows, 'estimated_cost': cost, 'bases': bases, 'first': first, 'steps': steps}
+
+    def __execute_multi_join_step__(self, tables, bases, step, inputs):
+        """
+        Joins one more table to a stream of partial results. Each partial result maps table positions to rows.
+        """
+        table = tables[step['table']]
+        other = step['with']
+        fields = step['on']
+        template = bases[step['table']]['template']
+        step['actual_rows'] = 0
+
+        def matches_filters(result):
+            for a, b, on in step['filters']:
+                if any(result[a].get(f) is None or result[a].get(f) != result[b].get(f) for f in on):
+                    return False
+            return True
+
+        if step['op'] == 'IndexNestedLoopJoin':
+            index = table.indexes[step['index']]
+            rownums = None
+            if template:
+                rownums = set(r['rownum'] for r in table.__get_join_input__(template))
+                if not rownums:
+                    return
+
+            for partial in inputs:
+                on_template = table.__get_on_template__(partial[other], fields)
+                if any(v is None for v in on_template.values()):
+                    continue
+                for r in table.__iter_by_template_index__(on_template, index, rownums=rownums):
+                    result = dict(partial)
+                    result[step['table']] = r
+                    if matches_filters(result):
+                        step['actual_rows'] += 1
+                        yield result
+        else:
+            hash_table = defaultdict(list)
+            for r in table.__get_join_input__(template):
+                key = tuple(r.get(f) for f in fields)
+                if not any(v is None for v in key):
+                    hash_table[key].append(r)
+
+            for partial in inputs:
+                for r in hash_table.get(tuple(partial[other].get(f) for f in fields), ()):
+                    result = dict(partial)
+                    result[step['table']] = r
+                    if matches_filters(result):
+                        step['actual_rows'] += 1
+                        yield result
+
+    def __plan_semi_join__(self, right_r, on_fields, where_template=None, anti=False):
+        """
+        Chooses how a semi join or anti join tests each row of this table for a match in right_r: by
+        probing an index of right_r on the on fields, which stops at the first match, or by a hash set of
+        the keys of right_r's rows.
+        :return: Plan dict. 'children' holds the access plans of this table and right_r, in that order.
+        """
+        where_template = where_template or {}
+        children = []
+        for table in (self, right_r):
+            sub_t = table.__get_sub_where_clause__(where_template)
+            index, est_rows = table.__estimate_rows__(sub_t)
+            children.append({'op': 'IndexLookup' if index else 'Scan',
+                             'table': table.__table_name__,
+                             'index': index['index_name'] if index else None,
+                             'template': sub_t,
+                             'estimated_rows': est_rows})
+        left_rows, right_rows = children[0]['estimated_rows'], children[1]['estimated_rows']
+
+        op, probe_index = 'Hash', None
+        cost = CSVPlanner.hash_join_cost(right_rows, left_rows)
+        index = right_r.__get_index_for_columns__(on_fields)
+        if index:
+            # a probe reads rows of the bucket only until one passes the where clause
+            per_probe = len(right_r) / max(len(index['index']), 1) if children[1]['template'] else 1
+            index_cost = CSVPlanner.index_cost(left_rows, per_probe)
+            if index_cost < cost:
+                op, probe_index, cost = 'Index', index, index_cost
+        return {'op': op + ('AntiJoin' if anti else 'SemiJoin'),
+                'on': on_fields,
+                'index': probe_index['index_name'] if probe_index else None,
+                'estimated_cost': cost,
+                'children': children}
+
+    def __execute_semi_join__(self, right_r, plan, anti=False):
+        """
+        Runs a plan from __plan_semi_join__.
+        :return: Generator of the rows of this table with a match in right_r, or without one if anti. Rows
+            with NULL in an on field never match, so an anti join returns them, as NOT EXISTS does.
+        """
+        left_plan, right_plan = plan['children']
+        on_fields = plan['on']
+
+        def join_key(r):
+            key = tuple(r.get(field) for field in on_fields)
+            return None if any(v is None for v in key) else key
+
+        right_rownums = None
+        if right_plan['template']:
+            right_rownums = set(r['rownum'] for r in right_r.__get_join_input__(right_plan['template']))
+            right_plan['actual_rows'] = len(right_rownums)
+
+        if right_rownums is not None and not right_rownums:
+            exists = lambda r: False
+        elif plan['index']:
+            probe_index = right_r.indexes[plan['index']]
+
+            def exists(r):
+                if join_key(r) is None:
+                    return False
+                on_template = self.__get_on_template__(r, on_fields)
+                matches = right_r.__iter_by_template_index__(on_template, probe_index, rownums=right_rownums)
+                return next(matches, None) is not None
+        else:
+            rows = right_r.__get_join_input__(right_plan['template'])
+            right_plan['actual_rows'] = len(rows)
+            keys = set(join_key(r) for r in rows)
+            keys.discard(None)
+            exists = lambda r: join_key(r) in keys
+
+        left_rows = self.__get_join_input__(left_plan['template'])
+        left_plan['actual_rows'] = len(left_rows)
+        for r in left_rows:
+            if exists(r) != anti:
+                yield r
+
+    def __semi_join__(self, right_r, on_fields, where_template, anti, usage):
+        if not isinstance(right_r, CSVTable) or not isinstance(on_fields, list) or \
+                where_template and not isinstance(where_template, (dict, OrderedDict)):
+            raise DataTableExceptions.DataTableException(
+                code=DataTableExceptions.DataTableException.invalid_method_call,
+                message=usage
+            )
+        if not on_fields or not all(on_field in self.__get_column_names__() for on_field in on_fields) \
+                or not all(on_field in right_r.__get_column_names__() for on_field in on_fields):
+            raise DataTableExceptions.DataTableException(
+                code=DataTableExceptions.DataTableException.unknown_column,
+                message="Could not perform {} join; invalid on clause\n".format("anti" if anti else "semi") + usage)
 
         start_time = time.time()
-        usage = "Usage: <CSVTable>.having('<column> = <val>', 'yearID >= 2000', ...)"
-        if not all(isinstance(cond, str) for cond in conds):
+        plan = self.__plan_semi_join__(right_r, on_fields, where_template, anti=anti)
+        if self.__metrics__.verbose:
+            print(CSVPlanner.format_plan(plan), end='')
+        rows = [copy.deepcopy(row) for row in self.__execute_semi_join__(right_r, plan, anti=anti)]
+
+        t_name = self.__table_name__ + ('_anti_' if anti else '_semi_') + right_r.__table_name__ + '_' \
+            + '_'.join(on_fields)
+        new_table = CSVTable(t_name, load=False)
+        new_table.__column_names__ = self.__get_column_names__()
+        new_table.__column_types__ = self.__get_column_types__()
+        new_table.__rows__ = rows
+        new_table.__refresh_rownums__()  # numbered 0..n-1 as in join(), for find_page cursors and __rows__[rownum]
+
+        self.__record__("anti_join" if anti else "semi_join", start_time,
+                        rows_scanned=plan['children'][0]['actual_rows'], rows_returned=len(rows),
+                        access_path="index" if plan['index'] else "hash", index=plan['index'],
+                        query={'on': on_fields, 'where': where_template})
+        return new_table
+
+    @CSVLock.read_locked_with('right_r')
+    def semi_join(self, right_r, on_fields, where_template=None):
+        """
+        Returns a derived table of the rows of this table that have at least one matching row in right_r,
+        as WHERE EXISTS does: each row appears once, however many rows it matches, and no joined rows are
+        built. Matches are found by probing an index of right_r on the on fields, or a hash set of its keys.
+        :param right_r: The table to look for matches in.
+        :param on_fields: Fields that must be equal in both rows.
+        :param where_template: Template applied to each table on the columns it has, as in join().
+        :return: Derived table of copies of this table's rows, in rownum order, renumbered from 0
+        """
+        usage = "Usage: <CSVTable>.semi_join(<CSVTable>, on_fields=[...], where_template={...})"
+        return self.__semi_join__(right_r, on_fields, where_template, False, usage)
+
+    @CSVLock.read_locked_with('right_r')
+    def anti_join(self, right_r, on_fields, where_template=None):
+        """
+        Returns a derived table of the rows of this table with no matching row in right_r, as WHERE NOT
+        EXISTS does. Rows with NULL in an on field match nothing, so they are returned. See semi_join().
+        """
+        usage = "Usage: <CSVTable>.anti_join(<CSVTable>, on_fields=[...], where_template={...})"
+        return self.__semi_join__(right_r, on_fields, where_template, True, usage)
+
+    @CSVLock.read_locked_with('tables')
+    def multi_join(self, tables, conditions, where_template=None, project_fields=None):
+        """
+        Implements a JOIN of this table and several others. The join order is chosen by estimated cost,
+        and rows are pipelined through the joins without building intermediate tables.
+        :param tables: List of the other CSVTables.
+        :param conditions: List of (table, table, [on fields]) equi-join conditions. Tables may be given by
+            object or by name.
+        :param where_template: Select template, applied to each table that has the column.
+        :param project_fields: List of fields to return from the result.
+        :return: Joined table. Where tables share a column name, the value from the table listed first
+            (this table, then tables in order) is kept.
+        """
+        usage = "Usage: <CSVTable>.multi_join([<CSVTable>, ...], [(<table>, <table>, [on fields]), ...], " \
+                "where_template={...}, project_fields=[...])"
+        tables = [self] + list(tables) if isinstance(tables, list) else None
+        if tables is None or not all(isinstance(table, CSVTable) for table in tables) \
+                or not isinstance(conditions, list) \
+                or where_template and not isinstance(where_template, (dict, OrderedDict)) \
+                or project_fields and not isinstance(project_fields, list):
             raise DataTableExceptions.DataTableException(
                 code=DataTableExceptions.DataTableException.invalid_method_call,
                 message=usage
             )
 
+        def position(ref):
+            for i, table in enumerate(tables):
+                if table is ref or table.__snapshot_of__ is ref and ref is not None \
+                        or isinstance(ref, str) and table.__table_name__ == ref:
+                    return i
+            raise DataTableExceptions.DataTableException(
+                code=DataTableExceptions.DataTableException.invalid_method_call,
+                message="Unknown table {} in join condition\n".format(ref) + usage)
+
+        positions = []
+        for condition in conditions:
+            if not isinstance(condition, (tuple, list)) or len(condition) != 3 or not isinstance(condition[2], list):
+                raise DataTableExceptions.DataTableException(
+                    code=DataTableExceptions.DataTableException.invalid_method_call,
+                    message=usage
+                )
+            a, b, fields = position(condition[0]), position(condition[1]), condition[2]
+            if not fields or not all(f in tables[a].__get_column_names__() and f in tables[b].__get_column_names__()
+                                     for f in fields):
+                raise DataTableExceptions.DataTableException(
+                    code=DataTableExceptions.DataTableException.unknown_column,
+                    message="Could not perform equijoin; invalid on clause\n" + usage)
+            positions.append((a, b, fields))
+
+        start_time = time.time()
+        plan = self.__plan_multi_join__(tables, positions, where_template)
+        if self.__metrics__.verbose:
+            print("Join order: " + " -> ".join(plan['order']))
+
+        first = plan['first']
+        first_rows = tables[first].__get_join_input__(plan['bases'][first]['template'])
+        pipeline = ({first: r} for r in first_rows)
+        for step in plan['steps']:
+            pipeline = self.__execute_multi_join_step__(tables, plan['bases'], step, pipeline)
+
+        column_names = []
+        column_types = {}
+        for table in tables:
+            for col in table.__get_column_names__():
+                if col not in column_types:
+                    column_names.append(col)
+                    column_types[col] = table.__get_column_types__().get(col)
+        if project_fields:
+            column_names = list(project_fields)
+
+        join_result = []
+        for partial in pipeline:
+            row = {}
+            for i in range(len(tables)):  # earlier tables win on shared column names
+                for k, v in partial[i].items():
+                    if k not in row and k != 'rownum':
+                        row[k] = v
+            join_result.append(self.__project_row__(row, project_fields))
+
+        join_table = CSVTable('_'.join(plan['order']), load=False)
+        join_table.__column_names__ = column_names
+        join_table.__column_types__ = {col: column_types.get(col) for col in column_names}
+        join_table.__rows__ = join_result
+        join_table.__refresh_rownums__()
+
+        bases = plan.pop('bases')
+        plan['actual_rows'] = len(join_result)
+        plan['children'] = [dict(bases[first], actual_rows=len(first_rows))] + \
+            [dict(step, table=tables[step['table']].__table_name__, **{'with': tables[step['with']].__table_name__})
+             for step in plan.pop('steps')]
+        for step in plan['children'][1:]:
+            step['filters'] = [(tables[a].__table_name__, tables[b].__table_name__, on) for a, b, on in step['filters']]
+        plan.pop('first')
+        join_table.__plan__ = plan
+
+        self.__record__("multi_join", start_time, rows_scanned=len(first_rows), rows_returned=len(join_result),
+                        access_path="multi_join", query=plan['order'])
+        return join_table
+
+    def __get_printable_plan__(self, plan):
+        """
+        :return: Copy of a join plan without the table objects, for printing or returning from explain.
+        """
+        return {k: v for k, v in plan.items() if k not in ('outer', 'inner')}
+
+    @CSVLock.read_locked
+    def explain(self, t):
+        """
+        EXPLAIN ANALYZE for find_by_template. Runs the lookup.
+        :param t: Template, as for find_by_template.
+        :return: Plan dict with the access path, estimated rows and cost, and actual rows
+        """
+        usage = "Usage: <CSVTable>.explain({where clause})"
+        t = self.__check_find_args__(t, None, None, None, usage)
+
+        index, est_rows = self.__estimate_rows__(t)
+        merged, used = self.__get_index_merge__(t) if self.__use_index_merge__(t) else (None, [])
+        if merged is not None:
+            plan = {'op': 'IndexMerge', 'table': self.__table_name__, 'index': ",".join(used),
+                    'estimated_rows': min(est_rows, len(merged)),
+                    'estimated_cost': CSVPlanner.index_cost(len(used), len(merged) / max(len(used), 1))}
+        elif index:
+            plan = {'op': 'IndexLookup', 'table': self.__table_name__, 'index': index['index_name'],
+                    'estimated_rows': est_rows,
+                    'estimated_cost': CSVPlanner.index_cost(1, len(index['index'].get(
+                        self.__create_key_template__(t, index['columns'])[0], ())))}
+        elif self.__prune_partitions__(t) is not None:
+            partitions = self.__get_pruned_partitions__(t)
+            rows = sum(len(self.__partitions__[partition]) for partition in partitions)
+            plan = {'op': 'PartitionScan', 'table': self.__table_name__, 'index': None, 'partitions': partitions,
+                    'estimated_rows': min(est_rows, rows), 'estimated_cost': rows * CSVPlanner.index_row_cost}
+        else:
+            plan = {'op': 'Scan', 'table': self.__table_name__, 'index': None, 'estimated_rows': est_rows,
+                    'estimated_cost': CSVPlanner.scan_cost(len(self.__rows__ or ()))}
+
+        result = self.__find__(t)[0]
+        plan['actual_rows'] = len(result or ())
+        return plan
+
+    @CSVLock.read_locked_with('right_r')
+    def explain_join(self, right_r, on_fields, where_template=None):
+        """
+        EXPLAIN ANALYZE for join. Runs the join.
+        :return: Plan dict with the join strategy, estimated rows and cost, and actual rows, with the
+            outer and inner access plans as children
+        """
+        return self.join(right_r, on_fields, where_template=where_template).__plan__
+
+    @CSVLock.read_locked
+    def memory_usage(self, sample_size=1000):
+        """
+        Estimates the memory held by the table, from sys.getsizeof over a sample of rows and of index keys
+        scaled to the whole table. The values of a dictionary encoded column are counted once, as rows share
+        them.
+        :param sample_size: Rows, and keys per index, to measure.
+        :return: {'total': bytes, 'rows': bytes for the row list and row dicts, 'columns': {column: bytes for
+            its values}, 'indexes': {index name: bytes}}
+        """
+        rows = self.__rows__ or []
+        sample = [row for row in rows[::max(len(rows) // sample_size, 1)] if row is not None]
+        scale = len(self) / len(sample) if sample else 0
+
+        usage = {'rows': int(sys.getsizeof(rows) + scale * sum(sys.getsizeof(row) for row in sample)),
+                 'columns': {}, 'indexes': {}}
+        for col in self.__get_column_names__():
+            dictionary = self.__dictionaries__.get(col)
+            if dictionary is not None:
+                size = sys.getsizeof(dictionary) + sum(sys.getsizeof(value) for value in dictionary)
+            else:
+                size = scale * sum(sys.getsizeof(row[col]) for row in sample if row.get(col) is not None)
+            usage['columns'][col] = int(size)
+
+        for index_name, idx in self.indexes.items():
+            index = idx.get('index')
+            if index is None:
+                usage['indexes'][index_name] = 0
+                continue
+            keys = list(index)
+            key_sample = keys[::max(len(keys) // sample_size, 1)]
+            values = idx.get('values') or {}
+            per_key = sum(sys.getsizeof(key) + sys.getsizeof(index[key]) + sys.getsizeof(values.get(key, ()))
+                          for key in key_sample)
+            size = sys.getsizeof(index) + sys.getsizeof(values) + sys.getsizeof(idx.get('sorted_keys') or ())
+            usage['indexes'][index_name] = int(size + (len(keys) / len(key_sample) * per_key if key_sample else 0))
+
+        usage['total'] = usage['rows'] + sum(usage['columns'].values()) + sum(usage['indexes'].values())
+        return usage
+
+    def analyze(self, persist=True):
+        """
+        ANALYZE TABLE: collects column statistics (row count, distinct count, null fraction, min/max and an
+        equi-depth histogram) for the cost-based planner. They are computed on a snapshot, then published as
+        a write (see __publish_statistics__).
+        :param persist: Store the statistics in the catalog so they are loaded with the table next time.
+            Ignored for derived tables.
+        :return: Dict of column name -> statistics
+        """
+        start_time = time.time()
+        statistics, row_count = self.__collect_statistics__()
+        if self.__snapshot_of__ is not None:  # analyzed through a snapshot, which plans with them too
+            self.__statistics__ = statistics
+            self.__snapshot_of__.__publish_statistics__(statistics, persist)
+        else:
+            self.__publish_statistics__(statistics, persist)
+
+        self.__record__("analyze", start_time, rows_scanned=row_count, access_path="scan")
+        return statistics
+
+    @CSVLock.read_locked
+    def __collect_statistics__(self):
+        """
+        :return: (dict of column name -> statistics of the live rows of one snapshot, number of live rows)
+        """
+        rows = [r for r in self.__rows__ or () if r is not None]
+        statistics = {}
+        for col in self.__get_column_names__():
+            statistics[col] = CSVPlanner.analyze_column([r.get(col) for r in rows], len(rows))
+        return statistics, len(rows)
+
+    @CSVLock.write_locked
+    def __publish_statistics__(self, statistics, persist):
+        """
+        Replaces the table's statistics, and those in the catalog, holding the write mutex so that concurrent
+        analyze() calls and writers publish one at a time. The statistics dict is never changed once published,
+        so a snapshot taken before or after sees either the old or the new one whole.
+        """
+        self.__statistics__ = statistics
+        if persist and self.__get_file_name__() != "DERIVED":
+            self.__catalog__.get_table(self.__table_name__).set_statistics(statistics)
+
+    def __parse_conditions__(self, conds, usage):
+        """
+        Parses having-style condition strings.
+        :param conds: Condition strings such as 'yearID >= 2000'.
+        :param usage: Usage string to include in raised exceptions.
+        :return: List of (column, operator function, value) tuples.
+        """
         operators = {'=': operator.eq,
                      '!=': operator.ne,
                      '<': operator.lt,
@@ -830,36 +2696,183 @@ class CSVTable:
 
         conditions = []
         for c in conds:
+            like = re.match(r"^\s*(\S+)\s+LIKE\s+(['\"]?)(.*)\2\s*$", c, re.IGNORECASE)
+            if like:  # 'nameLast LIKE Aar%', the pattern may be quoted
+                if not self.__is_valid_column__(like.group(1)):
+                    raise DataTableExceptions.DataTableException(
+                        code=DataTableExceptions.DataTableException.unknown_column,
+                        message="Unknown column '{}' in condition\n".format(like.group(1)) + usage
+                    )
+                conditions.append((like.group(1), CSVPlanner.like, like.group(3)))
+                continue
+
             split_cond = re.split(r"([!><=]+)", c.replace(' ', ''))
             if len(split_cond) != 3 or operators.get(split_cond[1]) is None:  # check operator
                 raise DataTableExceptions.DataTableException(
                     code=DataTableExceptions.DataTableException.invalid_operation,
-                    message="Invalid condition. Supported operators: = < <= > >= !=\n" + usage
+                    message="Invalid condition. Supported operators: = < <= > >= != LIKE\n" + usage
                 )
-            elif split_cond[0] not in self.__get_column_names__():  # check columns
+            elif not self.__is_valid_column__(split_cond[0]):  # check columns
                 raise DataTableExceptions.DataTableException(
                     code=DataTableExceptions.DataTableException.unknown_column,
                     message="Unknown column '{}' in condition\n".format(split_cond[0]) + usage
                 )
 
-            if self.__get_column_types__().get(split_cond[0]) == "number":
+            if CSVExpression.result_type(split_cond[0], self.__get_column_types__()) == "number":
                 split_cond[2] = float(split_cond[2])
 
             split_cond[1] = operators[split_cond[1]]
             conditions.append(tuple(split_cond))
 
-        rows = self.__rows__
-        matching_rows = []
-        for row in rows:
+        return conditions
+
+    def __parse_sorts__(self, cols, usage):
+        """
+        Parses order_by-style sort strings.
+        :param cols: Sort strings such as 'yearID DESC'.
+        :param usage: Usage string to include in raised exceptions.
+        :return: List of (column, descending) tuples.
+        """
+        sorts = []
+        for col in cols:
+            args = col.split(' ')
+            if len(args) == 2 and args[1].lower() == "desc":
+                sorts.append((args[0], True))
+            else:
+                sorts.append((args[0], False))
+
+        if not all(sort[0] in self.__get_column_names__() for sort in sorts):
+            raise DataTableExceptions.DataTableException(
+                code=DataTableExceptions.DataTableException.unknown_column,
+                message="Unknown column in order_by function call\n" + usage
+            )
+
+        return sorts
+
+    def query(self):
+        """
+        Starts a lazy query on this table. See CSVQuery.
+        :return: CSVQuery builder
+        """
+        return CSVQuery.CSVQuery(self)
+
+    def __get_sorted_keys__(self, idx):
+        """
+        :return: The index's keys in sorted order, built on first use and kept up to date by
+            __update_indexes__. Together with the buckets this is a sorted string index for prefix scans.
+        """
+        if 'sorted_keys' not in idx:
+            with self.__get_index_lock__(idx):
+                if 'sorted_keys' not in idx:
+                    idx['sorted_keys'] = sorted(idx['index'])
+        return idx['sorted_keys']
+
+    def __get_having_candidates__(self, conditions):
+        """
+        Index access for having conditions on a column, or expression, with a single-column index.
+        '=' on text looks up the key's bucket (number values are parsed as floats, which do not match the
+        keys). LIKE with a literal prefix bisects the index's sorted keys for the keys starting with it, so
+        finding k candidate rows costs O(log n + k) instead of a scan.
+        :param conditions: Output of __parse_conditions__.
+        :return: (sorted rownums of the candidate rows, index name), or (None, None) if no condition can
+            use an index or a scan is cheaper. Without an index, the candidates may be the rows of the
+            partitions left by partition pruning, with index name None.
+        """
+        column_types = self.__get_column_types__()
+        best_rownums, best_index = None, None
+        for col, op, val in conditions:
+            if op is operator.eq and CSVExpression.result_type(col, column_types) != "number":
+                prefix = None
+            elif op is CSVPlanner.like and CSVPlanner.like_prefix(val):
+                prefix = CSVPlanner.like_prefix(val)
+            else:
+                continue
+            for idx in self.indexes.values():
+                if idx['columns'] != [col] or idx.get('index') is None:
+                    continue
+                if prefix is None:
+                    rownums = list(idx['index'].get(str(val), ()))
+                else:
+                    keys = self.__get_sorted_keys__(idx)
+                    rownums = []
+                    for i in range(bisect.bisect_left(keys, prefix), len(keys)):
+                        if not keys[i].startswith(prefix):
+                            break
+                        rownums.extend(idx['index'].get(keys[i], ()))
+                if best_rownums is None or len(rownums) < len(best_rownums):
+                    best_rownums, best_index = rownums, idx['index_name']
+
+        if best_rownums is None \
+                or len(best_rownums) * CSVPlanner.index_row_cost > CSVPlanner.scan_cost(len(self.__rows__ or ())):
+            return self.__prune_partitions__(conditions=conditions), None
+        return sorted(best_rownums), best_index
+
+    def __iter_having__(self, conditions, fields=None, rownums=None):
+        """
+        Yields rows satisfying all parsed conditions.
+        :param conditions: Output of __parse_conditions__.
+        :param rownums: Candidate rows from __get_having_candidates__, or None to scan.
+        """
+        matching = CSVParallel.iter_matching(self, conditions=conditions, rownums=rownums)
+        if matching is not None:
+            for row in matching:
+                yield self.__project_row__(row, fields)
+            return
+
+        rows = self.__rows__ or []
+        for row in self.__iter_zones__(conditions=conditions) if rownums is None else (rows[rownum] for rownum in rownums):
+            if row is None:  # deleted
+                continue
+
             valid = True
             for condition in conditions:
-                row_val = row.get(condition[0])
+                row_val = self.__get_value__(row, condition[0])
                 if row_val is None or not condition[1](row_val, condition[2]):
                     valid = False
                     break
 
             if valid:
-                matching_rows.append(copy.deepcopy(row))
+                yield self.__project_row__(row, fields)
+
+    @CSVLock.read_locked_iter
+    def iter_having(self, *conds, fields=None):
+        """
+        Lazy version of having. Yields matching rows (projected onto fields, if given) instead of
+        building a derived table.
+        :return: Iterator over matching rows
+        """
+        usage = "Usage: <CSVTable>.iter_having('<column> = <val>', 'yearID >= 2000', ..., fields=[...])"
+        if not all(isinstance(cond, str) for cond in conds) or fields and not isinstance(fields, list):
+            raise DataTableExceptions.DataTableException(
+                code=DataTableExceptions.DataTableException.invalid_method_call,
+                message=usage
+            )
+
+        conditions = self.__parse_conditions__(conds, usage)
+        return self.__iter_having__(conditions, fields, rownums=self.__get_having_candidates__(conditions)[0])
+
+    @CSVLock.read_locked
+    def having(self, *conds):
+        """
+        Returns derived table with rows satisfying given conditions.
+        Supports = < <= > >= != and LIKE, e.g. 'nameLast LIKE Aar%', on columns or on expressions such as
+        'lower(nameLast) = aaron'. '=' on text and LIKE patterns starting with literal text use a
+        single-column index on the column or expression, if there is one (see __get_having_candidates__).
+        """
+        if len(conds) == 0:
+            return self
+
+        start_time = time.time()
+        usage = "Usage: <CSVTable>.having('<column> = <val>', 'yearID >= 2000', ...)"
+        if not all(isinstance(cond, str) for cond in conds):
+            raise DataTableExceptions.DataTableException(
+                code=DataTableExceptions.DataTableException.invalid_method_call,
+                message=usage
+            )
+
+        conditions = self.__parse_conditions__(conds, usage)
+        rownums, index_name = self.__get_having_candidates__(conditions)
+        matching_rows = [copy.deepcopy(row) for row in self.__iter_having__(conditions, rownums=rownums)]
 
         t_name = self.__table_name__ + '_having_' + '_'.join([c[0] for c in conditions])
         new_table = CSVTable(t_name, load=False)
@@ -868,9 +2881,169 @@ class CSVTable:
         new_table.__column_types__ = self.__get_column_types__()
         new_table.__rows__ = matching_rows
 
-        print("Fetch time: {:.4f}s".format(time.time() - start_time))
+        self.__record__("having", start_time,
+                        rows_scanned=len(self.__rows__ or ()) if rownums is None else len(rownums),
+                        rows_returned=len(matching_rows),
+                        access_path="index" if index_name else "scan" if rownums is None else "partition",
+                        index=index_name, query=list(conds))
+        return new_table
+
+    def __parse_aggregates__(self, aggregates, usage):
+        """
+        Parses aggregate strings such as 'count(*)', 'sum(W)' or 'max(lower(nameLast))'.
+        :return: List of (function, column or None for count(*)) tuples.
+        """
+        parsed = []
+        for agg in aggregates:
+            match = re.match(r"^\s*(\w+)\s*\(\s*(.+?)\s*\)\s*$", agg) if isinstance(agg, str) else None
+            if not match or match.group(1).lower() not in aggregate_functions \
+                    or match.group(2) == '*' and match.group(1).lower() != "count":
+                raise DataTableExceptions.DataTableException(
+                    code=DataTableExceptions.DataTableException.invalid_method_call,
+                    message="Invalid aggregate '{}'. Supported: {}\n".format(
+                        agg, ", ".join(f + "(<column>)" for f in aggregate_functions)) + usage
+                )
+            col = None if match.group(2) == '*' else match.group(2)
+            if col is not None and not self.__is_valid_column__(col):
+                raise DataTableExceptions.DataTableException(
+                    code=DataTableExceptions.DataTableException.unknown_column,
+                    message="Unknown column '{}' in aggregate\n".format(col) + usage
+                )
+            parsed.append((match.group(1).lower(), col))
+        return parsed
+
+    @staticmethod
+    def __new_aggregate_states__(aggregates):
+        # count, [sum, count] for sum and avg, or the min or max so far
+        return [0 if function == "count" else [0, 0] if function in ("sum", "avg") else None
+                for function, _ in aggregates]
+
+    def __get_partial_aggregates__(self, aggregates, group_by, conditions):
+        """
+        :return: Function computing the partial aggregates of (rownum, row) pairs that satisfy the parsed
+            conditions, as a list of (group key, states) in order of first appearance. A morsel's partial
+            aggregates are merged with __merge_aggregates__. The function is picklable, for CSVParallel.
+        """
+        return partial(CSVTable.__partial_aggregates__, aggregates, group_by, conditions)
+
+    @staticmethod
+    def __partial_aggregates__(aggregates, group_by, conditions, table, rows):
+        value = table.__get_value__
+        groups = {}
+        for _, r in rows:
+            if r is None or not all(value(r, c[0]) is not None and c[1](value(r, c[0]), c[2])
+                                    for c in conditions):
+                continue
+            key = tuple(value(r, col) for col in group_by)
+            states = groups.get(key)
+            if states is None:
+                states = groups[key] = CSVTable.__new_aggregate_states__(aggregates)
+            for i, (function, col) in enumerate(aggregates):
+                v = 1 if col is None else value(r, col)
+                if v is None:
+                    continue
+                if function == "count":
+                    states[i] += 1
+                elif function in ("sum", "avg"):
+                    states[i][0] += v
+                    states[i][1] += 1
+                elif states[i] is None or (v < states[i] if function == "min" else v > states[i]):
+                    states[i] = v
+        return list(groups.items())
+
+    @staticmethod
+    def __merge_aggregates__(aggregates, groups, partials):
+        """
+        Merges the partial aggregates of one morsel into groups, {group key: states}.
+        """
+        for key, states in partials:
+            merged = groups.get(key)
+            if merged is None:
+                groups[key] = states
+                continue
+            for i, (function, _) in enumerate(aggregates):
+                if function == "count":
+                    merged[i] += states[i]
+                elif function in ("sum", "avg"):
+                    merged[i] = [merged[i][0] + states[i][0], merged[i][1] + states[i][1]]
+                elif merged[i] is None or states[i] is not None \
+                        and (states[i] < merged[i] if function == "min" else states[i] > merged[i]):
+                    merged[i] = states[i]
+
+    @CSVLock.read_locked
+    def aggregate(self, *aggregates, group_by=None, where=None):
+        """
+        Returns a derived table with one row per group: the group_by columns, and a column per aggregate,
+        named as given, e.g. aggregate('count(*)', 'avg(W)', group_by=['teamID'], where=['yearID >= 2000']).
+        Supports count(*), count, sum, avg, min and max of columns or expressions. NULLs are ignored, so the
+        sum, avg, min and max of a group without values are NULL. Groups come in order of their first row.
+        With parallel_degree > 1, large tables are aggregated by morsel in parallel (see CSVParallel).
+        :param group_by: Columns or expressions to group by, or None for one group of all rows.
+        :param where: Having-style conditions the rows must satisfy, e.g. ['yearID >= 2000'].
+        """
+        start_time = time.time()
+        usage = "Usage: <CSVTable>.aggregate('count(*)', 'sum(<column>)', ..., group_by=[...], where=['<column> = <val>', ...])"
+        group_by, where = group_by or [], where or []
+        if not aggregates or not isinstance(group_by, list) or not isinstance(where, list) \
+                or not all(isinstance(cond, str) for cond in where):
+            raise DataTableExceptions.DataTableException(
+                code=DataTableExceptions.DataTableException.invalid_method_call,
+                message=usage
+            )
+        for col in group_by:
+            if not isinstance(col, str) or not self.__is_valid_column__(col):
+                raise DataTableExceptions.DataTableException(
+                    code=DataTableExceptions.DataTableException.unknown_column,
+                    message="Unknown column '{}' in group_by\n".format(col) + usage
+                )
+        parsed = self.__parse_aggregates__(aggregates, usage)
+        conditions = self.__parse_conditions__(where, usage) if where else []
+
+        rownums, index_name = self.__get_having_candidates__(conditions) if conditions else (None, None)
+        partial = self.__get_partial_aggregates__(parsed, group_by, conditions)
+        morsels = CSVParallel.get_morsels(self, conditions=conditions, rownums=rownums)
+        groups = {}
+        if morsels is not None:
+            for partials in CSVParallel.run(self, morsels, partial):
+                self.__merge_aggregates__(parsed, groups, partials)
+        else:
+            rows = self.__rows__ or []
+            candidates = self.__iter_zones__(conditions=conditions) if rownums is None \
+                else (rows[rownum] for rownum in rownums)
+            self.__merge_aggregates__(parsed, groups, partial(self, ((None, r) for r in candidates)))
+        if not groups and not group_by:  # no rows: one row of empty aggregates, as in SQL
+            groups[()] = self.__new_aggregate_states__(parsed)
+
+        result = []
+        for key, states in groups.items():
+            row = dict(zip(group_by, key))
+            for agg, (function, _), state in zip(aggregates, parsed, states):
+                if function == "sum":
+                    state = state[0] if state[1] else None
+                elif function == "avg":
+                    state = state[0] / state[1] if state[1] else None
+                row[agg] = state
+            result.append(row)
+
+        column_types = self.__get_column_types__()
+        t_name = self.__table_name__ + '_aggregate_' + '_'.join(group_by)
+        new_table = CSVTable(t_name, load=False)
+        new_table.__column_names__ = group_by + list(aggregates)
+        new_table.__column_types__ = dict(
+            [(col, CSVExpression.result_type(col, column_types)) for col in group_by]
+            + [(agg, "number" if function in ("count", "sum", "avg") else CSVExpression.result_type(col, column_types))
+               for agg, (function, col) in zip(aggregates, parsed)])
+        new_table.__rows__ = result
+        new_table.__refresh_rownums__()
+
+        self.__record__("aggregate", start_time,
+                        rows_scanned=len(self.__rows__ or ()) if rownums is None else len(rownums),
+                        rows_returned=len(result),
+                        access_path="index" if index_name else "scan" if rownums is None else "partition",
+                        index=index_name, query=list(aggregates) + list(where))
         return new_table
 
+    @CSVLock.read_locked
     def order_by(self, *cols):
         """
         Returns new table with rows sorted by given columnsß
@@ -886,21 +3059,9 @@ class CSVTable:
                 message=usage
             )
 
-        sorts = []
-        for col in cols:
-            args = col.split(' ')
-            if len(args) == 2 and args[1].lower() == "desc":
-                sorts.append((args[0], True))
-            else:
-                sorts.append((args[0], False))
-
-        if not all(sort[0] in self.__get_column_names__() for sort in sorts):
-            raise DataTableExceptions.DataTableException(
-                code=DataTableExceptions.DataTableException.unknown_column,
-                message="Unknown column in order_by function call\n" + usage
-            )
+        sorts = self.__parse_sorts__(cols, usage)
 
-        rows = copy.deepcopy(self.__rows__)
+        rows = [copy.deepcopy(row) for row in self.__rows__ or () if row is not None]  # skip deleted rows
         for sort in reversed(sorts):
             rows = sorted(rows, key=lambda x: x[sort[0]], reverse=sort[1])
 
@@ -910,8 +3071,10 @@ class CSVTable:
         sorted_table.__column_types__ = self.__get_column_types__()
         sorted_table.__rows__ = rows
 
-        print("Sort time: {:.4f}s".format(time.time() - start_time))
+        self.__record__("order_by", start_time, label="Sort time", rows_scanned=len(rows),
+                        rows_returned=len(rows), access_path="sort", query=list(cols))
         return sorted_table
 
+    @CSVLock.read_locked
     def print_all(self, rownums=False):
         print(self.__str__(all=True, rownums=rownums))
@@ -0,0 +1,293 @@
+"""
+Benchmarks for CSVTable on scaled synthetic copies of data/People.csv and data/Teams.csv.
+
+Runs offline: table definitions come from LocalCatalog, an in-memory stand-in for the MySQL-backed
+CSVCatalog. Results are written as JSON so runs from different releases can be compared.
+
+Usage: python benchmark.py --sizes 10000 100000 --skew 1.2 --output bench.json
+"""
+import argparse
+import contextlib
+import csv
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+src_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'src')
+data_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'data')
+sys.path.append(os.path.realpath(src_path))
+
+import CSVCatalog
+import CSVTable
+from CSVCatalog import ColumnDefinition, IndexDefinition, TableDefinition
+
+
+class LocalConnection:
+    """
+    Connection stand-in that accepts and ignores catalog SQL.
+    """
+
+    def cursor(self):
+        return self
+
+    def execute(self, q):
+        pass
+
+    def fetchall(self):
+        return ()
+
+    def commit(self):
+        pass
+
+
+class LocalCatalog:
+    """
+    In-memory stand-in for CSVCatalog. Only supports what CSVTable needs: get_table().
+    """
+
+    def __init__(self):
+        self.cnx = LocalConnection()
+        self.table_definitions = {}
+
+    def create_table(self, table_name, file_name, column_definitions=None, index_definitions=None):
+        table = TableDefinition(table_name, file_name, column_definitions, index_definitions,
+                                cnx=self.cnx, init=False)
+        self.table_definitions[table_name.lower()] = table
+        return table
+
+    def get_table(self, table_name):
+        return self.table_definitions[table_name.lower()]
+
+
+def read_base(file_name):
+    with open(os.path.join(data_path, file_name), "r") as csvfile:
+        reader = csv.DictReader(csvfile)
+        return reader.fieldnames, list(reader)
+
+
+def zipf_sampler(rng, values, skew):
+    """
+    Returns a function drawing from values with weight 1 / rank^skew. skew=0 is uniform.
+    """
+    weights = [1.0 / (rank ** skew) for rank in range(1, len(values) + 1)]
+    return lambda: rng.choices(values, weights)[0]
+
+
+def generate_people(n, skew, seed, out_file):
+    """
+    Scaled copy of People.csv. playerID stays unique by suffixing the copy number. If skew > 0,
+    nameLast (the secondary index key) is redrawn from the distinct last names with Zipf skew.
+    """
+    fields, base = read_base("People.csv")
+    rng = random.Random(seed)
+    draw = zipf_sampler(rng, sorted(set(r['nameLast'] for r in base)), skew) if skew > 0 else None
+
+    with open(out_file, "w", newline='') as f:
+        writer = csv.DictWriter(f, fields)
+        writer.writeheader()
+        for i in range(n):
+            row = dict(base[i % len(base)])
+            copy_num = i // len(base)
+            if copy_num:
+                row['playerID'] += '.' + str(copy_num)
+            if draw:
+                row['nameLast'] = draw()
+            writer.writerow(row)
+
+
+def generate_teams(n, skew, seed, out_file):
+    """
+    Scaled copy of Teams.csv. (teamID, yearID) stays unique by shifting yearID 1000 years per copy.
+    If skew > 0, lgID (the secondary index key) is redrawn from the distinct leagues with Zipf skew.
+    """
+    fields, base = read_base("Teams.csv")
+    rng = random.Random(seed)
+    draw = zipf_sampler(rng, sorted(set(r['lgID'] for r in base)), skew) if skew > 0 else None
+
+    with open(out_file, "w", newline='') as f:
+        writer = csv.DictWriter(f, fields)
+        writer.writeheader()
+        for i in range(n):
+            row = dict(base[i % len(base)])
+            row['yearID'] = str(int(row['yearID']) + 1000 * (i // len(base)))
+            if draw:
+                row['lgID'] = draw()
+            writer.writerow(row)
+
+
+def define_tables(catalog, people_file, teams_file):
+    cds = [ColumnDefinition('playerID'), ColumnDefinition('nameLast', not_null=True),
+           ColumnDefinition('nameFirst'), ColumnDefinition('birthYear', 'number'),
+           ColumnDefinition('birthCountry')]
+    ids = [IndexDefinition('PRIMARY', 'PRIMARY', ['playerID']),
+           IndexDefinition('ln_idx', 'INDEX', ['nameLast'])]
+    catalog.create_table("people", people_file, cds, ids)
+
+    cds = [ColumnDefinition('teamID'), ColumnDefinition('yearID', 'number'),
+           ColumnDefinition('lgID'), ColumnDefinition('W', 'number'), ColumnDefinition('name')]
+    ids = [IndexDefinition('PRIMARY', 'PRIMARY', ['teamID', 'yearID']),
+           IndexDefinition('lg_idx', 'INDEX', ['lgID'])]
+    catalog.create_table("teams", teams_file, cds, ids)
+
+
+class TimedTable(CSVTable.CSVTable):
+    """
+    CSVTable that records how long loading and index building take.
+    """
+
+    def __load__(self):
+        start_time = time.perf_counter()
+        super().__load__()
+        self.load_time = time.perf_counter() - start_time
+
+    def __build_indexes__(self):
+        start_time = time.perf_counter()
+        super().__build_indexes__()
+        self.index_time = time.perf_counter() - start_time
+
+
+class Recorder:
+
+    def __init__(self, size):
+        self.size = size
+        self.results = []
+
+    def record(self, table, op, seconds, ops=1, rows=None):
+        result = {'table': table, 'size': self.size, 'op': op, 'ops': ops,
+                  'seconds': round(seconds, 6), 'per_op': round(seconds / ops, 9)}
+        if rows is not None:
+            result['rows'] = rows
+        self.results.append(result)
+
+    def time(self, table, op, f, ops=1):
+        """
+        Times f() and records it. An exception ends the run, so a failed operation is never reported as a
+        timing.
+        """
+        start_time = time.perf_counter()
+        rows = f()
+        self.record(table, op, time.perf_counter() - start_time, ops, rows=rows if isinstance(rows, int) else None)
+
+
+def bench_table(rec, name, key_values, secondary, scan, having, order_by, join_on, new_row, update_values,
+                rng, args):
+    table = TimedTable(name)
+    rec.record(name, 'load', table.load_time, rows=len(table))
+    rec.record(name, 'index_build', table.index_time, ops=len(table.indexes))
+    rec.time(name, 'analyze', lambda: len(table.analyze()))
+
+    keys = [rng.choice(key_values) for _ in range(args.ops)]
+    rec.time(name, 'pk_lookup', lambda: sum(len(table.find_by_template(k, show_time=False) or [])
+                                            for k in keys), ops=args.ops)
+    sec_keys = [rng.choice(secondary) for _ in range(args.ops)]
+    rec.time(name, 'secondary_lookup', lambda: sum(len(table.find_by_template(k, show_time=False) or [])
+                                                   for k in sec_keys), ops=args.ops)
+    rec.time(name, 'scan', lambda: len(table.find_by_template(scan, show_time=False)))
+    rec.time(name, 'having', lambda: len(table.having(*having)))
+    rec.time(name, 'order_by', lambda: len(table.order_by(*order_by)))
+    rec.time(name, 'join', lambda: len(table.join(table, join_on)))
+
+    inserted = [(new_row(i),) for i in range(args.mutations)]
+    rec.time(name, 'insert', lambda: call_each(table.insert, inserted), ops=args.mutations)
+    updates = [(rng.choice(key_values), update_values) for _ in range(args.mutations)]
+    rec.time(name, 'update', lambda: call_each(table.update, updates), ops=args.mutations)
+    deletes = [(k,) for k in rng.sample(key_values, args.mutations)]  # each key exists once
+    rec.time(name, 'delete', lambda: call_each(table.delete, deletes), ops=args.mutations)
+
+
+def call_each(f, arg_tuples):
+    for a in arg_tuples:
+        f(*a)
+    return len(arg_tuples)
+
+
+def run(args):
+    results = []
+    work_dir = args.data_dir or tempfile.mkdtemp(prefix="csvdb_bench_")
+    CSVTable.CSVTable.__catalog__ = catalog = LocalCatalog()
+
+    try:
+        for size in args.sizes:
+            people_file = os.path.join(work_dir, "People_{}_{}_{}.csv".format(size, args.skew, args.seed))
+            teams_file = os.path.join(work_dir, "Teams_{}_{}_{}.csv".format(size, args.skew, args.seed))
+            if not os.path.exists(people_file):
+                generate_people(size, args.skew, args.seed, people_file)
+            if not os.path.exists(teams_file):
+                generate_teams(size, args.skew, args.seed, teams_file)
+
+            # mutations rewrite the file, so benchmark against copies
+            people_copy = people_file[:-4] + "_work.csv"
+            teams_copy = teams_file[:-4] + "_work.csv"
+            shutil.copy(people_file, people_copy)
+            shutil.copy(teams_file, teams_copy)
+            define_tables(catalog, people_copy, teams_copy)
+
+            rec = Recorder(size)
+            rng = random.Random(args.seed)
+            base_people = read_base("People.csv")[1][:size]  # keys present in the generated copy
+            base_teams = read_base("Teams.csv")[1][:size]
+
+            with contextlib.redirect_stdout(io.StringIO()):  # engine prints progress and timing
+                bench_table(rec, 'people',
+                            key_values=[{'playerID': r['playerID']} for r in base_people],
+                            secondary=[{'nameLast': r['nameLast']} for r in base_people],  # may be skewed
+                            scan={'birthCountry': 'CAN'},
+                            having=['birthYear >= 1980'],
+                            order_by=['nameLast', 'playerID'],
+                            join_on=['playerID'],
+                            new_row=lambda i: {'playerID': 'bench{:06d}'.format(i), 'nameLast': 'Bench'},
+                            update_values={'birthCountry': 'XYZ'},
+                            rng=rng, args=args)
+                bench_table(rec, 'teams',
+                            key_values=[{'teamID': r['teamID'], 'yearID': int(r['yearID'])} for r in base_teams],
+                            secondary=[{'lgID': r['lgID']} for r in base_teams if r['lgID']],
+                            scan={'W': 90},
+                            having=['yearID >= 2000', 'W > 90'],
+                            order_by=['W DESC', 'teamID'],
+                            join_on=['teamID', 'yearID'],
+                            new_row=lambda i: {'teamID': 'BEN', 'yearID': 9000 + i},
+                            update_values={'W': 0},
+                            rng=rng, args=args)
+            results.extend(rec.results)
+
+            os.remove(people_copy)
+            os.remove(teams_copy)
+    finally:
+        if not args.data_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    return {'meta': {'sizes': args.sizes, 'skew': args.skew, 'seed': args.seed, 'ops': args.ops,
+                     'mutations': args.mutations, 'python': platform.python_version(),
+                     'platform': platform.platform()},
+            'results': results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark CSVTable on scaled synthetic data.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000],
+                        help="Row counts per table, e.g. 10000 100000 1000000 10000000")
+    parser.add_argument('--skew', type=float, default=0.0,
+                        help="Zipf exponent for secondary index keys; 0 keeps the original distribution")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--ops', type=int, default=1000, help="Lookups per lookup benchmark")
+    parser.add_argument('--mutations', type=int, default=10, help="Rows per insert/update/delete benchmark")
+    parser.add_argument('--data-dir', default=None, help="Keep generated CSV files here for reuse")
+    parser.add_argument('--output', default=None, help="Write JSON results here instead of stdout")
+    args = parser.parse_args()
+
+    report = json.dumps(run(args), indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report + '\n')
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
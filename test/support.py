@@ -0,0 +1,33 @@
+"""
+Fixtures for the unit tests. Tables are defined in benchmark.LocalCatalog, so the tests run offline, and
+read copies of the data files in a temporary directory, as writes rewrite the CSV files.
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+import benchmark
+import CSVTable
+
+
+class TableTestCase(unittest.TestCase):
+    """
+    Defines the people and teams tables of benchmark.define_tables on fresh copies of People.csv and
+    Teams.csv for every test.
+    """
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix="csvdb_test_")
+        people_file = os.path.join(self.work_dir, "People.csv")
+        teams_file = os.path.join(self.work_dir, "Teams.csv")
+        shutil.copy(os.path.join(benchmark.data_path, "People.csv"), people_file)
+        shutil.copy(os.path.join(benchmark.data_path, "Teams.csv"), teams_file)
+        self.catalog = benchmark.LocalCatalog()
+        benchmark.define_tables(self.catalog, people_file, teams_file)
+        self.saved_catalog = CSVTable.CSVTable.__catalog__
+        CSVTable.CSVTable.__catalog__ = self.catalog
+
+    def tearDown(self):
+        CSVTable.CSVTable.__catalog__ = self.saved_catalog
+        shutil.rmtree(self.work_dir, ignore_errors=True)
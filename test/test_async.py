@@ -0,0 +1,128 @@
+"""
+The asyncio facade (see CSVAsync), checked against the same calls on a CSVTable.
+"""
+import asyncio
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+import support
+import CSVAsync
+import CSVTable
+import DataTableExceptions
+
+
+class AsyncTest(support.TableTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.executor = ThreadPoolExecutor(max_workers=2)
+        self.io_executor = ThreadPoolExecutor(max_workers=1)
+        self.serial = CSVTable.CSVTable("teams")
+
+    def tearDown(self):
+        self.executor.shutdown()
+        self.io_executor.shutdown()
+        super().tearDown()
+
+    def run_async(self, f):
+        async def main():
+            teams = await CSVAsync.AsyncCSVTable.open("teams", self.executor, self.io_executor)
+            return await f(teams)
+        return asyncio.run(main())
+
+    @staticmethod
+    def rows(table):
+        return [{k: v for k, v in r.items() if k != 'rownum'} for r in table.find_by_template({}) or []]
+
+    def test_queries(self):
+        async def queries(teams):
+            people = CSVAsync.AsyncCSVTable(CSVTable.CSVTable("people"), self.executor, self.io_executor)
+            return (await teams.find({'lgID': 'AL'}, fields=['teamID', 'W'], limit=20),
+                    (await teams.find_page({'lgID': 'NL'}, page_size=10))[0],
+                    [r async for r in teams.iter({'teamID': 'BOS'}, batch_size=7)],
+                    [r async for r in teams.iter_having('W > 100', fields=['teamID'])],
+                    self.rows((await teams.having('W > 100', 'lgID = NL')).table),
+                    await teams.collect(teams.table.query().where({'lgID': 'AL'}).order_by('W DESC').limit(5)),
+                    (await teams.explain({'lgID': 'AL'}))['op'],
+                    len(await teams.join(teams, ['teamID', 'yearID'], where_template={'lgID': 'AL'})),
+                    len(await people.semi_join(people, ['playerID'], where_template={'nameLast': 'Aaron'})))
+
+        serial, people = self.serial, CSVTable.CSVTable("people")
+        self.assertEqual(self.run_async(queries),
+                         (serial.find_by_template({'lgID': 'AL'}, fields=['teamID', 'W'], limit=20),
+                          serial.find_page({'lgID': 'NL'}, page_size=10)[0],
+                          serial.find_by_template({'teamID': 'BOS'}),
+                          list(serial.iter_having('W > 100', fields=['teamID'])),
+                          self.rows(serial.having('W > 100', 'lgID = NL')),
+                          serial.query().where({'lgID': 'AL'}).order_by('W DESC').limit(5).collect(),
+                          serial.explain({'lgID': 'AL'})['op'],
+                          len(serial.join(serial, ['teamID', 'yearID'], where_template={'lgID': 'AL'})),
+                          len(people.semi_join(people, ['playerID'], where_template={'nameLast': 'Aaron'}))))
+
+    def test_concurrent_reads_and_writes(self):
+        async def work(teams):
+            new = {'teamID': 'ZZZ', 'yearID': 3000, 'lgID': 'AL', 'W': 1, 'name': 'Zed'}
+            results = await asyncio.gather(teams.find({'lgID': 'AL'}), teams.insert(new),
+                                           teams.update({'teamID': 'BOS'}, {'W': 0}), teams.find({'lgID': 'NL'}))
+            await teams.delete({'lgID': 'NA'})
+            await teams.vacuum()
+            return results, teams.table
+
+        results, teams = self.run_async(work)
+        expected = [dict(r, W=0) if r['teamID'] == 'BOS' else r for r in self.rows(self.serial) if r['lgID'] != 'NA']
+        expected.append({'teamID': 'ZZZ', 'yearID': 3000, 'lgID': 'AL', 'W': 1, 'name': 'Zed'})
+        self.assertEqual(self.rows(teams), expected)
+        self.assertEqual(self.rows(CSVTable.CSVTable("teams")), expected)
+        self.assertEqual(results[3], self.serial.find_by_template({'lgID': 'NL'}))  # no NL row was changed
+
+    def test_iterator_releases_its_snapshot(self):
+        async def stop_early(teams):
+            rows = teams.iter({}, batch_size=10)
+            first = [r async for r, _ in zip_async(rows, range(15))]
+            await rows.aclose()
+            return first, teams.table
+
+        first, teams = self.run_async(stop_early)
+        self.assertEqual(first, self.serial.find_by_template({})[:15])
+        self.assertEqual(teams.__pins__, {})
+
+    def test_cancelled_write_completes(self):
+        release = threading.Event()
+
+        async def cancel(teams):
+            self.io_executor.submit(release.wait)  # holds the one io worker, so the update waits in the queue
+            task = asyncio.ensure_future(teams.update({'teamID': 'BOS'}, {'W': 0}))
+            await asyncio.sleep(0)
+            task.cancel()
+            release.set()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            return teams.table
+
+        teams = self.run_async(cancel)
+        self.io_executor.shutdown(wait=True)
+        self.assertEqual({r['W'] for r in teams.find_by_template({'teamID': 'BOS'})}, {0})
+
+    def test_errors(self):
+        async def bad(teams):
+            with self.assertRaises(DataTableExceptions.DataTableException):
+                await teams.find({'nope': 1})
+            with self.assertRaises(DataTableExceptions.DataTableException):
+                await teams.insert({'teamID': 'BOS', 'yearID': 2004, 'lgID': 'AL', 'W': 1, 'name': 'Dup'})
+            return True
+
+        self.assertTrue(self.run_async(bad))
+
+
+async def zip_async(rows, counter):
+    for i in counter:
+        try:
+            row = await rows.__anext__()
+        except StopAsyncIteration:
+            return
+        yield row, i
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,165 @@
+"""
+CSVCatalog on a catalog database created by an earlier release, before sql/upgrade.sql is run.
+"""
+import os
+import re
+import unittest
+
+import benchmark
+import CSVCatalog
+import DataTableExceptions
+from CSVCatalog import ColumnDefinition, IndexDefinition, PartitionDefinition
+
+teams_file = os.path.join(benchmark.data_path, "Teams.csv")
+
+# the catalog tables as created by a release without column encodings, statistics or partitions
+old_schema = {'CSVTables': ['table_name', 'file_path'],
+              'CSVColumns': ['table_name', 'column_name', 'column_type', 'not_null'],
+              'CSVIndexes': ['table_name', 'index_name', 'index_type', 'columns']}
+
+
+class CatalogDatabase:
+    """
+    Connection stand-in holding the catalog tables in memory. Understands the statements CSVCatalog sends,
+    and fails on unknown tables and columns as MySQL does.
+    """
+
+    def __init__(self, schema):
+        self.schema = {table: list(columns) for table, columns in schema.items()}
+        self.rows = {table: [] for table in schema}
+        self.result = ()
+
+    def cursor(self):
+        return self
+
+    def commit(self):
+        pass
+
+    def fetchall(self):
+        return self.result
+
+    def table(self, name):
+        if name not in self.schema:
+            raise Exception("(1146, \"Table 'CSVCatalog.{}' doesn't exist\")".format(name))
+        return self.schema[name]
+
+    def check_columns(self, table, columns):
+        for col in columns:
+            if col not in self.table(table):
+                raise Exception("(1054, \"Unknown column '{}' in 'field list'\")".format(col))
+
+    def where(self, table, condition):
+        if condition is None:
+            return lambda row: True
+        conditions = re.findall(r"(\w+)='((?:[^']|'')*)'", condition)
+        self.check_columns(table, [col for col, _ in conditions])
+        return lambda row: all(str(row[col]) == value for col, value in conditions)
+
+    def execute(self, q):
+        self.result = ()
+        if "information_schema" in q:
+            self.result = [(table, col) for table, columns in self.schema.items() for col in columns]
+            return
+        match = re.match(r"SELECT (.+?) FROM (\w+)(?: WHERE (.+))?$", q)
+        if match:
+            fields, table, condition = match.groups()
+            fields = self.table(table) if fields == "*" else [f.strip() for f in fields.split(",")]
+            self.check_columns(table, fields)
+            matches = self.where(table, condition)
+            self.result = [tuple(row[f] for f in fields) for row in self.rows[table] if matches(row)]
+            return
+        match = re.match(r"DELETE FROM (\w+)(?: WHERE (.+))?$", q)
+        if match:
+            table, condition = match.groups()
+            self.table(table)
+            matches = self.where(table, condition)
+            self.rows[table] = [row for row in self.rows[table] if not matches(row)]
+            return
+        match = re.match(r"INSERT INTO (\w+) \((.+?)\) VALUES \((.*)\)$", q)
+        if match:
+            table, fields, values = match.groups()
+            fields = [f.strip() for f in fields.split(",")]
+            self.check_columns(table, fields)
+            values = [None if v == "NULL" else v.strip("'") for v in re.findall(r"'(?:[^']|'')*'|NULL|[\w.]+", values)]
+            self.rows[table].append(dict(zip(fields, values)))
+            return
+        raise Exception("Unsupported statement: " + q)
+
+
+def make_catalog(cnx):
+    catalog = object.__new__(CSVCatalog.CSVCatalog)  # without connecting to MySQL
+    catalog.cnx = cnx
+    catalog.table_definitions = []
+    return catalog
+
+
+class OldCatalogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cnx = CatalogDatabase(old_schema)
+        self.catalog = make_catalog(self.cnx)
+        self.cds = [ColumnDefinition('teamID'), ColumnDefinition('yearID', 'number'),
+                    ColumnDefinition('lgID'), ColumnDefinition('W', 'number')]
+        self.ids = [IndexDefinition('PRIMARY', 'PRIMARY', ['teamID', 'yearID'])]
+
+    def test_columns_without_encoding(self):
+        self.catalog.create_table("teams", teams_file, self.cds, self.ids)
+        table = make_catalog(self.cnx).get_table("teams")
+        self.assertEqual(sorted(c.name for c in table.column_definitions), ['W', 'lgID', 'teamID', 'yearID'])
+        self.assertEqual({c.encoding for c in table.column_definitions}, {"auto"})
+        self.assertEqual(table.index_definitions[0].columns, ['teamID', 'yearID'])
+
+    def test_encoding_needs_upgrade(self):
+        table = self.catalog.create_table("teams", teams_file, self.cds, self.ids)
+        with self.assertRaises(DataTableExceptions.DataTableException) as raised:
+            table.add_column_definition(ColumnDefinition('name', encoding="dictionary"))
+        self.assertIn("sql/upgrade.sql", raised.exception.message)
+        self.assertEqual(len(table.column_definitions), 4)
+
+    def test_upgraded_catalog_stores_encoding(self):
+        cnx = CatalogDatabase(dict(old_schema, CSVColumns=old_schema['CSVColumns'] + ['encoding']))
+        make_catalog(cnx).create_table("teams", teams_file, self.cds + [ColumnDefinition('name', encoding="plain")])
+        table = make_catalog(cnx).get_table("teams")
+        self.assertEqual(table.get_column_by_name('name').encoding, "plain")
+        self.assertEqual(table.get_column_by_name('lgID').encoding, "auto")
+
+    def test_statistics_without_table(self):
+        table = self.catalog.create_table("teams", teams_file, self.cds, self.ids)
+        with self.assertRaises(DataTableExceptions.DataTableException) as raised:
+            table.set_statistics({'W': {'row_count': 1}})
+        self.assertIn("sql/upgrade.sql", raised.exception.message)
+        self.assertEqual(make_catalog(self.cnx).get_table("teams").statistics, {})
+        make_catalog(self.cnx).drop_table("teams")
+        self.assertEqual(self.cnx.rows['CSVTables'], [])
+        self.assertEqual(self.cnx.rows['CSVColumns'], [])
+
+    def test_upgraded_catalog_stores_statistics(self):
+        cnx = CatalogDatabase(dict(old_schema, CSVStatistics=['table_name', 'column_name', 'statistics']))
+        make_catalog(cnx).create_table("teams", teams_file, self.cds).set_statistics({'W': {'row_count': 1}})
+        self.assertEqual(make_catalog(cnx).get_table("teams").statistics, {'W': {'row_count': 1}})
+        make_catalog(cnx).drop_table("teams")
+        self.assertEqual(cnx.rows['CSVStatistics'], [])
+
+    def test_partitioning_without_table(self):
+        table = self.catalog.create_table("teams", teams_file, self.cds, self.ids)
+        table.set_partitioning(None)
+        with self.assertRaises(DataTableExceptions.DataTableException) as raised:
+            table.set_partitioning(PartitionDefinition('yearID', "RANGE", [1900, 2000]))
+        self.assertIn("sql/upgrade.sql", raised.exception.message)
+        self.assertIsNone(make_catalog(self.cnx).get_table("teams").partition_definition)
+        make_catalog(self.cnx).drop_table("teams")
+        self.assertEqual(self.cnx.rows['CSVTables'], [])
+
+    def test_upgraded_catalog_stores_partitioning(self):
+        cnx = CatalogDatabase(dict(old_schema, CSVPartitions=['table_name', 'column_name', 'partition_type',
+                                                              'bounds', 'partitions', 'directory']))
+        make_catalog(cnx).create_table("teams", teams_file, self.cds).set_partitioning(
+            PartitionDefinition('yearID', "RANGE", [1900, 2000]))
+        partitioning = make_catalog(cnx).get_table("teams").partition_definition
+        self.assertEqual((partitioning.column, partitioning.bounds), ('yearID', [1900, 2000]))
+        make_catalog(cnx).drop_table("teams")
+        self.assertEqual(cnx.rows['CSVPartitions'], [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+"""
+Functional indexes on column expressions (see CSVExpression).
+"""
+import os
+import unittest
+
+import support
+import CSVExpression
+import CSVMetrics
+import CSVTable
+from CSVCatalog import ColumnDefinition, IndexDefinition
+
+
+class FunctionalIndexTest(support.TableTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.catalog.create_table("debuts", os.path.join(self.work_dir, "People.csv"),
+                                  [ColumnDefinition('playerID'), ColumnDefinition('nameLast'),
+                                   ColumnDefinition('debut')],
+                                  [IndexDefinition('PRIMARY', 'PRIMARY', ['playerID']),
+                                   IndexDefinition('dy', 'INDEX', ['substr(debut, 1, 4)']),
+                                   IndexDefinition('lower_ln', 'INDEX', ['lower(nameLast)'])])
+        self.people = CSVTable.CSVTable("debuts")
+        self.people.__metrics__ = CSVMetrics.MetricsRegistry()
+        self.records = []
+        self.people.__metrics__.add_listener(self.records.append)
+
+    def scan(self, expression, value):
+        return [r['playerID'] for r in self.people.__rows__
+                if r is not None and CSVExpression.evaluate(expression, r) == value]
+
+    def test_both_spellings_use_the_index(self):
+        expected = self.scan('substr(debut,1,4)', '1990')
+        self.assertTrue(expected)
+        for col in ('substr(debut,1,4)', 'substr(debut, 1, 4)', 'substr( debut , 1 , 4 )'):
+            t = {col: '1990'}
+            self.assertEqual(self.people.explain(t)['op'], 'IndexLookup')
+            self.assertEqual([r['playerID'] for r in self.people.find_by_template(t)], expected)
+            self.assertEqual(self.records[-1]['access_path'], 'index')
+            self.assertEqual(self.records[-1]['rows_scanned'], len(expected))
+            self.assertEqual([r['playerID'] for r in self.people.iter_by_template(t)], expected)
+            self.assertEqual([r['playerID'] for r in self.people.find_page(t, page_size=1000)[0]], expected)
+            self.assertEqual([r['playerID'] for r in self.people.query().where(t).collect()], expected)
+
+    def test_lower(self):
+        expected = self.scan('lower(nameLast)', 'smith')
+        for col in ('lower(nameLast)', 'lower( nameLast )'):
+            self.assertEqual([r['playerID'] for r in self.people.find_by_template({col: 'smith'})], expected)
+            self.assertEqual(self.records[-1]['access_path'], 'index')
+        self.assertEqual([r['playerID'] for r in self.people.having('lower( nameLast ) = smith').find_by_template({})],
+                         expected)
+
+    def test_index_follows_writes(self):
+        self.people.update({'playerID': self.scan('lower(nameLast)', 'smith')[0]}, {'nameLast': 'Smythe'})
+        self.people.insert({'playerID': 'zz01', 'nameLast': 'SMITH', 'debut': '1990-04-01'})
+        for expression, value in (('lower(nameLast)', 'smith'), ('lower(nameLast)', 'smythe'),
+                                  ('substr(debut,1,4)', '1990')):
+            self.assertEqual([r['playerID'] for r in self.people.find_by_template({expression: value})],
+                             self.scan(expression, value))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,65 @@
+"""
+Incremental index maintenance on insert, update and delete, checked against indexes rebuilt from the rows.
+"""
+import unittest
+
+import support
+import CSVTable
+import DataTableExceptions
+
+
+class IndexMaintenanceTest(support.TableTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.teams = CSVTable.CSVTable("teams")
+
+    def check_indexes(self, table):
+        for name, idx in table.indexes.items():
+            expected = {}
+            for r in table.__rows__:
+                if r is not None:
+                    expected.setdefault(table.__create_key_template__(r, idx['columns'])[0], []).append(r['rownum'])
+            self.assertEqual(dict(idx['index']), expected, name)  # no empty buckets are left behind
+            self.assertEqual(set(idx['values']), set(expected), name)
+            if 'sorted_keys' in idx:
+                self.assertEqual(idx['sorted_keys'], sorted(expected), name)
+            self.assertEqual(table.__get_selectivity__(idx), len(expected) / len(table.__rows__), name)
+
+    def test_insert(self):
+        self.teams.__get_selectivity__(self.teams.indexes['lg_idx'])
+        self.teams.insert({'teamID': 'ZZZ', 'yearID': 3000, 'lgID': 'XX', 'W': 1, 'name': 'Zed'})
+        self.teams.insert({'teamID': 'ZZZ', 'yearID': 3001, 'lgID': 'AL', 'W': 2, 'name': 'Zed'})
+        self.check_indexes(self.teams)
+        with self.assertRaises(DataTableExceptions.DataTableException):  # duplicate primary key
+            self.teams.insert({'teamID': 'ZZZ', 'yearID': 3000, 'lgID': 'NL', 'W': 3, 'name': 'Zed'})
+        self.check_indexes(self.teams)
+
+    def test_update(self):
+        self.teams.update({'teamID': 'BOS', 'yearID': 2004}, {'teamID': 'BOX', 'lgID': 'XX'})  # primary key
+        self.teams.update({'lgID': 'UA'}, {'lgID': 'AL'})  # empties a bucket
+        self.teams.update({'lgID': 'AL'}, {'lgID': 'NL'})  # a large batch into a large bucket
+        self.teams.update({'teamID': 'NYA'}, {'W': 0})  # no indexed column changes
+        self.teams.update({'teamID': 'NOPE', 'yearID': 1}, {'W': 1})  # the primary key finds nothing
+        self.check_indexes(self.teams)
+        self.assertEqual(self.teams.find_by_template({'lgID': 'NL'}),
+                         [r for r in self.teams.__rows__ if r is not None and r['lgID'] == 'NL'])
+
+    def test_delete(self):
+        self.teams.delete({'teamID': 'BOS', 'yearID': 2004})
+        self.teams.delete({'lgID': 'FL'})  # empties a bucket
+        self.teams.delete({'W': 90})
+        self.teams.delete({'teamID': 'NOPE', 'yearID': 1})
+        self.check_indexes(self.teams)
+        self.assertNotIn('FL', self.teams.indexes['lg_idx']['index'])
+
+    def test_mixed_writes_after_vacuum(self):
+        self.teams.delete({'lgID': 'NA'})
+        self.teams.vacuum()
+        self.teams.insert({'teamID': 'ZZZ', 'yearID': 3000, 'lgID': 'NA', 'W': 1, 'name': 'Zed'})
+        self.teams.update({'teamID': 'ZZZ'}, {'lgID': 'AL'})
+        self.check_indexes(self.teams)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+"""
+IN lists and OR templates, answered by index merge, checked against a scan of the rows.
+"""
+import os
+import shutil
+import unittest
+
+import support
+import CSVMetrics
+import CSVTable
+from CSVCatalog import ColumnDefinition, IndexDefinition
+
+
+class IndexMergeTest(support.TableTestCase):
+
+    def setUp(self):
+        super().setUp()
+        seasons_file = os.path.join(self.work_dir, "Seasons.csv")
+        shutil.copy(os.path.join(self.work_dir, "Teams.csv"), seasons_file)
+        self.catalog.create_table("seasons", seasons_file,
+                                  [ColumnDefinition('teamID'), ColumnDefinition('yearID', 'number'),
+                                   ColumnDefinition('lgID'), ColumnDefinition('W', 'number')],
+                                  [IndexDefinition('tid_idx', 'INDEX', ['teamID']),
+                                   IndexDefinition('yr_idx', 'INDEX', ['yearID']),
+                                   IndexDefinition('lg_idx', 'INDEX', ['lgID'])])
+        self.seasons = CSVTable.CSVTable("seasons")
+        self.teams = CSVTable.CSVTable("teams")
+        self.records = []
+        for table in (self.seasons, self.teams):
+            table.__metrics__ = CSVMetrics.MetricsRegistry()
+            table.__metrics__.add_listener(self.records.append)
+
+    @staticmethod
+    def matches(r, t):
+        return any(all(r[k] in v if isinstance(v, list) else r[k] == v for k, v in sub_t.items())
+                   for sub_t in (t if isinstance(t, list) else [t]))
+
+    def scan(self, table, t):
+        return [r for r in table.__rows__ if r is not None and self.matches(r, t)]
+
+    def check(self, table, t, access_path):
+        expected = self.scan(table, t)
+        self.assertEqual(table.find_by_template(t) or [], expected)
+        self.assertEqual(self.records[-1]['access_path'], access_path)
+        self.assertEqual(list(table.iter_by_template(t)), expected)
+        self.assertEqual(table.find_page(t, page_size=10000)[0], expected)
+        return expected
+
+    def test_in_lists(self):
+        self.assertTrue(self.check(self.seasons, {'teamID': ['NYA', 'BOS']}, 'index_merge'))
+        self.check(self.seasons, {'teamID': ['NYA', 'BOS'], 'W': [90, 95, 100]}, 'index_merge')
+        self.check(self.seasons, {'teamID': ['NYA', 'NOPE']}, 'index_merge')
+        self.check(self.teams, {'teamID': ['BOS', 'NYA'], 'yearID': [2003, 2004]}, 'index_merge')
+        self.check(self.teams, {'W': [100, 101]}, 'scan')
+
+    def test_or_templates(self):
+        self.check(self.seasons, [{'teamID': 'NYA'}, {'lgID': 'NL', 'yearID': 1990}], 'index_merge')
+        self.check(self.teams, [{'teamID': 'BOS', 'yearID': 2004}, {'teamID': 'NYA', 'yearID': 1998}],
+                   'index_merge')
+        self.check(self.seasons, [{'teamID': 'NYA'}, {'teamID': 'NYA', 'lgID': 'AL'}], 'index_merge')
+        self.check(self.seasons, [{'teamID': 'NYA'}, {'W': 100}], 'scan')  # one part needs a scan
+
+    def test_intersection(self):
+        t = {'teamID': 'BOS', 'lgID': 'AL', 'yearID': 2004}
+        self.assertEqual(len(self.check(self.seasons, t, 'index_merge')), 1)
+        self.seasons.find_by_template(t)
+        self.assertEqual(self.records[-1]['rows_scanned'], 1)  # only the row in every probed bucket is fetched
+        plan = self.seasons.explain(t)
+        self.assertEqual(plan['op'], 'IndexMerge')
+        self.assertIn('tid_idx', plan['index'].split(','))
+        self.assertEqual(plan['actual_rows'], 1)
+
+    def test_follows_writes(self):
+        self.seasons.update({'teamID': 'BOS', 'yearID': 2004}, {'lgID': 'NL'})
+        self.seasons.delete({'teamID': 'NYA', 'yearID': 1998})
+        self.seasons.insert({'teamID': 'NYA', 'yearID': 3000, 'lgID': 'NL', 'W': 1})
+        for t in ({'teamID': ['NYA', 'BOS'], 'lgID': 'NL'}, [{'teamID': 'NYA'}, {'lgID': 'NL', 'yearID': 2004}]):
+            self.check(self.seasons, t, 'index_merge')
+
+
+if __name__ == "__main__":
+    unittest.main()
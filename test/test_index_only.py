@@ -0,0 +1,77 @@
+"""
+Index-only (covering index) lookups in find_by_template, checked against a scan of the rows.
+"""
+import unittest
+
+import support
+import CSVMetrics
+import CSVTable
+
+
+class UnreadRows(list):
+    """
+    Row store that fails any read of a row, so a test can show that a lookup never dereferenced __rows__.
+    """
+
+    def __getitem__(self, item):
+        raise AssertionError("row {} was read".format(item))
+
+    def __iter__(self):
+        raise AssertionError("rows were iterated")
+
+
+class IndexOnlyTest(support.TableTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.teams = CSVTable.CSVTable("teams")
+        self.teams.__metrics__ = CSVMetrics.MetricsRegistry()
+        self.records = []
+        self.teams.__metrics__.add_listener(self.records.append)
+
+    def scan(self, t, fields):
+        return [{f: r[f] for f in fields} for r in self.teams.__rows__ if r is not None
+                and all(r[k] in v if isinstance(v, list) else r[k] == v for k, v in t.items())]
+
+    def check(self, t, fields, access_path='index_only'):
+        expected = self.scan(t, fields)
+        self.assertEqual(self.teams.find_by_template(t, fields=fields) or [], expected)
+        self.assertEqual(self.records[-1]['access_path'], access_path)
+        self.assertEqual(list(self.teams.iter_by_template(t, fields=fields)), expected)
+        return expected
+
+    def test_covered_lookups(self):
+        self.assertTrue(self.check({'lgID': 'NL'}, ['lgID']))
+        self.check({'lgID': 'NL'}, ['lgID', 'rownum'])
+        self.check({'teamID': 'BOS', 'yearID': 2004}, ['yearID', 'teamID'])
+        self.check({'lgID': ['AL', 'NL']}, ['lgID'])
+        self.check({'lgID': 'XX'}, ['lgID'])
+        self.check({'lgID': 'NL'}, ['lgID', 'W'], access_path='index')  # W is not in the index
+        self.check({'teamID': 'BOS'}, ['teamID', 'yearID'], access_path='index')  # yearID is not in teamID_idx
+        self.check({'W': 90}, ['W'], access_path='scan')
+
+    def test_rows_are_not_read(self):
+        expected = self.scan({'lgID': 'AL'}, ['lgID', 'rownum'])
+        rows = self.teams.__rows__
+        self.teams.__rows__ = UnreadRows(rows)
+        try:
+            self.assertEqual(self.teams.find_by_template({'lgID': 'AL'}, fields=['lgID', 'rownum']), expected)
+            self.assertEqual(list(self.teams.iter_by_template({'lgID': 'AL'}, fields=['rownum', 'lgID'])),
+                             expected)
+        finally:
+            self.teams.__rows__ = rows
+
+    def test_follows_writes(self):
+        self.teams.update({'teamID': 'BOS', 'yearID': 2004}, {'lgID': 'XX'})
+        self.teams.update({'lgID': 'AL', 'yearID': 1990}, {'lgID': 'NL'})
+        self.teams.delete({'teamID': 'NYA'})
+        self.teams.insert({'teamID': 'ZZZ', 'yearID': 3000, 'lgID': 'XX', 'W': 1, 'name': 'Zed'})
+        for lg in ('AL', 'NL', 'XX'):
+            self.check({'lgID': lg}, ['lgID', 'rownum'])
+        self.teams.vacuum()
+        for lg in ('AL', 'NL', 'XX'):
+            self.check({'lgID': lg}, ['rownum', 'lgID'])
+
+
+if __name__ == "__main__":
+    unittest.main()
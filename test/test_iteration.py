@@ -0,0 +1,71 @@
+"""
+Lazy result iteration (iter_by_template, iter_having) and streaming export, checked against a scan of the rows.
+"""
+import csv
+import json
+import os
+import unittest
+from itertools import islice
+
+import support
+import CSVTable
+import DataTableExceptions
+
+
+class IterationTest(support.TableTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.teams = CSVTable.CSVTable("teams")
+
+    def scan(self, keep, fields=None):
+        return [{f: r[f] for f in fields} if fields else r for r in self.teams.__rows__ if r is not None and keep(r)]
+
+    def test_iter_by_template(self):
+        for t in ({'lgID': 'AL'}, {'teamID': 'BOS', 'yearID': 2004}, {'W': 90}, {}, {'teamID': 'NOPE'}):
+            expected = self.scan(lambda r: all(r[k] == v for k, v in t.items()))
+            self.assertEqual(list(self.teams.iter_by_template(t)), expected)
+            self.assertEqual(list(self.teams.iter_by_template(t)), self.teams.find_by_template(t) or [])
+        self.assertEqual(list(self.teams.iter_by_template({'lgID': 'NL'}, fields=['teamID', 'W'], limit=7, offset=3)),
+                         self.scan(lambda r: r['lgID'] == 'NL', ['teamID', 'W'])[3:10])
+
+    def test_iter_having(self):
+        expected = self.scan(lambda r: r['yearID'] >= 2000 and r['W'] > 95, ['teamID', 'yearID'])
+        self.assertEqual(list(self.teams.iter_having('yearID >= 2000', 'W > 95', fields=['teamID', 'yearID'])),
+                         expected)
+        self.assertEqual(list(self.teams.iter_having('name LIKE Boston%')),
+                         self.scan(lambda r: r['name'].startswith('Boston')))
+
+    def test_lazy(self):
+        rows = self.teams.iter_by_template({})
+        self.assertEqual(list(islice(rows, 3)), self.scan(lambda r: True)[:3])
+        rows.close()
+
+    def test_arguments_checked_when_called(self):
+        with self.assertRaises(DataTableExceptions.DataTableException):
+            self.teams.iter_by_template({'nope': 1})
+        with self.assertRaises(DataTableExceptions.DataTableException):
+            self.teams.iter_having('W ~ 1')
+
+    def test_export_rows(self):
+        rows = self.teams.iter_by_template({'lgID': 'AL'}, fields=['teamID', 'yearID', 'W'])
+        file_name = os.path.join(self.work_dir, "al.jsonl")
+        expected = self.scan(lambda r: r['lgID'] == 'AL', ['teamID', 'yearID', 'W'])
+        self.assertEqual(CSVTable.export_rows(rows, file_name), len(expected))
+        with open(file_name) as f:
+            self.assertEqual([json.loads(line) for line in f], expected)
+
+        file_name = os.path.join(self.work_dir, "al.csv")
+        self.assertEqual(CSVTable.export_rows(self.teams.iter_by_template({'lgID': 'AL'}), file_name,
+                                              fields=['teamID', 'W']), len(expected))
+        with open(file_name, newline='') as f:
+            self.assertEqual(list(csv.DictReader(f)),
+                             [{'teamID': r['teamID'], 'W': str(r['W'])} for r in expected])
+
+        self.assertEqual(CSVTable.export_rows(iter(()), os.path.join(self.work_dir, "none.csv")), 0)
+        with self.assertRaises(DataTableExceptions.DataTableException):
+            CSVTable.export_rows(iter(expected), os.path.join(self.work_dir, "missing", "al.csv"))
+
+
+if __name__ == "__main__":
+    unittest.main()
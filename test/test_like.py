@@ -0,0 +1,75 @@
+"""
+LIKE conditions in having, iter_having and CSVQuery, and their index prefix range scans, checked against a scan.
+"""
+import re
+import unittest
+
+import support
+import CSVMetrics
+import CSVPlanner
+import CSVTable
+
+
+class LikeTest(support.TableTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.people = CSVTable.CSVTable("people")
+        self.people.__metrics__ = CSVMetrics.MetricsRegistry()
+        self.records = []
+        self.people.__metrics__.add_listener(self.records.append)
+
+    def scan(self, pattern):
+        regex = re.compile(pattern.replace('%', '.*').replace('_', '.'), re.DOTALL)
+        return [r['playerID'] for r in self.people.__rows__
+                if r is not None and r['nameLast'] is not None and regex.fullmatch(r['nameLast'])]
+
+    def having(self, *conditions):
+        return [r['playerID'] for r in self.people.having(*conditions).find_by_template({}) or []]
+
+    def test_patterns(self):
+        for pattern, access_path in (('Aar%', 'index'), ('Sm_th', 'index'), ('Mc%n', 'index'), ('%son', 'scan'),
+                                     ('_a%', 'scan'), ('Zzzz%', 'index'), ('%', 'scan')):
+            expected = self.scan(pattern)
+            self.assertEqual(self.having('nameLast LIKE ' + pattern), expected)
+            self.assertEqual(self.records[-1]['access_path'], access_path, pattern)
+            self.assertEqual([r['playerID'] for r in self.people.iter_having('nameLast LIKE ' + pattern)], expected)
+            self.assertEqual([r['playerID'] for r in self.people.query().having('nameLast LIKE ' + pattern)],
+                             expected)
+        self.assertTrue(self.scan('Aar%'))
+
+    def test_prefix_scan_reads_only_candidates(self):
+        expected = self.scan('Aar%')
+        self.having('nameLast LIKE Aar%')
+        self.assertEqual(self.records[-1]['rows_scanned'], len(expected))
+        plan = self.people.query().having('nameLast LIKE Aar%').__plan__()
+        self.assertEqual(plan[0]['op'], 'IndexRangeScan')
+        self.assertEqual(plan[0]['index'], 'ln_idx')
+
+    def test_with_other_conditions(self):
+        expected = [r['playerID'] for r in self.people.__rows__ if r is not None and r['nameLast'] is not None
+                    and r['nameLast'].startswith('B') and r['birthYear'] is not None and r['birthYear'] > 1980]
+        self.assertEqual(self.having('nameLast LIKE B%', 'birthYear > 1980'), expected)
+
+    def test_literal_characters(self):
+        self.assertTrue(CSVPlanner.like('O.Neal', 'O.N%'))
+        self.assertFalse(CSVPlanner.like('OxNeal', 'O.N%'))
+        self.assertTrue(CSVPlanner.like('a+b', 'a+_'))
+        self.assertFalse(CSVPlanner.like('smith', 'Smith'))  # case sensitive, like the index keys
+        self.assertEqual(CSVPlanner.like_prefix('Mc_n%'), 'Mc')
+
+    def test_sorted_keys_follow_writes(self):
+        self.having('nameLast LIKE Aar%')  # builds the sorted keys
+        victim = self.scan('Aar%')[0]
+        self.people.insert({'playerID': 'zz01', 'nameLast': 'Aardvark', 'nameFirst': 'Al'})
+        self.people.update({'playerID': victim}, {'nameLast': 'Zaaron'})
+        self.people.delete({'nameLast': 'Aase'})
+        index = self.people.indexes['ln_idx']
+        self.assertEqual(index['sorted_keys'], sorted(index['index']))
+        for pattern in ('Aar%', 'Zaa%', 'Aas%'):
+            self.assertEqual(self.having('nameLast LIKE ' + pattern), self.scan(pattern))
+        self.assertIn('zz01', self.having('nameLast LIKE Aar%'))
+
+
+if __name__ == "__main__":
+    unittest.main()
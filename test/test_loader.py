@@ -0,0 +1,114 @@
+"""
+Loading CSV files with the positional reader and column converters, checked against csv.DictReader.
+"""
+import csv
+import os
+import unittest
+
+import support
+import CSVTable
+import DataTableExceptions
+from CSVCatalog import ColumnDefinition, IndexDefinition
+
+
+class LoaderTest(support.TableTestCase):
+
+    def read(self, file_name, columns):
+        """
+        The rows a load should produce, from csv.DictReader: defined columns only, '' as None, numbers parsed.
+        """
+        with open(file_name, newline='') as f:
+            rows = []
+            for r in csv.DictReader(f):
+                row = {}
+                for col, column_type in columns:
+                    value = r.get(col) or None
+                    row[col] = CSVTable.number(value) if column_type == "number" and value is not None else value
+                rows.append(dict(row, rownum=len(rows)))
+            return rows
+
+    def define(self, text, columns, not_null=()):
+        file_name = os.path.join(self.work_dir, "Edge.csv")
+        with open(file_name, "w", newline='') as f:
+            f.write(text)
+        self.catalog.create_table("edge", file_name,
+                                  [ColumnDefinition(col, column_type, not_null=col in not_null)
+                                   for col, column_type in columns],
+                                  [IndexDefinition('PRIMARY', 'PRIMARY', [columns[0][0]])])
+        return file_name
+
+    def test_data_files(self):
+        people = [('playerID', 'text'), ('nameLast', 'text'), ('nameFirst', 'text'), ('birthYear', 'number'),
+                  ('birthCountry', 'text')]
+        teams = [('teamID', 'text'), ('yearID', 'number'), ('lgID', 'text'), ('W', 'number'), ('name', 'text')]
+        for table_name, file_name, columns in (("people", "People.csv", people), ("teams", "Teams.csv", teams)):
+            table = CSVTable.CSVTable(table_name)
+            self.assertEqual(table.__rows__, self.read(os.path.join(self.work_dir, file_name), columns))
+            self.assertEqual(len(table), len(table.__rows__))
+
+    def test_dictionary_encoding(self):
+        teams = CSVTable.CSVTable("teams")
+        self.assertIn('lgID', teams.__dictionaries__)
+        al = [r['lgID'] for r in teams.__rows__ if r['lgID'] == 'AL']
+        self.assertTrue(all(value is al[0] for value in al))
+
+    def test_writes_replace_dictionaries(self):
+        teams = CSVTable.CSVTable("teams")
+        with teams.snapshot() as snap:
+            dictionaries = snap.__dictionaries__
+            leagues = dict(dictionaries['lgID'])
+            teams.insert({'teamID': 'ZZZ', 'yearID': 3000, 'lgID': 'XL', 'W': 1, 'name': 'Zed'})
+            teams.update({'teamID': 'ZZZ'}, {'lgID': 'AL'})
+            self.assertIs(snap.__dictionaries__, dictionaries)
+            self.assertEqual(dictionaries['lgID'], leagues)
+            self.assertIsNone(snap.find_by_template({'lgID': 'XL'}))  # the snapshot can still skip the scan
+        self.assertIn('XL', teams.__dictionaries__['lgID'])
+        self.assertIs(teams.find_by_template({'teamID': 'ZZZ'})[0]['lgID'], leagues['AL'])
+
+        teams.dictionary_max_distinct = len(teams.__dictionaries__['lgID'])
+        with teams.snapshot() as snap:
+            teams.insert({'teamID': 'ZZZ', 'yearID': 3001, 'lgID': 'YL', 'W': 1, 'name': 'Zed'})
+            self.assertNotIn('lgID', teams.__dictionaries__)  # too many distinct values to encode
+            self.assertIn('lgID', snap.__dictionaries__)
+        self.assertEqual(len(teams.find_by_template({'lgID': 'YL'})), 1)
+
+    def test_edge_cases(self):
+        columns = [('id', 'text'), ('x', 'number'), ('note', 'text')]
+        text = ('note,unused,x,id\n'  # columns in another order, and one not defined
+                '"a, quoted ""note""",u,1,r1\n'
+                '"two\nlines",u,2.5,r2\n'
+                '\n'  # blank line
+                ',u,,r3\n'  # NULLs
+                'last,u,-3,r4\n'
+                ',,,r5\n')
+        file_name = self.define(text, columns)
+        table = CSVTable.CSVTable("edge")
+        self.assertEqual(table.__rows__, self.read(file_name, columns))
+        self.assertEqual([r['x'] for r in table.__rows__], [1, 2.5, None, -3, None])
+
+    def test_missing_trailing_fields(self):
+        columns = [('id', 'text'), ('a', 'text'), ('b', 'number')]
+        file_name = self.define('id,a,b\nr1,x,1\nr2,y\nr3\n', columns)
+        self.assertEqual(CSVTable.CSVTable("edge").__rows__, self.read(file_name, columns))
+
+    def test_errors(self):
+        self.define('id,x\nr1,1\nr2,\n', [('id', 'text'), ('x', 'number')], not_null=['x'])
+        with self.assertRaises(DataTableExceptions.DataTableException) as e:
+            CSVTable.CSVTable("edge")
+        self.assertEqual(e.exception.code, DataTableExceptions.DataTableException.cannot_be_null)
+
+        file_name = self.define('id,x\nr1,1\n', [('id', 'text'), ('x', 'number')])
+        with open(file_name, "w") as f:  # the file lost a defined column after it was defined
+            f.write('id,y\nr1,1\n')
+        with self.assertRaises(DataTableExceptions.DataTableException):
+            CSVTable.CSVTable("edge")
+
+    def test_empty_file(self):
+        file_name = self.define('id,x\n', [('id', 'text'), ('x', 'number')])
+        self.assertEqual(len(CSVTable.CSVTable("edge")), 0)
+        open(file_name, "w").close()  # not even a header
+        self.assertEqual(len(CSVTable.CSVTable("edge")), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+"""
+Per-call metrics and the slow query log (see CSVMetrics).
+"""
+import json
+import os
+import unittest
+
+import support
+import CSVMetrics
+import CSVTable
+
+
+class MetricsTest(support.TableTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.metrics = CSVMetrics.MetricsRegistry()
+        self.teams = CSVTable.CSVTable("teams")
+        self.teams.__metrics__ = self.metrics
+
+    def test_records_calls(self):
+        records = []
+        self.metrics.add_listener(records.append)
+        self.teams.find_by_template({'teamID': 'BOS', 'yearID': 2004})
+        self.assertEqual([(r['table'], r['operation'], r['rows_returned']) for r in records],
+                         [('teams', 'find_by_template', 1)])
+        self.assertEqual(self.metrics.summary()[('teams', 'find_by_template')]['calls'], 1)
+
+    def test_slow_query_log(self):
+        log = os.path.join(self.work_dir, "slow.log")
+        self.metrics.set_slow_query_log(log, threshold=0)
+        self.teams.find_by_template({'lgID': 'AL'})
+        with open(log) as f:
+            self.assertEqual(json.loads(f.readline())['operation'], 'find_by_template')
+
+    def test_failing_listener_does_not_fail_the_call(self):
+        def fail(metrics):
+            raise ValueError("listener failed")
+
+        records = []
+        self.metrics.add_listener(fail)
+        self.metrics.add_listener(records.append)
+        self.assertEqual(len(self.teams.find_by_template({'teamID': 'BOS', 'yearID': 2004})), 1)
+        self.assertEqual(len(records), 1)  # later listeners still run
+        self.assertEqual(self.metrics.listener_errors, 1)
+        self.assertIsInstance(self.metrics.last_error, ValueError)
+
+    def test_unwritable_log_does_not_fail_the_call(self):
+        self.metrics.set_slow_query_log(os.path.join(self.work_dir, "missing", "slow.log"), threshold=0)
+        self.assertEqual(len(self.teams.find_by_template({'teamID': 'BOS', 'yearID': 2004})), 1)
+        self.assertEqual(self.metrics.slow_query_log_errors, 1)
+        self.assertEqual(self.metrics.summary()[('teams', 'find_by_template')]['calls'], 1)
+
+        self.metrics.reset()
+        self.assertEqual((self.metrics.slow_query_log_errors, self.metrics.last_error), (0, None))
+
+
+if __name__ == "__main__":
+    unittest.main()
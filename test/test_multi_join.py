@@ -0,0 +1,114 @@
+"""
+Joins of several tables in a cost-based order (see multi_join), checked against nested loops over the rows.
+"""
+import os
+import shutil
+import unittest
+
+import support
+import CSVTable
+import DataTableExceptions
+from CSVCatalog import ColumnDefinition, IndexDefinition
+
+
+class MultiJoinTest(support.TableTestCase):
+
+    def setUp(self):
+        super().setUp()
+        leagues_file = os.path.join(self.work_dir, "Leagues.csv")
+        with open(leagues_file, "w") as f:
+            f.write("lgID,lgName\nAL,American League\nNL,National League\nAA,American Association\n")
+        self.catalog.create_table("leagues", leagues_file, [ColumnDefinition('lgID'), ColumnDefinition('lgName')],
+                                  [IndexDefinition('PRIMARY', 'PRIMARY', ['lgID'])])
+        franchises_file = os.path.join(self.work_dir, "Franchises.csv")
+        shutil.copy(os.path.join(self.work_dir, "Teams.csv"), franchises_file)
+        self.catalog.create_table("franchises", franchises_file,
+                                  [ColumnDefinition('teamID'), ColumnDefinition('yearID', 'number'),
+                                   ColumnDefinition('franchID'), ColumnDefinition('Rank', 'number')],
+                                  [IndexDefinition('PRIMARY', 'PRIMARY', ['teamID', 'yearID'])])
+        self.teams = CSVTable.CSVTable("teams")
+        self.leagues = CSVTable.CSVTable("leagues")
+        self.franchises = CSVTable.CSVTable("franchises")
+
+    def chain(self, n):
+        """
+        Tables c0 ... c<n-1>, where c<i> has columns k<i> and k<i+1>, so each joins the next on one column.
+        """
+        tables = []
+        for i in range(n):
+            file_name = os.path.join(self.work_dir, "c{}.csv".format(i))
+            with open(file_name, "w") as f:
+                f.write("k{},k{}\n".format(i, i + 1))
+                for j in range(5 + i % 3):
+                    f.write("{},{}\n".format(j, (j * 3 + i) % 5))
+            self.catalog.create_table("c{}".format(i), file_name,
+                                      [ColumnDefinition("k{}".format(i)), ColumnDefinition("k{}".format(i + 1))],
+                                      [IndexDefinition('k_idx', 'INDEX', ["k{}".format(i + 1)])])
+            tables.append(CSVTable.CSVTable("c{}".format(i)))
+        return tables
+
+    @staticmethod
+    def rows(table, fields):
+        return sorted(tuple(r[f] for f in fields) for r in table.__rows__ if r is not None)
+
+    def check_chain(self, n):
+        tables = self.chain(n)
+        conditions = [("c{}".format(i), "c{}".format(i + 1), ["k{}".format(i + 1)]) for i in range(n - 1)]
+        result = tables[0].multi_join(tables[1:], conditions)
+
+        partials = [dict(r) for r in tables[0].__rows__]
+        for table in tables[1:]:
+            partials = [dict(p, **r) for p in partials for r in table.__rows__
+                        if all(p[k] == r[k] for k in r if k in p and k != 'rownum')]
+        fields = ["k{}".format(i) for i in range(n + 1)]
+        self.assertEqual(self.rows(result, fields), sorted(tuple(p[f] for f in fields) for p in partials))
+        self.assertEqual(sorted(result.__plan__['order']), sorted(t.__table_name__ for t in tables))
+        self.assertEqual(result.__plan__['actual_rows'], len(partials))
+
+    def test_three_tables(self):
+        fields = ['teamID', 'yearID', 'lgName', 'franchID', 'W']
+        for where in (None, {'lgID': 'AL'}, {'teamID': 'BOS', 'yearID': 2004}, {'lgName': 'National League'}):
+            result = self.teams.multi_join([self.leagues, self.franchises],
+                                           [(self.teams, self.leagues, ['lgID']),
+                                            ('teams', 'franchises', ['teamID', 'yearID'])],
+                                           where_template=where, project_fields=fields)
+            where = where or {}
+            franchises = {(f['teamID'], f['yearID']): f for f in self.franchises.__rows__}
+            expected = [tuple({**t, **l, **franchises[(t['teamID'], t['yearID'])]}[c] for c in fields)
+                        for t in self.teams.__rows__ for l in self.leagues.__rows__
+                        if t['lgID'] == l['lgID'] and (t['teamID'], t['yearID']) in franchises
+                        and all({**t, **l}[k] == v for k, v in where.items())]
+            self.assertEqual(self.rows(result, fields), sorted(expected))
+
+            plan = result.__plan__
+            self.assertEqual(plan['op'], 'MultiJoin')
+            self.assertEqual(sorted(plan['order']), ['franchises', 'leagues', 'teams'])
+            self.assertEqual(plan['actual_rows'], len(expected))
+
+    def test_most_selective_table_first(self):
+        result = self.teams.multi_join([self.leagues, self.franchises],
+                                       [(self.teams, self.leagues, ['lgID']),
+                                        (self.teams, self.franchises, ['teamID', 'yearID'])],
+                                       where_template={'teamID': 'BOS', 'yearID': 2004})
+        self.assertIn(result.__plan__['order'][0], ('teams', 'franchises'))
+        self.assertEqual(result.__plan__['children'][0]['op'], 'IndexLookup')
+
+    def test_dynamic_programming(self):
+        self.check_chain(6)
+
+    def test_greedy_beyond_ten_tables(self):
+        self.check_chain(12)
+
+    def test_invalid_joins(self):
+        with self.assertRaises(DataTableExceptions.DataTableException):  # franchises is not connected
+            self.teams.multi_join([self.leagues, self.franchises], [(self.teams, self.leagues, ['lgID'])])
+        with self.assertRaises(DataTableExceptions.DataTableException):
+            self.teams.multi_join([self.leagues], [(self.teams, self.leagues, ['lgName'])])
+        with self.assertRaises(DataTableExceptions.DataTableException):
+            self.teams.multi_join([self.leagues], [(self.teams, 'nope', ['lgID'])])
+        with self.assertRaises(DataTableExceptions.DataTableException):
+            self.teams.multi_join(self.leagues, [(self.teams, self.leagues, ['lgID'])])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,95 @@
+"""
+Keyset pagination with find_page, checked against a scan of the rows.
+"""
+import base64
+import json
+import unittest
+
+import support
+import CSVTable
+import DataTableExceptions
+
+
+class PagingTest(support.TableTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.teams = CSVTable.CSVTable("teams")
+
+    def scan(self, t, after=-1):
+        return [r for r in self.teams.__rows__ if r is not None and r['rownum'] > after
+                and all(r[k] == v for k, v in t.items())]
+
+    def pages(self, t, page_size, cursor=None, fields=None):
+        result = []
+        while True:
+            page, cursor = self.teams.find_page(t, fields=fields, page_size=page_size, cursor=cursor)
+            self.assertLessEqual(len(page), page_size)
+            result += page
+            if cursor is None:
+                return result
+
+    def test_pages_match_scan(self):
+        for t in ({'lgID': 'NL'}, {'teamID': 'BOS'}, {'W': 90}, {}, {'lgID': 'NOPE'}):  # index and scan paths
+            for page_size in (1, 7, 100, 10000):
+                self.assertEqual(self.pages(t, page_size), self.scan(t))
+
+    def test_fields(self):
+        expected = [{'teamID': r['teamID'], 'W': r['W']} for r in self.scan({'lgID': 'AL'})]
+        self.assertEqual(self.pages({'lgID': 'AL'}, 50, fields=['teamID', 'W']), expected)
+
+    def check_pages_across_writes(self, t):
+        matching = self.scan(t)
+        first, cursor = self.teams.find_page(t, page_size=len(matching) // 2)
+        last = first[-1]['rownum']
+        behind, ahead = matching[0], matching[-1]
+
+        # rows leave and join the matches on both sides of the cursor, and rows are added and deleted
+        self.teams.update({'teamID': ahead['teamID'], 'yearID': ahead['yearID']}, {'lgID': 'XX', 'W': -1})
+        moved = next(r for r in self.teams.__rows__ if r is not None and r['rownum'] > last and not all(
+            r[k] == v for k, v in t.items()))
+        self.teams.update({'teamID': moved['teamID'], 'yearID': moved['yearID']}, t)
+        self.teams.update({'teamID': behind['teamID'], 'yearID': behind['yearID']}, {'name': 'Renamed'})
+        self.teams.insert({'teamID': 'ZZZ', 'yearID': 3000, 'lgID': 'NL', 'W': 90, 'name': 'Zed'})
+        self.teams.delete({'teamID': 'BOS'})
+
+        rest = self.pages(t, 37, cursor=cursor)
+        self.assertEqual(rest, self.scan(t, after=last))
+        self.assertIn(moved['teamID'], [r['teamID'] for r in rest])
+        keys = [(r['teamID'], r['yearID']) for r in first + rest]
+        self.assertEqual(len(keys), len(set(keys)))
+
+    def test_index_pages_across_writes(self):
+        self.check_pages_across_writes({'lgID': 'NL'})
+
+    def test_scan_pages_across_writes(self):
+        self.check_pages_across_writes({'W': 90})
+
+    def test_buckets_stay_sorted(self):
+        self.teams.update({'lgID': 'AL'}, {'lgID': 'NL'})
+        self.teams.update({'teamID': 'BOS'}, {'lgID': 'AL'})
+        self.teams.insert({'teamID': 'ZZZ', 'yearID': 3000, 'lgID': 'NL', 'W': 1, 'name': 'Zed'})
+        self.teams.delete({'teamID': 'NYA'})
+        for idx in self.teams.indexes.values():
+            for bucket in idx['index'].values():
+                self.assertEqual(bucket, sorted(bucket))
+        self.assertEqual(self.pages({'lgID': 'NL'}, 100), self.scan({'lgID': 'NL'}))
+
+    def test_invalid_cursors(self):
+        _, cursor = self.teams.find_page({'lgID': 'NL'}, page_size=10)
+        forged = base64.urlsafe_b64encode(json.dumps({'q': 'x', 'p': 3}).encode()).decode()
+        for t, fields, bad in (({'lgID': 'AL'}, None, cursor), ({'lgID': 'NL'}, ['teamID'], cursor),
+                               ({'lgID': 'NL'}, None, forged), ({'lgID': 'NL'}, None, "not a cursor")):
+            with self.assertRaises(DataTableExceptions.DataTableException):
+                self.teams.find_page(t, fields=fields, page_size=10, cursor=bad)
+
+    def test_vacuum_expires_cursors(self):
+        _, cursor = self.teams.find_page({'lgID': 'NL'}, page_size=10)
+        self.teams.delete({'teamID': 'BOS'})
+        self.teams.vacuum()
+        with self.assertRaises(DataTableExceptions.DataTableException):
+            self.teams.find_page({'lgID': 'NL'}, page_size=10, cursor=cursor)
+
+
+if __name__ == "__main__":
+    unittest.main()
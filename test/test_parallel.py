@@ -0,0 +1,123 @@
+"""
+Parallel scans, having and aggregate (see CSVParallel), checked against serial execution.
+"""
+import gc
+import threading
+import unittest
+import weakref
+
+import support
+import CSVParallel
+import CSVTable
+
+
+class ParallelTest(support.TableTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.serial = CSVTable.CSVTable("teams")
+        self.teams = CSVTable.CSVTable("teams")
+        self.teams.parallel_degree = 2
+        self.teams.parallel_min_rows = 1
+        self.teams.morsel_size = 500
+
+    def tearDown(self):
+        CSVParallel.shutdown()
+        super().tearDown()
+
+    def rows(self, table):
+        return [{k: v for k, v in r.items() if k != 'rownum'} for r in table.find_by_template({}) or []]
+
+    def check(self, query):
+        self.assertEqual(query(self.teams), query(self.serial))
+
+    def test_find_by_template(self):
+        for t in ({'lgID': 'AL'}, {'W': 100}, {'teamID': 'NOPE'}, {}):
+            self.check(lambda table: table.find_by_template(t))
+        self.check(lambda table: list(table.iter_by_template({'lgID': 'NL'}, fields=['teamID', 'yearID'])))
+        self.assertIsNotNone(CSVParallel.__pool__)
+
+    def test_having(self):
+        for conds in (['W >= 100'], ['yearID >= 2000', 'lgID = NL'], ['name LIKE Boston%'], ['W > 1000']):
+            self.check(lambda table: self.rows(table.having(*conds)))
+        self.check(lambda table: list(table.iter_having('W < 50', fields=['teamID', 'W'])))
+        self.assertIsNotNone(CSVParallel.__pool__)
+
+    def test_aggregate(self):
+        aggregates = ('count(*)', 'count(W)', 'sum(W)', 'avg(W)', 'min(yearID)', 'max(W)')
+        self.check(lambda table: self.rows(table.aggregate(*aggregates)))
+        self.check(lambda table: self.rows(table.aggregate(*aggregates, group_by=['lgID'])))
+        self.check(lambda table: self.rows(table.aggregate(*aggregates, group_by=['teamID', 'lgID'],
+                                                           where=['yearID >= 1990'])))
+        self.check(lambda table: self.rows(table.aggregate('count(*)', 'max(W)', where=['W > 1000'])))
+        self.assertIsNotNone(CSVParallel.__pool__)
+
+    def test_pool_is_kept_until_the_table_changes(self):
+        self.teams.find_by_template({'W': 100})
+        pool = CSVParallel.__pool__
+        self.assertIsNotNone(pool)
+        self.teams.having('W >= 100')
+        self.teams.aggregate('count(*)', group_by=['lgID'])
+        self.assertIs(CSVParallel.__pool__, pool)
+
+        for table in (self.teams, self.serial):
+            table.update({'teamID': 'BOS', 'yearID': 2004}, {'W': 1000})
+        self.check(lambda table: table.find_by_template({'W': 1000}))
+        self.assertIsNot(CSVParallel.__pool__, pool)
+
+    def test_pool_does_not_keep_the_table(self):
+        self.teams.find_by_template({'W': 100})
+        pool = CSVParallel.__pool__
+        self.assertIsNotNone(pool)
+        teams = weakref.ref(self.teams)
+        del self.teams
+        gc.collect()
+        self.assertIsNone(teams())
+
+        other = CSVTable.CSVTable("teams")
+        other.parallel_degree, other.parallel_min_rows = 2, 1
+        self.assertEqual(other.find_by_template({'W': 100}), self.serial.find_by_template({'W': 100}))
+        self.assertIsNot(CSVParallel.__pool__, pool)  # retired, as its table is gone
+
+    def test_snapshot_reads_rows_from_before_write(self):
+        with self.teams.snapshot() as snap:
+            before = snap.find_by_template({'lgID': 'AL'})
+            self.teams.update({'lgID': 'AL'}, {'W': 0})
+            self.assertEqual(snap.find_by_template({'lgID': 'AL'}), before)
+            self.assertEqual(self.rows(snap.aggregate('max(W)', where=['lgID = AL'])), [{'max(W)': 116}])
+        self.assertEqual(self.rows(self.teams.aggregate('max(W)', where=['lgID = AL'])), [{'max(W)': 0}])
+
+    def test_no_fork_while_other_threads_run(self):
+        done = threading.Event()
+        thread = threading.Thread(target=done.wait)
+        thread.start()
+        try:
+            self.check(lambda table: table.find_by_template({'lgID': 'AL'}))
+            self.check(lambda table: self.rows(table.aggregate('sum(W)', group_by=['lgID'])))
+            self.assertIsNone(CSVParallel.__pool__)
+        finally:
+            done.set()
+            thread.join()
+
+    def test_pool_is_used_while_other_threads_run(self):
+        self.teams.find_by_template({'W': 100})
+        pool = CSVParallel.__pool__
+        self.assertIsNotNone(pool)
+        done = threading.Event()
+        thread = threading.Thread(target=done.wait)
+        thread.start()
+        try:
+            self.check(lambda table: self.rows(table.having('W >= 100')))
+            self.assertIs(CSVParallel.__pool__, pool)
+
+            for table in (self.teams, self.serial):  # the pool is out of date, and cannot be forked again
+                table.delete({'teamID': 'BOS'})
+            self.check(lambda table: self.rows(table.having('W >= 100')))
+            self.assertIs(CSVParallel.__pool__, pool)
+        finally:
+            done.set()
+            thread.join()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,117 @@
+"""
+ANALYZE statistics and the cost-based choice of join strategy, checked against values computed from the rows.
+"""
+import os
+import shutil
+import threading
+import unittest
+
+import support
+import CSVTable
+from CSVCatalog import ColumnDefinition, IndexDefinition
+
+
+class PlannerTest(support.TableTestCase):
+
+    def setUp(self):
+        super().setUp()
+        # copies of Teams.csv sharing only the join columns; seasons and names have no indexes
+        for table_name, column, indexes in (("seasons", 'W', []), ("names", 'name', []),
+                                            ("leagues", 'lgID', [IndexDefinition('PRIMARY', 'PRIMARY',
+                                                                                 ['teamID', 'yearID'])])):
+            file_name = os.path.join(self.work_dir, table_name + ".csv")
+            shutil.copy(os.path.join(self.work_dir, "Teams.csv"), file_name)
+            self.catalog.create_table(table_name, file_name,
+                                      [ColumnDefinition('teamID'), ColumnDefinition('yearID', 'number'),
+                                       ColumnDefinition(column, 'number' if column == 'W' else 'text')], indexes)
+        self.teams = CSVTable.CSVTable("teams")
+        self.seasons = CSVTable.CSVTable("seasons")
+        self.names = CSVTable.CSVTable("names")
+        self.leagues = CSVTable.CSVTable("leagues")
+
+    @staticmethod
+    def live(table):
+        return [r for r in table.__rows__ if r is not None]
+
+    def brute_force_join(self, left, right, on_fields, where_template=None):
+        def matching(table):
+            return [r for r in self.live(table) if all(r[k] == v for k, v in (where_template or {}).items() if k in r)]
+
+        left_rows, right_rows = matching(left), matching(right)
+        return sorted(tuple(sorted((k, v) for k, v in {**l, **r}.items() if k != 'rownum'))
+                      for l in left_rows for r in right_rows
+                      if all(l[f] is not None and l[f] == r[f] for f in on_fields))
+
+    def check_join(self, left, right, on_fields, op, where_template=None):
+        joined = left.join(right, on_fields, where_template=where_template)
+        self.assertEqual(joined.__plan__['op'], op)
+        self.assertEqual(sorted(tuple(sorted((k, v) for k, v in r.items() if k != 'rownum'))
+                                for r in self.live(joined)),
+                         self.brute_force_join(left, right, on_fields, where_template))
+        self.assertEqual(joined.__plan__['actual_rows'], len(self.live(joined)))
+
+    def test_analyze(self):
+        statistics = self.teams.analyze()
+        rows = self.live(self.teams)
+        for col in ('teamID', 'yearID', 'W'):
+            values = [r[col] for r in rows if r[col] is not None]
+            self.assertEqual(statistics[col]['row_count'], len(rows))
+            self.assertEqual(statistics[col]['distinct'], len(set(values)))
+            self.assertEqual((statistics[col]['min'], statistics[col]['max']), (min(values), max(values)))
+            self.assertEqual(statistics[col]['histogram'][-1], max(values))
+        self.assertTrue(statistics['teamID']['sorted'])
+        self.assertFalse(statistics['W']['sorted'])
+
+        self.assertEqual(self.catalog.get_table("teams").statistics, statistics)
+        self.assertEqual(CSVTable.CSVTable("teams").__statistics__, statistics)
+        self.assertEqual(self.seasons.analyze(persist=False)['W']['distinct'], statistics['W']['distinct'])
+        self.assertEqual(self.catalog.get_table("seasons").statistics, {})
+
+    def test_analyze_through_snapshot(self):
+        with self.teams.snapshot() as snap:
+            self.teams.delete({'lgID': 'NA'})
+            statistics = snap.analyze(persist=False)
+            self.assertEqual(statistics['lgID']['distinct'], len({r['lgID'] for r in self.live(snap)}))
+            self.assertIn('NA', [r['lgID'] for r in self.live(snap)])
+        self.assertIs(self.teams.__statistics__, statistics)
+
+    def test_analyze_beside_writers(self):
+        done = threading.Event()
+
+        def write():
+            year = 3000
+            while not done.is_set():
+                self.teams.insert({'teamID': 'ZZZ', 'yearID': year, 'lgID': 'AL', 'W': 1, 'name': 'Zed'})
+                year += 1
+
+        writer = threading.Thread(target=write)
+        writer.start()
+        try:
+            for _ in range(5):
+                statistics = self.teams.analyze(persist=False)
+                self.assertEqual(statistics['teamID']['row_count'], statistics['W']['row_count'])
+        finally:
+            done.set()
+            writer.join()
+        statistics = self.teams.analyze()
+        self.assertEqual(statistics['yearID']['row_count'], len(self.teams))
+        self.assertEqual(self.catalog.get_table("teams").statistics, statistics)
+
+    def test_index_nested_loop_join(self):
+        self.check_join(self.seasons, self.leagues, ['teamID', 'yearID'], 'IndexNestedLoopJoin',
+                        where_template={'W': 100})
+        plan = self.seasons.explain_join(self.leagues, ['teamID', 'yearID'], where_template={'W': 100})
+        self.assertEqual(plan['index'], 'PRIMARY')
+
+    def test_hash_join(self):
+        self.check_join(self.seasons, self.names, ['teamID', 'yearID'], 'HashJoin', where_template={'W': 100})
+
+    def test_merge_join_once_analyzed(self):
+        self.seasons.analyze()
+        self.names.analyze()
+        self.check_join(self.seasons, self.names, ['teamID'], 'MergeJoin',
+                        where_template={'name': 'Seattle Pilots'})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+"""
+The lazy query builder (see CSVQuery), checked against a scan of the rows.
+"""
+import unittest
+
+import support
+import CSVTable
+import DataTableExceptions
+
+
+class QueryTest(support.TableTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.teams = CSVTable.CSVTable("teams")
+
+    def scan(self, keep, fields=None, sort=None, reverse=False):
+        rows = [r for r in self.teams.__rows__ if r is not None and keep(r)]
+        if sort:
+            rows.sort(key=sort, reverse=reverse)
+        return [{f: r[f] for f in fields} if fields else r for r in rows]
+
+    def test_clauses(self):
+        query = self.teams.query().where({'lgID': 'NL'}).having('yearID >= 1990', 'W < 80') \
+            .select('teamID', 'yearID', 'W').order_by('W DESC').limit(10, offset=5)
+        expected = self.scan(lambda r: r['lgID'] == 'NL' and r['yearID'] >= 1990 and r['W'] < 80,
+                             ['teamID', 'yearID', 'W'], sort=lambda r: r['W'], reverse=True)
+        self.assertEqual(query.collect(), expected[5:15])
+        self.assertEqual(list(query), expected[5:15])
+
+    def test_each_clause_alone(self):
+        self.assertEqual(self.teams.query().collect(), self.scan(lambda r: True))
+        self.assertEqual(self.teams.query().where({'teamID': 'BOS', 'yearID': 2004}).collect(),
+                         self.scan(lambda r: (r['teamID'], r['yearID']) == ('BOS', 2004)))
+        self.assertEqual(self.teams.query().having('W > 110').collect(), self.scan(lambda r: r['W'] > 110))
+        self.assertEqual(self.teams.query().having('name LIKE New York%').collect(),
+                         self.scan(lambda r: r['name'].startswith('New York')))
+        self.assertEqual(self.teams.query().select(['teamID']).limit(3).collect(),
+                         self.scan(lambda r: True, ['teamID'])[:3])
+        self.assertEqual(self.teams.query().order_by('yearID', 'teamID DESC').collect(),
+                         self.scan(lambda r: True, sort=lambda r: (r['yearID'], [-ord(c) for c in r['teamID']])))
+
+    def test_plan(self):
+        ops = lambda query: [node['op'] for node in query.__plan__()]
+        self.assertEqual(ops(self.teams.query().where({'lgID': 'AL'})), ['IndexLookup'])
+        self.assertEqual(ops(self.teams.query().having('lgID = AL', 'W > 100').select('teamID')),
+                         ['IndexLookup', 'Filter', 'Project'])  # text equality is pushed into the template
+        self.assertEqual(ops(self.teams.query().having('W > 100').order_by('W').limit(5)),
+                         ['Scan', 'Filter', 'Sort', 'Limit'])
+        contradiction = self.teams.query().where({'lgID': 'AL'}).where({'lgID': 'NL'})
+        self.assertEqual(ops(contradiction), ['Empty'])
+        self.assertEqual(contradiction.collect(), [])
+
+    def test_runs_when_collected(self):
+        query = self.teams.query().where({'teamID': 'ZZZ'})
+        self.teams.insert({'teamID': 'ZZZ', 'yearID': 3000, 'lgID': 'AL', 'W': 1, 'name': 'Zed'})
+        self.assertEqual([r['yearID'] for r in query.collect()], [3000])
+
+    def test_explain(self):
+        plan = self.teams.query().where({'lgID': 'AL'}).having('W > 100').explain()
+        self.assertEqual(plan['op'], 'Filter')
+        self.assertEqual(plan['actual_rows'], len(self.scan(lambda r: r['lgID'] == 'AL' and r['W'] > 100)))
+        self.assertEqual(plan['children'][0]['op'], 'IndexLookup')
+        self.assertEqual(plan['children'][0]['actual_rows'], len(self.scan(lambda r: r['lgID'] == 'AL')))
+
+    def test_invalid_clauses(self):
+        for build in (lambda: self.teams.query().where({'nope': 1}), lambda: self.teams.query().where([]),
+                      lambda: self.teams.query().having('W ~ 1'), lambda: self.teams.query().select('nope'),
+                      lambda: self.teams.query().limit('5')):
+            with self.assertRaises(DataTableExceptions.DataTableException):
+                build()
+
+
+if __name__ == "__main__":
+    unittest.main()
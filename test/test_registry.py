@@ -0,0 +1,48 @@
+"""
+The process-wide table registry and its memory budget (see CSVRegistry).
+"""
+import unittest
+
+import support
+import CSVRegistry
+
+
+class RegistryTest(support.TableTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.registry = CSVRegistry.TableRegistry()
+
+    def test_loads_each_table_once(self):
+        teams = self.registry.get_table("teams")
+        self.assertIs(self.registry.get_table("Teams"), teams)
+        self.assertEqual(self.registry.loaded_tables(), ["teams"])
+
+    def test_footprint_follows_unpinned_writes(self):
+        teams = self.registry.get_table("teams")
+        footprint = self.registry.__footprint__("teams")
+        length, version = len(teams), teams.__version__
+
+        teams.update({'lgID': 'AL'}, {'W': 10 ** 1000})  # same rows, larger values
+        self.assertEqual((len(teams), teams.__version__), (length, version))
+        self.assertGreater(self.registry.__footprint__("teams"), footprint + 1000 * 400)
+
+    def test_budget_evicts_least_recently_used(self):
+        self.registry.get_table("teams")
+        self.registry.get_table("people")
+        self.registry.get_table("teams")
+        self.registry.set_memory_budget(self.registry.__footprint__("teams") + 1)
+        self.assertEqual(self.registry.loaded_tables(), ["teams"])
+        self.assertEqual(self.registry.evictions, 1)
+
+    def test_budget_counts_writes(self):
+        teams = self.registry.get_table("teams")
+        people = CSVRegistry.TableRegistry().get_table("people").memory_usage()['total']
+        self.registry.set_memory_budget(self.registry.__footprint__("teams") + people + 1000 * 400)
+        teams.update({'lgID': 'AL'}, {'W': 10 ** 1000})
+        self.registry.get_table("people")  # over budget now that teams has grown
+        self.assertEqual(self.registry.loaded_tables(), ["people"])
+
+
+if __name__ == "__main__":
+    unittest.main()
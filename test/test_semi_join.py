@@ -0,0 +1,70 @@
+"""
+Semi joins and anti joins (EXISTS / NOT EXISTS), by index probe and by hash set.
+"""
+import unittest
+
+import support
+import CSVTable
+
+
+class SemiJoinTest(support.TableTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.teams = CSVTable.CSVTable("teams")
+        self.rows = self.teams.find_by_template({})
+
+    def keys(self, table):
+        return [(r['teamID'], r['yearID']) for r in table.find_by_template({}) or []]
+
+    def test_semantics(self):
+        right = self.teams.having('yearID >= 2010')  # derived, so without indexes: probed by hash set
+        recent = {r['teamID'] for r in self.rows if r['yearID'] >= 2010}
+        semi = self.teams.semi_join(right, ['teamID'])
+        anti = self.teams.anti_join(right, ['teamID'])
+        self.assertEqual(self.keys(semi), [(r['teamID'], r['yearID']) for r in self.rows if r['teamID'] in recent])
+        self.assertEqual(self.keys(anti), [(r['teamID'], r['yearID']) for r in self.rows if r['teamID'] not in recent])
+
+    def test_each_row_once(self):
+        semi = self.teams.semi_join(self.teams, ['lgID'])  # every row matches many rows, by index probe
+        self.assertEqual(self.keys(semi), [(r['teamID'], r['yearID']) for r in self.rows])
+        self.assertEqual(len(self.teams.anti_join(self.teams, ['lgID'])), 0)
+
+    def test_where_template(self):
+        semi = self.teams.semi_join(self.teams, ['lgID'], where_template={'teamID': 'BOS'})
+        self.assertEqual(self.keys(semi), [(r['teamID'], r['yearID']) for r in self.rows if r['teamID'] == 'BOS'])
+        semi = self.teams.semi_join(self.teams, ['lgID'], where_template={'teamID': 'NOPE'})
+        self.assertEqual(len(semi), 0)
+
+    def test_null_keys(self):
+        self.teams.insert({'teamID': 'ZZZ', 'yearID': 3000, 'W': 1, 'name': 'Zed'})  # lgID is NULL
+        self.teams.insert({'teamID': 'ZZZ', 'yearID': 3001, 'W': 2, 'name': 'Zed'})
+        hashed = self.teams.having('yearID >= 1800')  # without indexes
+        for right in (self.teams, hashed):
+            # NULL matches nothing, not even NULL: a semi join drops the rows, an anti join returns them
+            self.assertEqual(len(self.teams.semi_join(right, ['lgID'])), len(self.rows))
+            self.assertEqual(self.keys(self.teams.anti_join(right, ['lgID'])), [('ZZZ', 3000), ('ZZZ', 3001)])
+
+    def test_rows_are_copied_and_renumbered(self):
+        anti = self.teams.anti_join(self.teams.having('yearID >= 1900'), ['teamID'])
+        rows = anti.find_by_template({})
+        self.assertEqual([r['rownum'] for r in rows], list(range(len(rows))))
+        self.assertEqual([anti.__rows__[r['rownum']] for r in rows], rows)
+        self.assertNotEqual([r['rownum'] for r in rows],
+                            [r['rownum'] for r in self.rows if (r['teamID'], r['yearID']) in set(self.keys(anti))])
+
+        anti.__rows__[0]['W'] = -1
+        original = self.teams.find_by_template({'teamID': rows[0]['teamID'], 'yearID': rows[0]['yearID']})
+        self.assertNotEqual(original[0]['W'], -1)
+
+    def test_find_page(self):
+        semi = self.teams.semi_join(self.teams.having('yearID >= 2010'), ['teamID'])
+        result, cursor = semi.find_page({}, page_size=100)
+        while cursor is not None:
+            page, cursor = semi.find_page({}, page_size=100, cursor=cursor)
+            result += page
+        self.assertEqual(result, semi.find_by_template({}))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,113 @@
+"""
+The query server and client (see CSVServer and CSVClient), checked against the same calls on a local CSVTable.
+"""
+import asyncio
+import os
+import threading
+import unittest
+from itertools import islice
+
+import support
+import CSVAsync
+import CSVClient
+import CSVServer
+import CSVTable
+import DataTableExceptions
+
+
+class ServerTest(support.TableTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.local = CSVTable.CSVTable("teams")
+        self.path = os.path.join(self.work_dir, "csvdb.sock")
+        self.server = CSVServer.CSVServer(path=self.path, batch_size=7)
+        self.loop = asyncio.new_event_loop()
+        self.loop.run_until_complete(self.server.start())
+        self.thread = threading.Thread(target=self.loop.run_forever)
+        self.thread.start()
+        self.client = CSVClient.CSVClient(path=self.path, timeout=60)
+        self.teams = self.client.table("teams")
+
+    def tearDown(self):
+        self.client.close()
+
+        async def stop():
+            self.server.close()
+            others = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+            await asyncio.gather(*others)  # connections end once they read the client's EOF
+
+        asyncio.run_coroutine_threadsafe(stop(), self.loop).result(timeout=60)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+        for executor in (CSVAsync.query_executor, CSVAsync.io_executor):  # the server used the shared pools
+            if executor is not None:
+                executor.shutdown()
+        CSVAsync.query_executor = CSVAsync.io_executor = None
+        super().tearDown()
+
+    @staticmethod
+    def rows(rows):
+        return [{k: v for k, v in r.items() if k != 'rownum'} for r in rows or []]
+
+    def test_queries(self):
+        local = self.local
+        self.assertEqual(self.teams.find_by_template({'lgID': 'AL'}, fields=['teamID', 'W'], limit=20, offset=3),
+                         local.find_by_template({'lgID': 'AL'}, fields=['teamID', 'W'], limit=20, offset=3))
+        self.assertIsNone(self.teams.find_by_template({'teamID': 'NOPE'}))
+        self.assertEqual(list(self.teams.iter_by_template({'teamID': 'BOS'})),
+                         local.find_by_template({'teamID': 'BOS'}))
+        self.assertEqual(list(self.teams.iter_having('W > 100', fields=['teamID', 'yearID'])),
+                         list(local.iter_having('W > 100', fields=['teamID', 'yearID'])))
+        self.assertEqual(self.teams.find_page({'lgID': 'NL'}, page_size=10),
+                         local.find_page({'lgID': 'NL'}, page_size=10))
+        self.assertEqual(self.teams.explain({'lgID': 'AL'})['op'], local.explain({'lgID': 'AL'})['op'])
+        self.assertEqual(len(self.teams), len(local))
+
+    def test_derived_tables(self):
+        local = self.local
+        remote = self.teams.having('yearID >= 2000').order_by('W DESC')
+        self.assertEqual(self.rows(remote.find_by_template({'lgID': 'AL'})),
+                         self.rows(local.having('yearID >= 2000').order_by('W DESC').find_by_template({'lgID': 'AL'})))
+        self.assertEqual(len(self.teams.join('teams', ['teamID', 'yearID'], where_template={'teamID': 'BOS'})),
+                         len(local.join(local, ['teamID', 'yearID'], where_template={'teamID': 'BOS'})))
+        people = self.client.table("people")
+        self.assertEqual(self.rows(people.semi_join(people, ['playerID'], where_template={'nameLast': 'Aaron'})),
+                         self.rows(CSVTable.CSVTable("people").find_by_template({'nameLast': 'Aaron'})))
+        self.assertEqual(len(self.teams.multi_join([self.teams.having('W > 100')],
+                                                   [('teams', self.teams.having('W > 100'), ['teamID', 'yearID'])])),
+                         len(local.having('W > 100')))
+
+    def test_writes(self):
+        self.teams.insert({'teamID': 'ZZZ', 'yearID': 3000, 'lgID': 'AL', 'W': 1, 'name': 'Zed'})
+        self.teams.update({'teamID': 'BOS'}, {'W': 0})
+        self.teams.delete({'lgID': 'NA'})
+        expected = [dict(r, W=0) if r['teamID'] == 'BOS' else r for r in self.rows(self.local.find_by_template({}))
+                    if r['lgID'] != 'NA']
+        expected.append({'teamID': 'ZZZ', 'yearID': 3000, 'lgID': 'AL', 'W': 1, 'name': 'Zed'})
+        self.assertEqual(self.rows(self.teams.iter_by_template({})), expected)
+        self.assertEqual(self.rows(CSVTable.CSVTable("teams").find_by_template({})), expected)
+
+    def test_nested_iterators(self):
+        outer = self.teams.iter_by_template({'lgID': 'AL'}, fields=['teamID'])
+        first = list(islice(outer, 3))
+        inner = list(self.teams.iter_by_template({'teamID': 'BOS'}))
+        self.assertEqual(first + list(outer), self.local.find_by_template({'lgID': 'AL'}, fields=['teamID']))
+        self.assertEqual(inner, self.local.find_by_template({'teamID': 'BOS'}))
+
+    def test_errors(self):
+        with self.assertRaises(DataTableExceptions.DataTableException) as e:
+            self.teams.find_by_template({'nope': 1})
+        self.assertEqual(e.exception.code, DataTableExceptions.DataTableException.invalid_column_definition)
+        with self.assertRaises(DataTableExceptions.DataTableException):
+            self.teams.having('W > 100').delete({'teamID': 'BOS'})
+        with self.assertRaises(DataTableExceptions.DataTableException):
+            self.client.call({'table': 'teams'}, "drop")
+        with self.assertRaises(DataTableExceptions.DataTableException):
+            self.client.table("nope").find_by_template({})
+        self.assertEqual(len(self.teams), len(self.local))  # the connection is still served
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+"""
+Publishing tables to shared memory and attaching to them (see CSVShared).
+"""
+import os
+import subprocess
+import sys
+import unittest
+
+import support
+import CSVShared
+import CSVTable
+import DataTableExceptions
+
+
+def strip(rows):
+    return [{k: v for k, v in r.items() if k != 'rownum'} for r in rows or []]
+
+
+class SharedTableTest(support.TableTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.teams = CSVTable.CSVTable("teams")
+        CSVShared.unpublish("teams")  # left over from an interrupted run
+        self.version = CSVShared.publish(self.teams)
+
+    def tearDown(self):
+        CSVShared.unpublish("teams")
+        super().tearDown()
+
+    def test_attached_table_answers_queries(self):
+        shared = CSVShared.attach("teams")
+        teams = self.teams
+        self.assertEqual(shared.version, self.version)
+        self.assertEqual(len(shared), len(teams))
+        for t in ({'teamID': 'BOS', 'yearID': 2004}, {'lgID': 'AL'}, {'W': 100}, {'teamID': 'NOPE'}):
+            self.assertEqual(strip(shared.find_by_template(t)), strip(teams.find_by_template(t)))
+        self.assertEqual(strip(shared.having('yearID >= 2010').find_by_template({})),
+                         strip(teams.having('yearID >= 2010').find_by_template({})))
+        self.assertEqual(strip(shared.iter_by_template({'lgID': 'NL'}, fields=['teamID'])),
+                         strip(teams.iter_by_template({'lgID': 'NL'}, fields=['teamID'])))
+
+    def test_attached_table_is_read_only(self):
+        shared = CSVShared.attach("teams")
+        for write in (lambda: shared.insert({'teamID': 'ZZZ', 'yearID': 3000}),
+                      lambda: shared.update({'teamID': 'BOS'}, {'W': 0}),
+                      lambda: shared.delete({'teamID': 'BOS'}),
+                      shared.vacuum):
+            with self.assertRaises(DataTableExceptions.DataTableException):
+                write()
+
+    def test_memory_usage(self):
+        shared = CSVShared.attach("teams")
+        usage = shared.memory_usage()
+        self.assertGreater(usage['total'], 0)
+        self.assertEqual(set(usage['indexes']), set(self.teams.indexes))
+        self.assertEqual(len(shared.__rows__[::100]), len(range(0, len(shared), 100)))
+        self.assertEqual(strip(shared.__rows__[2:4]), strip(self.teams.__rows__[2:4]))
+
+    def test_refresh(self):
+        shared = CSVShared.attach("teams")
+        auto = CSVShared.attach("teams", auto_refresh=True)
+        self.assertFalse(shared.refresh())
+
+        self.teams.insert({'teamID': 'ZZZ', 'yearID': 3000, 'lgID': 'AL', 'W': 1, 'name': 'Zed'})
+        self.teams.delete({'teamID': 'BOS'})
+        version = CSVShared.publish(self.teams)
+        self.assertGreater(version, self.version)
+
+        self.assertIsNone(shared.find_by_template({'teamID': 'ZZZ'}))  # until refreshed
+        with shared.snapshot() as snap:
+            self.assertTrue(shared.refresh())
+            self.assertIsNone(snap.find_by_template({'teamID': 'ZZZ'}))
+            self.assertIsNotNone(snap.find_by_template({'teamID': 'BOS'}))
+        self.assertEqual(shared.version, version)
+        self.assertEqual(len(shared.find_by_template({'teamID': 'ZZZ'})), 1)
+        self.assertIsNone(shared.find_by_template({'teamID': 'BOS'}))  # deleted rows are not published
+        self.assertEqual(len(shared), len(self.teams))
+
+        self.assertEqual(len(auto.find_by_template({'teamID': 'ZZZ'})), 1)
+        self.assertEqual(auto.version, version)
+
+    def test_unpublish(self):
+        shared = CSVShared.attach("teams")
+        CSVShared.unpublish("teams")
+        with self.assertRaises(DataTableExceptions.DataTableException):
+            CSVShared.attach("teams")
+        self.assertEqual(len(shared.find_by_template({'lgID': 'AL'})), len(self.teams.find_by_template({'lgID': 'AL'})))
+
+    def test_attach_from_another_process(self):
+        script = "import CSVShared; t = CSVShared.attach('teams'); print(len(t), t.find_by_template({'teamID': 'BOS', 'yearID': 2004})[0]['W'])"
+        env = dict(os.environ, PYTHONPATH=os.path.dirname(CSVShared.__file__))
+        output = subprocess.run([sys.executable, "-c", script], env=env, capture_output=True, text=True, timeout=60)
+        self.assertEqual(output.stdout.split(), [str(len(self.teams)), "98"], output.stderr)
+
+
+if __name__ == "__main__":
+    unittest.main()
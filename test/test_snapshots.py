@@ -0,0 +1,191 @@
+"""
+Snapshot isolation and locking of CSVTable (see CSVLock).
+"""
+import threading
+import unittest
+
+import support
+import CSVTable
+import DataTableExceptions
+
+
+class SnapshotTest(support.TableTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.teams = CSVTable.CSVTable("teams")
+
+    def rows(self, table, t=None):
+        return [{k: v for k, v in r.items() if k != 'rownum'} for r in table.find_by_template(t or {}) or []]
+
+    def test_snapshot_survives_writes(self):
+        teams = self.teams
+        before = self.rows(teams)
+        bos_2004 = self.rows(teams, {'teamID': 'BOS', 'yearID': 2004})
+        with teams.snapshot() as snap:
+            teams.insert({'teamID': 'ZZZ', 'yearID': 3000, 'lgID': 'AL', 'W': 1, 'name': 'Zed'})
+            teams.update({'teamID': 'BOS', 'yearID': 2004}, {'W': 0, 'lgID': 'XX'})
+            teams.delete({'lgID': 'NL'})
+            teams.vacuum()
+
+            self.assertEqual(self.rows(snap), before)
+            self.assertEqual(len(snap), len(before))
+            self.assertEqual(self.rows(snap, {'teamID': 'BOS', 'yearID': 2004}), bos_2004)
+            self.assertEqual(len(snap.find_by_template({'lgID': 'NL'})), len([r for r in before if r['lgID'] == 'NL']))
+            self.assertIsNone(snap.find_by_template({'teamID': 'ZZZ'}))
+            self.assertIsNone(snap.find_by_template({'lgID': 'XX'}))
+
+        self.assertEqual(self.rows(teams, {'teamID': 'BOS', 'yearID': 2004})[0]['W'], 0)
+        self.assertIsNone(teams.find_by_template({'lgID': 'NL'}))
+        self.assertEqual(len(teams.find_by_template({'teamID': 'ZZZ'})), 1)
+        self.assertEqual(teams.__pins__, {})
+
+    def test_writer_copies_only_what_it_changes(self):
+        teams = self.teams
+        with teams.snapshot() as snap:
+            teams.update({'teamID': 'BOS', 'yearID': 2004}, {'lgID': 'XX'})
+
+            # the primary key is not on lgID, so it is still shared with the snapshot
+            self.assertIs(teams.indexes['PRIMARY'], snap.indexes['PRIMARY'])
+            self.assertIsNot(teams.indexes['lg_idx'], snap.indexes['lg_idx'])
+            self.assertIsNot(teams.__rows__, snap.__rows__)
+
+            index, snap_index = teams.indexes['lg_idx']['index'], snap.indexes['lg_idx']['index']
+            self.assertIsNot(index['AL'], snap_index['AL'])  # the row left the AL bucket
+            self.assertIn('XX', index)
+            self.assertNotIn('XX', snap_index)
+            self.assertIs(index['NL'], snap_index['NL'])  # untouched buckets are shared
+            self.assertIs(index['FL'], snap_index['FL'])
+
+            # unchanged rows are shared, the updated row is replaced
+            rownum = teams.find_by_template({'teamID': 'BOS', 'yearID': 2004})[0]['rownum']
+            self.assertIsNot(teams.__rows__[rownum], snap.__rows__[rownum])
+            self.assertIs(teams.__rows__[rownum + 1], snap.__rows__[rownum + 1])
+
+    def test_unpinned_write_copies_nothing(self):
+        teams = self.teams
+        rows, primary = teams.__rows__, teams.indexes['PRIMARY']
+        version = teams.__version__
+        teams.update({'teamID': 'BOS', 'yearID': 2004}, {'lgID': 'XX'})
+        self.assertIs(teams.__rows__, rows)
+        self.assertIs(teams.indexes['PRIMARY'], primary)
+        self.assertEqual(teams.__version__, version)
+
+    def test_snapshot_is_read_only(self):
+        with self.teams.snapshot() as snap:
+            with self.assertRaises(DataTableExceptions.DataTableException):
+                snap.insert({'teamID': 'ZZZ', 'yearID': 3000})
+
+    def test_reader_cannot_upgrade(self):
+        teams = self.teams
+        teams.__lock__.acquire_read()
+        try:
+            with self.assertRaises(DataTableExceptions.DataTableException) as raised:
+                teams.update({'teamID': 'BOS', 'yearID': 2004}, {'W': 0})
+            self.assertEqual(raised.exception.code, DataTableExceptions.DataTableException.invalid_operation)
+        finally:
+            teams.__lock__.release_read()
+        self.assertEqual(self.rows(teams, {'teamID': 'BOS', 'yearID': 2004})[0]['W'], 98)
+
+    def test_lock_is_reentrant(self):
+        lock = self.teams.__lock__
+        lock.acquire_write()
+        lock.acquire_write()
+        lock.acquire_read()  # the writer may read
+        lock.release_read()
+        lock.release_write()
+        lock.release_write()
+        lock.acquire_read()
+        lock.acquire_read()
+        lock.release_read()
+        lock.release_read()
+
+    def test_writer_waits_for_readers(self):
+        lock = self.teams.__lock__
+        lock.acquire_read()
+        acquired = threading.Event()
+
+        def write():
+            lock.acquire_write()
+            acquired.set()
+            lock.release_write()
+
+        writer = threading.Thread(target=write)
+        writer.start()
+        self.assertFalse(acquired.wait(0.2))
+        lock.release_read()
+        self.assertTrue(acquired.wait(5))
+        writer.join()
+
+
+class SnapshotIteratorTest(support.TableTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.teams = CSVTable.CSVTable("teams")
+        self.expected = [(r['teamID'], r['yearID'], r['W']) for r in self.teams.find_by_template({'lgID': 'AL'})]
+
+    def write(self):
+        teams = self.teams
+        teams.update({'lgID': 'AL'}, {'W': 0})
+        teams.delete({'teamID': 'BOS'})
+        teams.insert({'teamID': 'ZZZ', 'yearID': 3000, 'lgID': 'AL', 'W': 1, 'name': 'Zed'})
+
+    def test_iterator_reads_rows_from_before_write(self):
+        rows = self.teams.iter_by_template({'lgID': 'AL'})
+        first = [next(rows) for _ in range(10)]
+        self.assertEqual(len(self.teams.__pins__), 1)
+        self.write()
+        result = [(r['teamID'], r['yearID'], r['W']) for r in first + list(rows)]
+        self.assertEqual(result, self.expected)
+        self.assertEqual(self.teams.__pins__, {})  # released when exhausted
+
+    def test_iter_having_reads_rows_from_before_write(self):
+        rows = self.teams.iter_having('lgID = AL', fields=['teamID', 'yearID', 'W'])
+        first = [next(rows) for _ in range(10)]
+        self.write()
+        self.assertEqual([(r['teamID'], r['yearID'], r['W']) for r in first + list(rows)], self.expected)
+        self.assertEqual(self.teams.__pins__, {})
+
+    def test_closed_iterator_releases_pin(self):
+        rows = self.teams.iter_by_template({'lgID': 'AL'})
+        next(rows)
+        rows.close()
+        self.assertEqual(self.teams.__pins__, {})
+        self.assertEqual(list(rows), [])
+
+        rows = self.teams.iter_by_template({'lgID': 'AL'})
+        next(rows)
+        del rows  # garbage collected
+        self.assertEqual(self.teams.__pins__, {})
+
+    def test_unstarted_iterator_pins_when_created(self):
+        rows = self.teams.iter_by_template({'lgID': 'AL'})
+        self.write()
+        self.assertEqual([(r['teamID'], r['yearID'], r['W']) for r in rows], self.expected)
+        self.assertEqual(self.teams.__pins__, {})
+
+    def test_find_page_in_snapshot_reads_rows_from_before_write(self):
+        with self.teams.snapshot() as snap:
+            result, cursor = snap.find_page({'lgID': 'AL'}, page_size=100)
+            self.write()
+            while cursor is not None:
+                page, cursor = snap.find_page({'lgID': 'AL'}, page_size=100, cursor=cursor)
+                result += page
+        self.assertEqual([(r['teamID'], r['yearID'], r['W']) for r in result], self.expected)
+        self.assertEqual(self.teams.__pins__, {})
+
+    def test_find_page_resumes_after_write(self):
+        result, cursor = self.teams.find_page({'lgID': 'AL'}, page_size=100)
+        self.teams.delete({'teamID': 'BOS'})
+        while cursor is not None:
+            page, cursor = self.teams.find_page({'lgID': 'AL'}, page_size=100, cursor=cursor)
+            result += page
+        keys = [(r['teamID'], r['yearID']) for r in result]
+        self.assertEqual(len(keys), len(set(keys)))  # no row twice
+        self.assertEqual(keys, [(r[0], r[1]) for r in self.expected[:100]]
+                         + [(r[0], r[1]) for r in self.expected[100:] if r[0] != 'BOS'])
+
+
+if __name__ == "__main__":
+    unittest.main()
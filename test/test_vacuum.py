@@ -0,0 +1,81 @@
+"""
+Tombstone compaction with vacuum() and autovacuum, checked against the rows kept aside before the deletes.
+"""
+import unittest
+
+import support
+import CSVTable
+
+
+class VacuumTest(support.TableTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.teams = CSVTable.CSVTable("teams")
+        self.teams.autovacuum_threshold = 10 ** 9  # only vacuum when asked, unless a test sets it
+
+    @staticmethod
+    def values(rows):
+        return [{k: v for k, v in r.items() if k != 'rownum'} for r in rows if r is not None]
+
+    def check_compacted(self, expected):
+        rows = self.teams.__rows__
+        self.assertNotIn(None, rows)
+        self.assertEqual([r['rownum'] for r in rows], list(range(len(rows))))
+        self.assertEqual(self.values(rows), expected)
+        self.assertEqual(len(self.teams), len(expected))
+        for name, idx in self.teams.indexes.items():
+            rebuilt = {}
+            for r in rows:
+                rebuilt.setdefault(self.teams.__create_key_template__(r, idx['columns'])[0], []).append(r['rownum'])
+            self.assertEqual(dict(idx['index']), rebuilt, name)
+
+    def test_vacuum(self):
+        keep = lambda r: r['lgID'] != 'NA' and r['W'] != 90
+        expected = self.values(r for r in self.teams.__rows__ if keep(r))
+        self.teams.delete({'lgID': 'NA'})
+        self.teams.delete({'W': 90})
+        removed = len(self.teams.__rows__) - len(expected)
+        self.assertEqual(len(self.teams), len(expected))
+        self.assertEqual(self.teams.__tombstones__, removed)
+
+        self.assertEqual(self.teams.vacuum(), removed)
+        self.check_compacted(expected)
+        self.assertEqual(self.teams.vacuum(), 0)
+        self.assertEqual(self.values(self.teams.find_by_template({'lgID': 'AL'})),
+                         [r for r in expected if r['lgID'] == 'AL'])
+
+    def test_writes_after_vacuum_reach_the_file(self):
+        self.teams.delete({'lgID': 'NA'})
+        self.teams.vacuum()
+        self.teams.update({'teamID': 'BOS'}, {'W': 0})
+        self.teams.delete({'teamID': 'NYA'})
+        self.teams.insert({'teamID': 'ZZZ', 'yearID': 3000, 'lgID': 'AL', 'W': 1, 'name': 'Zed'})
+        expected = self.values(self.teams.__rows__)
+        self.assertEqual(self.values(CSVTable.CSVTable("teams").__rows__), expected)
+
+    def test_autovacuum(self):
+        self.teams.autovacuum_threshold = 10
+        self.teams.autovacuum_scale_factor = 0.0
+        bos = len(self.teams.find_by_template({'teamID': 'BOS'}))
+        self.assertGreater(bos, 10)
+        self.teams.delete({'lgID': 'PL'})  # 8 rows, below the threshold
+        self.assertEqual(self.teams.__tombstones__, 8)
+        self.assertIn(None, self.teams.__rows__)
+
+        expected = self.values(r for r in self.teams.__rows__ if r is not None and r['teamID'] != 'BOS')
+        self.teams.delete({'teamID': 'BOS'})
+        self.assertEqual(self.teams.__tombstones__, 0)
+        self.check_compacted(expected)
+
+    def test_snapshot_reads_rows_from_before_vacuum(self):
+        with self.teams.snapshot() as snap:
+            before = snap.find_by_template({'lgID': 'AL'})
+            self.teams.delete({'lgID': 'NA'})
+            self.teams.vacuum()
+            self.assertEqual(snap.find_by_template({'lgID': 'AL'}), before)
+            self.assertEqual(self.values(self.teams.find_by_template({'lgID': 'AL'})), self.values(before))
+
+
+if __name__ == "__main__":
+    unittest.main()
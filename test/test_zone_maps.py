@@ -0,0 +1,95 @@
+"""
+Zone maps, which let scans skip blocks of rows, checked against a scan of every row.
+"""
+import copy
+import os
+import shutil
+import unittest
+
+import support
+import CSVTable
+from CSVCatalog import ColumnDefinition
+
+
+class SmallBlocks(CSVTable.CSVTable):
+    zone_map_block_size = 100  # Teams.csv is sorted by teamID, so most blocks cover a few teams
+
+
+class ZoneMapTest(support.TableTestCase):
+
+    def setUp(self):
+        super().setUp()
+        seasons_file = os.path.join(self.work_dir, "Seasons.csv")
+        shutil.copy(os.path.join(self.work_dir, "Teams.csv"), seasons_file)
+        self.catalog.create_table("seasons", seasons_file,  # no indexes, so every lookup scans
+                                  [ColumnDefinition('teamID'), ColumnDefinition('yearID', 'number'),
+                                   ColumnDefinition('lgID'), ColumnDefinition('W', 'number')], [])
+        self.teams = SmallBlocks("seasons")
+
+    def scan(self, keep):
+        return [r for r in self.teams.__rows__ if r is not None and keep(r)]
+
+    def covered(self, t=None, conditions=()):
+        ranges = self.teams.__get_zone_ranges__(t, self.teams.__parse_conditions__(conditions, "") if conditions
+                                                 else ())
+        return len(self.teams.__rows__) if ranges is None else sum(end - start for start, end in ranges)
+
+    def zone_files(self, directory):
+        return [f for f in os.listdir(directory) if f.endswith(".zones.json")]
+
+    def test_skipped_blocks_match_scan(self):
+        self.assertEqual(self.teams.find_by_template({'teamID': 'BOS'}), self.scan(lambda r: r['teamID'] == 'BOS'))
+        self.assertLessEqual(self.covered({'teamID': 'BOS'}), 300)
+        self.assertEqual(self.teams.find_by_template({'teamID': ['ALT', 'WS1'], 'yearID': 1884}),
+                         self.scan(lambda r: r['teamID'] in ('ALT', 'WS1') and r['yearID'] == 1884))
+        self.assertEqual(self.teams.having('teamID >= SLN', 'W > 95').__rows__,
+                         self.scan(lambda r: r['teamID'] >= 'SLN' and r['W'] > 95))
+        self.assertLess(self.covered(conditions=('teamID >= SLN',)), len(self.teams.__rows__) // 2)
+        self.assertEqual(list(self.teams.iter_having('teamID < A')), [])
+        self.assertEqual(self.covered(conditions=('teamID < A',)), 0)
+
+    def test_writes_widen_zones(self):
+        self.teams.update({'teamID': 'BOS', 'yearID': 1990}, {'teamID': 'AAA'})
+        self.teams.insert({'teamID': 'AAB', 'yearID': 3000, 'lgID': 'AL', 'W': 1})
+        self.teams.delete({'teamID': 'SLN'})
+        for team in ('AAA', 'AAB', 'BOS', 'SLN', 'WS1'):
+            self.assertEqual(self.teams.find_by_template({'teamID': team}) or [],
+                             self.scan(lambda r: r['teamID'] == team))
+        self.teams.vacuum()
+        self.assertEqual(self.teams.find_by_template({'teamID': 'AAA'}), self.scan(lambda r: r['teamID'] == 'AAA'))
+
+    def test_snapshot_keeps_its_zones(self):
+        with self.teams.snapshot() as snap:
+            zones = copy.deepcopy(snap.__zone_maps__)
+            before = snap.find_by_template({'W': 1000})
+            self.teams.update({'teamID': 'BOS', 'yearID': 1990}, {'W': 1000})
+            self.teams.insert({'teamID': 'ZZZ', 'yearID': 3000, 'lgID': 'AL', 'W': 1000})
+            self.assertEqual(snap.__zone_maps__, zones)
+            self.assertNotEqual(self.teams.__zone_maps__, zones)
+            self.assertEqual(snap.find_by_template({'W': 1000}), before)
+        self.assertEqual(len(self.teams.find_by_template({'W': 1000})), 2)
+
+    def test_kept_in_memory(self):
+        self.teams.insert({'teamID': 'ZZZ', 'yearID': 3000, 'lgID': 'AL', 'W': 1})
+        self.teams.update({'teamID': 'ZZZ'}, {'W': 2})
+        self.teams.vacuum()
+        self.assertEqual(self.zone_files(self.work_dir), [])
+
+    def test_cache_dir(self):
+        cache_dir = os.path.join(self.work_dir, "zones")
+        SmallBlocks.zone_map_cache_dir = cache_dir
+        try:
+            teams = SmallBlocks("seasons")
+            self.assertEqual(len(self.zone_files(cache_dir)), 1)
+            self.assertTrue(SmallBlocks("seasons").__load_zone_maps__())
+            teams.insert({'teamID': 'ZZZ', 'yearID': 3000, 'lgID': 'AL', 'W': 1})
+            reloaded = SmallBlocks("seasons")
+            self.assertEqual(reloaded.__zone_maps__, teams.__zone_maps__)
+            self.assertEqual(reloaded.find_by_template({'yearID': 3000}), teams.find_by_template({'yearID': 3000}))
+        finally:
+            del SmallBlocks.zone_map_cache_dir
+        self.assertEqual(self.zone_files(self.work_dir), [])
+
+
+if __name__ == "__main__":
+    unittest.main()